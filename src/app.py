@@ -1,17 +1,29 @@
+import asyncio
+import json
 import os
 from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict
 
-from fastapi import FastAPI, Query
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
-from dto.request import QueryRequest
-from dto.response import QueryResponse
+from dto.request import BatchQueryRequest, QueryRequest
+from dto.response import BatchQueryResult, QueryResponse, StreamEvent
 from rag.engine import Engine
+from utils.admission import (DEADLINE_HEADER, AdmissionController, AdmittedResponse, ClientDisconnected,
+                             Overloaded, QueueTimeout)
+from utils.api_client import close_clients
 from utils.config import load_config
+from utils.constants import Constants
+from utils.executors import shutdown_executors
 from utils.logger import setup_logger
+from utils.metrics import render
 from utils.middlewares.id_middleware import RequestIDMiddleware
+from utils.middlewares.tracing_middleware import TracingMiddleware
 from utils.timer import timeit
+from utils.tracing import get_tracer
 
 logger = setup_logger()
 
@@ -25,11 +37,42 @@ async def lifespan(server: FastAPI):
     """
     load_config()
     server.state.engine = Engine()
+    server.state.admission = AdmissionController()
     yield
+    await server.state.engine.aclose()
+    shutdown_executors()
+    await close_clients()
+    get_tracer().close()
 
 server = FastAPI(lifespan=lifespan)
+# The last added runs first, the request id is set before the trace starts.
+server.add_middleware(TracingMiddleware)
 server.add_middleware(RequestIDMiddleware)
 
+@server.exception_handler(Overloaded)
+async def handle_overloaded(request: Request, e: Overloaded) -> JSONResponse:
+    return JSONResponse(status_code=429, content={"detail": str(e)},
+                        headers={"Retry-After": str(e.retry_after)})
+
+
+@server.exception_handler(QueueTimeout)
+async def handle_queue_timeout(request: Request, e: QueueTimeout) -> JSONResponse:
+    return JSONResponse(status_code=503, content={"detail": str(e)},
+                        headers={"Retry-After": str(e.retry_after)})
+
+
+async def wait_for_disconnect(request: Request) -> None:
+    """Completes when the client disconnects, once the body of the request has been read.
+
+    Args:
+        request (Request): The incoming request.
+    """
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
 # Mount frontend folder as static files
 frontend_path = os.path.join(os.path.dirname(__file__), "ui")
 server.mount("/static", StaticFiles(directory=frontend_path), name="static")
@@ -45,23 +88,197 @@ def serve_index() -> FileResponse:
     return FileResponse(os.path.join(frontend_path, "index.html"))
 
 
+@server.get("/ready")
+def readiness(response: Response) -> Dict[str, Any]:
+    """Readiness probe, 200 as soon as retrieval is usable and 503 until then. Requests arriving
+    before the language model is loaded wait for it.
+
+    Args:
+        response (Response): The outgoing response, to set the status code.
+
+    Returns:
+        Dict[str, Any]: The loading state and time of each component, and the uptime.
+    """
+    ready, report = server.state.engine.readiness()
+    if not ready:
+        response.status_code = 503
+    return report
+
+
+@server.get("/metrics")
+def metrics() -> PlainTextResponse:
+    """The metrics of the server in the Prometheus text format, labeled by retriever mode and lm.
+
+    Returns:
+        PlainTextResponse: The exposition of the latency histograms, counters and gauges.
+    """
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
+
+
+@server.get("/admission")
+def admission_stats() -> Dict[str, Any]:
+    """The load of the admission control: the requests in flight and waiting, and the recent waits.
+
+    Returns:
+        Dict[str, Any]: The limits, queue depth, counts and wait times of the admission control.
+    """
+    return server.state.admission.stats()
+
+
 @server.post("/ask")
 @timeit
-def handle_query(request: QueryRequest,
-                 limit: int = Query(10, ge=1, le=25,
-                                    description="Max number of abstracts to process for the query")
-                 ) -> QueryResponse:
+async def handle_query(request: QueryRequest,
+                       http_request: Request,
+                       response: Response,
+                       limit: int = Query(10, ge=1, le=25,
+                                          description="Max number of abstracts to process for the query")
+                       ) -> QueryResponse:
     """Endpoint to handle user query for the actual RAG flow.
 
     Args:
         request (QueryRequest): The query from the user to generate content on.
+        http_request (Request): The incoming request, for its deadline header and to watch for
+        the client disconnecting.
+        response (Response): The outgoing response, to report the cache status as the X-Cache header.
         limit (int): The maximum number of abstracts to process, summarise and cite in response.
 
     Returns:
         QueryResponse: The structured response generated by the server.
     """
     logger.info(f"Received request: {request}")
-    response = server.state.engine.generate_response(
-        query=request.query, limit=limit)
+    admission: AdmissionController = server.state.admission
+    deadline = admission.deadline(http_request.headers.get(DEADLINE_HEADER))
+    try:
+        query_response, waited = await admission.run(
+            lambda: server.state.engine.generate_response(
+                query=request.query, limit=limit, params=request.params),
+            deadline, disconnected=lambda: wait_for_disconnect(http_request))
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"Deadline of {deadline:g}s exceeded")
+    except ClientDisconnected:
+        # Nobody is left to read it, nginx's code for a client that closed the request.
+        raise HTTPException(status_code=499, detail="Client closed the request")
+
+    response.headers["X-Cache"] = query_response.cache
+    response.headers["X-Queue-Wait-Ms"] = f"{waited * 1000:.1f}"
+
+    return query_response
+
+
+async def format_sse(events: AsyncIterator[StreamEvent]) -> AsyncIterator[str]:
+    """Encode the stream of engine events as Server-Sent Events frames.
+
+    Args:
+        events (AsyncIterator[StreamEvent]): The events yielded by the engine.
+
+    Yields:
+        AsyncIterator[str]: The SSE frames to be written to the response body.
+    """
+    try:
+        async for event in events:
+            data = json.dumps(jsonable_encoder(event.data))
+            yield f"event: {event.event}\ndata: {data}\n\n"
+    except ClientDisconnected:
+        # Nobody is left to write to.
+        return
+    except asyncio.TimeoutError:
+        # The response has started, the deadline can only be reported as a last event.
+        yield f"event: error\ndata: {json.dumps('Deadline exceeded')}\n\n"
+
+
+@server.post("/ask/stream")
+async def handle_query_stream(request: QueryRequest,
+                              http_request: Request,
+                              limit: int = Query(10, ge=1, le=25,
+                                                 description="Max number of abstracts to process for the query")
+                              ) -> StreamingResponse:
+    """Streaming variant of /ask, sends the retrieved abstracts first and then the summary tokens
+    as they are generated, as Server-Sent Events.
+
+    Args:
+        request (QueryRequest): The query from the user to generate content on.
+        http_request (Request): The incoming request, for its deadline header and to watch for
+        the client disconnecting.
+        limit (int): The maximum number of abstracts to process, summarise and cite in response.
+
+    Returns:
+        StreamingResponse: The text/event-stream response of "abstracts", "token" and "done" events,
+        or a final "error" event if the deadline passes mid-stream.
+    """
+    logger.info(f"Received streaming request: {request}")
+    admission: AdmissionController = server.state.admission
+    deadline = admission.deadline(http_request.headers.get(DEADLINE_HEADER))
+    # Admitted before the response starts, so that rejections still get their status code.
+    events, waited = await admission.run_stream(
+        lambda: server.state.engine.generate_response_stream(
+            query=request.query, limit=limit, params=request.params),
+        deadline, disconnected=lambda: wait_for_disconnect(http_request))
+
+    # Closed once the response is over, releasing the slot of a stream a disconnect kept from starting.
+    return AdmittedResponse(
+        format_sse(events),
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no",
+                 "X-Queue-Wait-Ms": f"{waited * 1000:.1f}"}
+    )
+
+
+async def format_ndjson(results: AsyncIterator[BatchQueryResult]) -> AsyncIterator[str]:
+    """Encode the results of a batch as newline delimited JSON, one line per result.
+
+    Args:
+        results (AsyncIterator[BatchQueryResult]): The results yielded by the engine.
+
+    Yields:
+        AsyncIterator[str]: The JSON lines to be written to the response body.
+    """
+    try:
+        async for result in results:
+            yield json.dumps(jsonable_encoder(result)) + "\n"
+    except ClientDisconnected:
+        return
+    except asyncio.TimeoutError:
+        # The results not sent yet are reported as a final line without an index.
+        yield json.dumps({"error": "Deadline exceeded"}) + "\n"
+
+
+@server.post("/ask/batch")
+async def handle_query_batch(request: BatchQueryRequest,
+                             http_request: Request,
+                             limit: int = Query(10, ge=1, le=25,
+                                                description="Max number of abstracts to process per query")
+                             ) -> StreamingResponse:
+    """Batch variant of /ask for many queries, retrieved and generated together and sent back as
+    newline delimited JSON as each completes. The whole batch holds a single admission slot.
+
+    Args:
+        request (BatchQueryRequest): The queries from the user to generate content on.
+        http_request (Request): The incoming request, for its deadline header and to watch for
+        the client disconnecting.
+        limit (int): The maximum number of abstracts to process, summarise and cite per query.
+
+    Returns:
+        StreamingResponse: The application/x-ndjson response of one result per query, in completion
+        order, each with the index of its query in the request.
+    """
+    max_queries = load_config()[Constants.ADMISSION][Constants.MAX_BATCH_QUERIES]
+    if len(request.requests) > max_queries:
+        raise HTTPException(status_code=413, detail=f"At most {max_queries} queries per batch")
+
+    logger.info(f"Received batch request of {len(request.requests)} queries.")
+    queries = [query_request.query for query_request in request.requests]
+    params = [query_request.params for query_request in request.requests]
+    admission: AdmissionController = server.state.admission
+    deadline = admission.deadline(http_request.headers.get(DEADLINE_HEADER))
+    results, waited = await admission.run_stream(
+        lambda: server.state.engine.generate_response_batch(
+            queries=queries, limit=limit, params=params),
+        deadline, disconnected=lambda: wait_for_disconnect(http_request))
 
-    return response
+    return AdmittedResponse(
+        format_ndjson(results),
+        results,
+        media_type="application/x-ndjson",
+        headers={"X-Queue-Wait-Ms": f"{waited * 1000:.1f}"}
+    )
@@ -1,5 +1,46 @@
-from pydantic import BaseModel
+from typing import Annotated, List, Optional
+
+from pydantic import BaseModel, Field
+
+# The longest stop sequence accepted, the stops are looked for in the last tokens generated.
+MAX_STOP_LENGTH = 32
+
+
+class GenerationParams(BaseModel):
+    # Overrides of the configured generation, each bounded by the server configuration.
+    max_tokens: Optional[int] = Field(default=None, ge=1)
+    temperature: Optional[float] = Field(default=None, ge=0)
+    # Sequences that end the summary, not included in it.
+    stop: Optional[List[Annotated[str, Field(min_length=1, max_length=MAX_STOP_LENGTH)]]] = None
 
 
 class QueryRequest(BaseModel):
     query: str
+    params: Optional[GenerationParams] = None
+
+
+class BatchQueryRequest(BaseModel):
+    requests: List[QueryRequest]
+
+
+class GenerationRequest(BaseModel):
+    prompt: str
+    params: Optional[GenerationParams] = None
+
+
+class BatchGenerationRequest(BaseModel):
+    prompts: List[str]
+    max_new_tokens: Optional[int] = None
+    params: Optional[List[GenerationParams]] = None
+    # Set by the clients that may cancel prompts of the batch, the id they cancel them with.
+    id: Optional[str] = None
+
+
+class CancelRequest(BaseModel):
+    # The id of the batch and the positions of the prompts whose callers gave up.
+    id: str
+    rows: List[int]
+
+
+class PrefixRequest(BaseModel):
+    prefix: str
@@ -1,6 +1,6 @@
-from typing import List
+from typing import Any, Dict, List, Optional, Union
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class Abstract(BaseModel):
@@ -17,3 +17,35 @@ class Abstract(BaseModel):
 class QueryResponse(BaseModel):
     summary: str
     abstracts: List[Abstract]
+    # Whether the response was served from the cache, sent as a header and not in the body.
+    cache: str = Field(default="MISS", exclude=True)
+
+
+class BatchQueryResult(BaseModel):
+    # The position of the query in the batch request, as results are sent in completion order.
+    index: int
+    query: str
+    response: Optional[QueryResponse] = None
+    error: Optional[str] = None
+
+
+class StreamEvent(BaseModel):
+    event: str
+    data: Union[List[Abstract], str]
+
+
+class BatchGenerationResponse(BaseModel):
+    completions: List[str]
+
+
+class ModelInfo(BaseModel):
+    model_id: str
+    is_mock: bool
+    replicas: int
+    max_tokens: int
+    context_window: Optional[int]
+
+
+class PoolHealth(BaseModel):
+    workers: List[Dict[str, Any]]
+    restarts: int
@@ -0,0 +1,139 @@
+"""The inference server, running the language model in a pool of worker processes on its own, so
+that the web workers configured with the remote inference mode share the same model replicas.
+
+Run from the src/ directory:
+    uvicorn inference_server:server --host 127.0.0.1 --port 8700
+"""
+import json
+import threading
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from dto.request import BatchGenerationRequest, CancelRequest, GenerationRequest, PrefixRequest
+from dto.response import BatchGenerationResponse, ModelInfo, PoolHealth
+from models.worker_pool import InferencePool
+from utils.config import load_config
+from utils.executors import get_inference_executor, run_in_executor, shutdown_executors
+from utils.logger import setup_logger
+from utils.middlewares.id_middleware import RequestIDMiddleware
+
+logger = setup_logger()
+
+# The cancellation events of the prompts of the batches in flight, by the id their client gave them.
+cancels: Dict[str, List[threading.Event]] = {}
+
+
+@asynccontextmanager
+async def lifespan(server: FastAPI):
+    """Start the worker pool before listening for requests, and stop it on shutdown.
+
+    Args:
+        server (FastAPI): The instance of FastAPI.
+    """
+    load_config()
+    server.state.pool = InferencePool()
+    yield
+    server.state.pool.close()
+    shutdown_executors()
+
+server = FastAPI(lifespan=lifespan)
+server.add_middleware(RequestIDMiddleware)
+
+
+@server.get("/health")
+def health() -> PoolHealth:
+    """The state of each worker of the pool.
+
+    Returns:
+        PoolHealth: The workers and the number of restarts so far.
+    """
+    pool: InferencePool = server.state.pool
+    return PoolHealth(workers=pool.health(), restarts=pool.restarts)
+
+
+@server.get("/info")
+def info() -> ModelInfo:
+    """The model served, for the clients to load the same tokenizer and limits.
+
+    Returns:
+        ModelInfo: The model and its limits.
+    """
+    pool: InferencePool = server.state.pool
+    return ModelInfo(
+        model_id=pool.lang_model.model_id,
+        is_mock=pool.is_mock,
+        replicas=pool.replicas,
+        max_tokens=pool.max_tokens,
+        context_window=pool.context_window
+    )
+
+
+@server.post("/prefix")
+def cache_prefix(request: PrefixRequest) -> None:
+    """Have the workers cache the key values of a static prompt prefix.
+
+    Args:
+        request (PrefixRequest): The prefix to cache.
+    """
+    server.state.pool.cache_prefix(request.prefix)
+
+
+@server.post("/generate")
+async def generate(request: BatchGenerationRequest) -> BatchGenerationResponse:
+    """Generate the completions of a batch of prompts on the least loaded worker.
+
+    Args:
+        request (BatchGenerationRequest): The batch of full prompts.
+
+    Returns:
+        BatchGenerationResponse: The completions, in the same order as the prompts.
+    """
+    events = [threading.Event() for _ in request.prompts]
+    if request.id:
+        cancels[request.id] = events
+    try:
+        completions = await run_in_executor(
+            get_inference_executor(), server.state.pool.generate_batch, request.prompts,
+            request.max_new_tokens, request.params, events if request.id else None)
+    finally:
+        if request.id:
+            cancels.pop(request.id, None)
+    return BatchGenerationResponse(completions=completions)
+
+
+@server.post("/cancel")
+def cancel(request: CancelRequest) -> None:
+    """Cut short prompts of a batch in flight, whose callers gave up. Batches already finished are
+    left as is.
+
+    Args:
+        request (CancelRequest): The id of the batch and the positions of its prompts to cancel.
+    """
+    events = cancels.get(request.id, [])
+    for row in request.rows:
+        if 0 <= row < len(events):
+            events[row].set()
+
+
+async def format_ndjson(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    async for chunk in chunks:
+        yield json.dumps({"text": chunk}) + "\n"
+
+
+@server.post("/generate/stream")
+async def generate_stream(request: GenerationRequest) -> StreamingResponse:
+    """Stream the completion of a prompt as it is generated.
+
+    Args:
+        request (GenerationRequest): The full prompt.
+
+    Returns:
+        StreamingResponse: The chunks of the completion as JSON lines of {"text": chunk}.
+    """
+    return StreamingResponse(
+        format_ndjson(server.state.pool.generate_stream(request.prompt, request.params)),
+        media_type="application/x-ndjson"
+    )
@@ -0,0 +1,26 @@
+"""Forwarding the cancellation of the prompts of a batch generated in another process, by the
+inference workers or the inference server, whose callers give up through threading events.
+"""
+import threading
+from typing import Callable, List
+
+# How often the events of a batch running elsewhere are checked.
+CANCEL_POLL_SECONDS = 0.05
+
+
+def watch_cancels(cancels: List[threading.Event], finished: Callable[[float], bool],
+                  cancel: Callable[[List[int]], None]) -> None:
+    """Forward the newly cancelled prompts of a batch until it finishes or all are cancelled.
+
+    Args:
+        cancels (List[threading.Event]): The event of each prompt of the batch.
+        finished (Callable[[float], bool]): Waits up to the given seconds for the batch, returning
+        True once it has finished.
+        cancel (Callable[[List[int]], None]): Cancels the prompts of the batch at the given positions.
+    """
+    sent: List[int] = []
+    while len(sent) < len(cancels) and not finished(CANCEL_POLL_SECONDS):
+        rows = [row for row, event in enumerate(cancels) if event.is_set() and row not in sent]
+        if rows:
+            sent.extend(rows)
+            cancel(rows)
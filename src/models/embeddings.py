@@ -0,0 +1,197 @@
+import os
+from functools import cached_property, lru_cache
+from typing import Any, List, Tuple
+
+import numpy as np
+from chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2 import ONNXMiniLM_L6_V2
+
+from utils.config import load_config
+from utils.constants import Constants
+from utils.logger import setup_logger
+from utils.metrics import EMBEDDING_SECONDS
+
+logger = setup_logger()
+
+EMBEDDING_MODEL = None
+
+# The model of the default backend, the one the collections were built with.
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
+
+# The private members of chromadb's ONNXMiniLM_L6_V2 that MiniLMEmbedding relies on. They are stable
+# for the chromadb version pinned in requirements.txt; should an upgrade drop any of them, the
+# embeddings fall back to the public __call__, the same embeddings without the batching set here.
+CHROMA_PRIVATE_MEMBERS = ("_forward", "_download_model_if_not_exists", "_normalize", "_preferred_providers",
+                          "DOWNLOAD_PATH", "EXTRACTED_FOLDER_NAME")
+
+
+class MiniLMEmbedding(ONNXMiniLM_L6_V2):
+    """Chroma's bundled ONNX all-MiniLM-L6-v2, producing the same embeddings as the collections'
+    default, but padding each batch to its longest document instead of always to 256 tokens,
+    tokenizing the batch at once and with a configurable number of threads.
+    """
+
+    def __init__(self, threads: int = 0) -> None:
+        super().__init__(preferred_providers=["CPUExecutionProvider"])
+        self.threads = threads
+        missing = [name for name in CHROMA_PRIVATE_MEMBERS if not hasattr(self, name)]
+        self.fast = not missing
+        if missing:
+            logger.warning(
+                f"chromadb no longer has {', '.join(missing)}, embedding through its public API instead.")
+
+    def embed(self, documents: List[str], batch_size: int) -> np.ndarray:
+        """Embed the documents in batches, padded to their longest document when the private
+        members of the pinned chromadb are available.
+
+        Args:
+            documents (List[str]): The documents to embed.
+            batch_size (int): The number of documents per forward pass.
+
+        Returns:
+            np.ndarray: The normalized embeddings, in the same order as the documents.
+        """
+        if self.fast:
+            return self._forward(documents, batch_size=batch_size)
+        return np.concatenate([np.asarray(self(documents[i:i + batch_size]), dtype=np.float32)
+                               for i in range(0, len(documents), batch_size)])
+
+    @cached_property
+    def tokenizer(self) -> Any:
+        tokenizer = super().tokenizer
+        tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+        return tokenizer
+
+    @cached_property
+    def model(self) -> Any:
+        if not self.fast:
+            return super().model
+
+        so = self.ort.SessionOptions()
+        so.log_severity_level = 3
+        so.graph_optimization_level = self.ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads:
+            so.intra_op_num_threads = self.threads
+
+        return self.ort.InferenceSession(
+            os.path.join(self.DOWNLOAD_PATH, self.EXTRACTED_FOLDER_NAME, "model.onnx"),
+            providers=self._preferred_providers,
+            sess_options=so,
+        )
+
+    def _forward(self, documents: List[str], batch_size: int = 32) -> np.ndarray:
+        # Only download the model when it is actually used
+        self._download_model_if_not_exists()
+
+        all_embeddings = []
+        for i in range(0, len(documents), batch_size):
+            encoded = self.tokenizer.encode_batch(documents[i:i + batch_size])
+            input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+
+            last_hidden_state = self.model.run(None, {
+                "input_ids": input_ids,
+                "attention_mask": attention_mask,
+                "token_type_ids": np.zeros_like(input_ids),
+            })[0]
+
+            # Mean pooling over the non padded tokens
+            mask = attention_mask[..., np.newaxis].astype(np.float32)
+            embeddings = (last_hidden_state * mask).sum(1) / np.clip(mask.sum(1), 1e-9, None)
+            all_embeddings.append(self._normalize(embeddings).astype(np.float32))
+
+        return np.concatenate(all_embeddings)
+
+
+class EmbeddingModel:
+    """The embedding layer shared by the vector store queries, the save path and the ingestion,
+    with the model, runtime and batching set in the configuration and an LRU cache of the query
+    embeddings.
+    """
+
+    def __init__(self) -> None:
+        emb_config = load_config()[Constants.EMBEDDINGS]
+        self.backend = emb_config[Constants.BACKEND].lower()
+        self.model_name = emb_config[Constants.MODEL]
+        self.batch_size = emb_config[Constants.BATCH_SIZE]
+        threads = emb_config[Constants.THREADS]
+
+        if self.backend == "sentence-transformers":
+            # Optional dependency, only needed for this backend.
+            from sentence_transformers import SentenceTransformer
+
+            runtime = emb_config[Constants.RUNTIME]
+            model_kwargs = {}
+            if runtime == "onnx" and emb_config[Constants.ONNX_FILE]:
+                model_kwargs["file_name"] = emb_config[Constants.ONNX_FILE]
+            if runtime == "torch" and threads:
+                import torch
+                torch.set_num_threads(threads)
+
+            self.model = SentenceTransformer(
+                self.model_name,
+                device=emb_config[Constants.DEVICE],
+                backend=runtime,
+                model_kwargs=model_kwargs or None
+            )
+        else:
+            if self.backend != "default":
+                logger.warning(
+                    f"Unknown embedding backend '{self.backend}', falling back to default")
+                self.backend = "default"
+            if self.model_name.split("/")[-1] != DEFAULT_MODEL:
+                logger.warning(
+                    f"The default embedding backend always runs {DEFAULT_MODEL}, ignoring the configured "
+                    f"model '{self.model_name}', which needs the sentence-transformers backend.")
+            self.model_name = DEFAULT_MODEL
+            self.model = MiniLMEmbedding(threads=threads)
+
+        self.cached_query = lru_cache(maxsize=emb_config[Constants.CACHE_SIZE])(self.embed_one)
+        logger.info(f"Created '{self.backend}' embedding model '{self.model_name}'.")
+
+    def embed_documents(self, documents: List[str]) -> List[List[float]]:
+        """Embed the documents in batches of the configured size.
+
+        Args:
+            documents (List[str]): The documents to embed.
+
+        Returns:
+            List[List[float]]: The normalized embeddings, in the same order as the documents.
+        """
+        if not documents:
+            return []
+
+        with EMBEDDING_SECONDS.time():
+            if self.backend == "sentence-transformers":
+                embeddings = self.model.encode(
+                    documents, batch_size=self.batch_size, normalize_embeddings=True)
+            else:
+                embeddings = self.model.embed(documents, batch_size=self.batch_size)
+
+        return np.asarray(embeddings, dtype=np.float32).tolist()
+
+    def embed_one(self, query: str) -> Tuple[float, ...]:
+        return tuple(self.embed_documents([query])[0])
+
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a query, repeated queries are served from the LRU cache.
+
+        Args:
+            query (str): The query to embed.
+
+        Returns:
+            List[float]: The normalized embedding of the query.
+        """
+        return list(self.cached_query(query))
+
+
+def get_embedding_model() -> EmbeddingModel:
+    """Returns the shared embedding model.
+
+    Returns:
+        EmbeddingModel: The embedding model configured under embeddings.
+    """
+    global EMBEDDING_MODEL
+    if EMBEDDING_MODEL is None:
+        EMBEDDING_MODEL = EmbeddingModel()
+
+    return EMBEDDING_MODEL
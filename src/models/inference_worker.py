@@ -0,0 +1,114 @@
+"""The entry point of the inference worker processes of the InferencePool, kept apart from the pool
+so that the workers set the configuration of the pool before loading anything else.
+"""
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import utils.config
+
+# The operations sent to the workers.
+GENERATE = "generate"
+STREAM = "stream"
+PREFIX = "prefix"
+PING = "ping"
+# Cancels prompts of a request, given the id of the request and the positions of its prompts, all
+# of them when None.
+CANCEL = "cancel"
+
+# The messages sent back, each along with the id of the request it answers. A pong carries the
+# seconds the worker has been busy on its current request, None when idle.
+READY = "ready"
+RESULT = "result"
+CHUNK = "chunk"
+END = "end"
+ERROR = "error"
+PONG = "pong"
+
+
+def worker_main(conn, config: dict) -> None:
+    """Receive the language model, then serve the requests of the pool one at a time, while the
+    health checks and cancellations are handled as they arrive. The health checks are answered
+    with how long the current request has been running, so that a stuck generation is caught.
+
+    Args:
+        conn (Connection): The worker's end of the pipe to the pool.
+        config (dict): The configuration of the pool.
+    """
+    utils.config.CONFIG = config
+    from models.lm import LanguageModel
+
+    # The pool sends its model when the weights can be shared, else the worker loads its own.
+    lang_model = conn.recv() or LanguageModel()
+
+    send_lock = threading.Lock()
+    requests: "queue.Queue[Optional[Tuple[int, str, Any]]]" = queue.Queue()
+    # The cancellation events of the prompts of each queued or running generation.
+    cancels: Dict[int, List[threading.Event]] = {}
+    # When the current request started, None while idle.
+    busy_since: List[Optional[float]] = [None]
+
+    def send(request_id: Optional[int], kind: str, payload: Any) -> None:
+        with send_lock:
+            conn.send((request_id, kind, payload))
+
+    def work() -> None:
+        while True:
+            request = requests.get()
+            if request is None:
+                return
+
+            request_id, op, payload = request
+            events = cancels.get(request_id, [])
+            busy_since[0] = time.monotonic()
+            try:
+                if op == GENERATE and all(event.is_set() for event in events):
+                    # Every caller gave up while the request was queued.
+                    send(request_id, RESULT, [""] * len(events))
+                elif op == GENERATE:
+                    send(request_id, RESULT, lang_model.generate_batch(*payload, cancels=events))
+                elif op == STREAM:
+                    for chunk in lang_model.iter_stream(*payload, cancel=events[0]):
+                        send(request_id, CHUNK, chunk)
+                    send(request_id, END, None)
+                elif op == PREFIX:
+                    lang_model.cache_prefix(payload)
+                    send(request_id, RESULT, None)
+            except Exception as e:
+                send(request_id, ERROR, f"{type(e).__name__}: {e}")
+            finally:
+                busy_since[0] = None
+                cancels.pop(request_id, None)
+
+    worker = threading.Thread(target=work, name="inference-work", daemon=True)
+    worker.start()
+    send(None, READY, os.getpid())
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+
+        request_id, op, payload = message
+        if op == PING:
+            started = busy_since[0]
+            send(request_id, PONG, None if started is None else time.monotonic() - started)
+        elif op == CANCEL:
+            target, rows = payload
+            events = cancels.get(target, [])
+            for row in range(len(events)) if rows is None else rows:
+                events[row].set()
+        else:
+            if op == GENERATE:
+                cancels[request_id] = [threading.Event() for _ in payload[0]]
+            elif op == STREAM:
+                cancels[request_id] = [threading.Event()]
+            requests.put(message)
+
+    requests.put(None)
+    worker.join()
@@ -1,16 +1,150 @@
-from typing import cast
+import asyncio
+import functools
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, cast
 
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from transformers.pipelines import pipeline
+from transformers import (AsyncTextIteratorStreamer, AutoModelForCausalLM, AutoTokenizer, DynamicCache,
+                          LogitsProcessor, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList,
+                          TextIteratorStreamer)
 
+from dto.request import MAX_STOP_LENGTH, GenerationParams
+from models.stopping import StopFilter, find_stop, trim
 from utils.config import load_config
 from utils.constants import Constants
+from utils.executors import get_inference_executor, run_in_executor
 from utils.logger import setup_logger
+from utils.metrics import DECODE_SECONDS, DRAFT_ACCEPTANCE, PREFILL_SECONDS, TOKENS_PER_SECOND
+from utils.readiness import TOKENIZER, get_readiness
+from utils.tracing import get_tracer
 
 logger = setup_logger()
 config = load_config()
 
+# The HF ids of the model keys, other values of the draft are taken as HF ids.
+MODEL_IDS = {
+    "mistral": "mistralai/Mistral-7B-Instruct-v0.1",
+    "phi": "microsoft/phi-2",
+    "gpt2": "openai-community/gpt2",
+    "distilgpt2": "distilbert/distilgpt2",
+}
+
+# The forward pass counts of the assisted generation running in each thread.
+assisted_counts = threading.local()
+
+
+class FirstTokenTimer(LogitsProcessor):
+    """Leaves the scores untouched, only noting when the logits of the first token are ready, that
+    is when the prefill of the batch completed.
+    """
+
+    def __init__(self) -> None:
+        self.first_token: Optional[float] = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        return scores
+
+
+class RowTemperature(LogitsProcessor):
+    """Scales the scores of each sequence of the batch by its own temperature, for batches of
+    requests sampling at different temperatures. A temperature of 0 is near greedy.
+    """
+
+    def __init__(self, temperatures: List[float]) -> None:
+        self.temperatures = torch.tensor([max(t, 1e-4) for t in temperatures]).unsqueeze(1)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        return scores / self.temperatures.to(scores.device, scores.dtype)
+
+
+class SummaryStop(StoppingCriteria):
+    """Ends each sequence of the batch once it has used its own token budget, or once its last
+    tokens contain a stop of the summary, rather than decoding the whole batch up to max_tokens.
+    """
+
+    def __init__(self, tokenizer: Any, prompt_length: int, budgets: List[int],
+                 stops: List[List[str]]) -> None:
+        """
+        Args:
+            tokenizer (Any): The tokenizer to decode the last tokens with.
+            prompt_length (int): The number of prompt tokens, the padded prompts all end there.
+            budgets (List[int]): The maximum number of tokens of each sequence.
+            stops (List[List[str]]): The stop sequences of each sequence.
+        """
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.budgets = budgets
+        self.stops = stops
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs: Any) -> torch.BoolTensor:
+        generated = input_ids.shape[1] - self.prompt_length
+        # A token is at least a character, the window covers the longest stop.
+        window = input_ids[:, max(self.prompt_length, input_ids.shape[1] - MAX_STOP_LENGTH):]
+        texts = self.tokenizer.batch_decode(window, skip_special_tokens=True)
+        done = [generated >= budget or find_stop(text, stops) is not None
+                for text, budget, stops in zip(texts, self.budgets, self.stops)]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class Cancelled(StoppingCriteria):
+    """Ends each sequence of the batch once its caller gave up on it, the client having left or its
+    deadline having passed, so that the batch stops as soon as none of its callers is left.
+    """
+
+    def __init__(self, cancels: List[threading.Event]) -> None:
+        """
+        Args:
+            cancels (List[threading.Event]): The event of each sequence, set to cancel it.
+        """
+        self.cancels = cancels
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs: Any) -> torch.BoolTensor:
+        return torch.tensor([cancel.is_set() for cancel in self.cancels], dtype=torch.bool, device=input_ids.device)
+
+
+class AssistedCounts:
+    """The forward passes of the main and draft models during an assisted generation, from which
+    the share of the draft tokens accepted by the main model is derived.
+    """
+
+    def __init__(self) -> None:
+        self.target = 0
+        self.draft = 0
+        self.first_token: Optional[float] = None
+
+    def acceptance(self, tokens: int) -> Optional[float]:
+        """The fraction of the proposed draft tokens that were accepted.
+
+        Every pass of the main model verifies the draft tokens proposed since the previous one,
+        one draft pass each, and adds one token of its own after the accepted ones.
+
+        Args:
+            tokens (int): The number of tokens generated.
+
+        Returns:
+            Optional[float]: The acceptance rate, None if no draft token was proposed.
+        """
+        if not self.draft:
+            return None
+        return min(1.0, max(0.0, (tokens - self.target) / self.draft))
+
+
+def count_forward(role: str, module: Any, args: Any, output: Any) -> None:
+    """Forward hook counting the passes of the model in the assisted generation of the thread.
+    """
+    counts: Optional[AssistedCounts] = getattr(assisted_counts, "current", None)
+    if counts is None:
+        return
+    if role == "target":
+        counts.target += 1
+        if counts.first_token is None:
+            counts.first_token = time.perf_counter()
+    else:
+        counts.draft += 1
+
 
 class LanguageModel:
     """Class to create an instance of the configured language model and run inference based
@@ -25,20 +159,31 @@ class LanguageModel:
         hf_key = None
 
         self.is_mock = False
+        # The number of batches that can run at the same time, one in process.
+        self.replicas = 1
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        # The maximum number of prompt and output tokens of the model, None if unbounded or unknown.
+        self.context_window: Optional[int] = None
+        # The token ids and past key values of the static prompt prefixes, by prefix text.
+        self.use_prefix_cache = gen_config[Constants.PREFIX_CACHE]
+        self.prefix_caches: Dict[str, Tuple[torch.Tensor, tuple]] = {}
+
+        # The small model proposing the tokens verified by the main one, None without assistance.
+        self.draft_model: Optional[Any] = None
+        self.draft_tokenizer: Optional[Any] = None
 
         if model_key == "mistral":
-            model_id = "mistralai/Mistral-7B-Instruct-v0.1"
             hf_key = gen_config[Constants.HF_KEY]
-        elif model_key == "phi":
-            model_id = "microsoft/phi-2"
-        elif model_key == "gpt2":
-            model_id = "openai-community/gpt2"
-        elif model_key == "mock":
+        if model_key == "mock":
             model_id = "mock"
+        elif model_key in MODEL_IDS:
+            model_id = MODEL_IDS[model_key]
         else:
-            model_id = "openai-community/gpt2"
+            model_id = MODEL_IDS["gpt2"]
             logger.warning(f"Unknown LM '{model_key}', falling back to gpt2")
 
+        self.model_id = model_id
         if model_key == "mock":
             self.is_mock = True
             # Hardcoded summary for mock mode
@@ -47,35 +192,516 @@ class LanguageModel:
                 "in sequence tasks [UT]. We can use different algorithms that involve transforms to solve "
                 "a reinforcement problem. [TR]."
             )
+            # Simulated decoding latency, a word of the summary standing for a token.
+            self.mock_token_seconds = gen_config.get(Constants.MOCK_TOKEN_MS, 0) / 1000
             logger.info("Mock model selected: returning hardcoded summary")
             return
 
         logger.info(f"Loading LM model '{model_id}'")
-        self.tokenizer = AutoTokenizer.from_pretrained(model_id, token=hf_key)
-        self.model = AutoModelForCausalLM.from_pretrained(
+        with get_readiness().loading(TOKENIZER):
+            self.tokenizer = AutoTokenizer.from_pretrained(model_id, token=hf_key)
+        self.model = self.load_model(model_id, hf_key, gen_config)
+        # Batched prompts are left padded so that the completions start at the same position.
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        # Tokenizers without a limit report a very large sentinel value instead.
+        if self.tokenizer.model_max_length < 1_000_000:
+            self.context_window = self.tokenizer.model_max_length
+
+        draft_key = (gen_config.get(Constants.DRAFT) or "").strip()
+        if draft_key:
+            self.load_draft(MODEL_IDS.get(draft_key.lower(), draft_key), hf_key, gen_config)
+
+    def load_draft(self, draft_id: str, hf_key: Optional[str], gen_config: dict) -> None:
+        """Load the draft model of the assisted generation, in the same inference mode as the main
+        model. A draft with another vocabulary is given its own tokenizer, its proposals are then
+        translated through the text.
+
+        Args:
+            draft_id (str): The HF id of the draft model.
+            hf_key (Optional[str]): The HF key, for the models with restricted access.
+            gen_config (dict): The generator section of the configuration.
+        """
+        logger.info(f"Loading draft model '{draft_id}' for assisted generation")
+        self.draft_model = self.load_model(draft_id, hf_key, gen_config)
+        # The number of proposed tokens grows while they are all accepted and shrinks otherwise.
+        self.draft_model.generation_config.num_assistant_tokens = gen_config[Constants.DRAFT_TOKENS]
+        self.draft_model.generation_config.num_assistant_tokens_schedule = "heuristic"
+
+        if (self.draft_model.config.get_text_config().vocab_size
+                != self.model.config.get_text_config().vocab_size):
+            self.draft_tokenizer = AutoTokenizer.from_pretrained(draft_id, token=hf_key)
+            logger.info(f"The draft '{draft_id}' has another tokenizer, using universal assisted decoding.")
+
+        self.model.register_forward_hook(functools.partial(count_forward, "target"))
+        self.draft_model.register_forward_hook(functools.partial(count_forward, "draft"))
+
+    def load_model(self, model_id: str, hf_key: Optional[str], gen_config: dict) -> Any:
+        """Load the model in the configured CPU inference mode.
+
+        Args:
+            model_id (str): The HF id of the model.
+            hf_key (Optional[str]): The HF key, for the models with restricted access.
+            gen_config (dict): The generator section of the configuration.
+
+        Returns:
+            Any: The model, quantized or compiled as configured.
+        """
+        threads = gen_config[Constants.THREADS]
+        dtype = gen_config[Constants.DTYPE].lower()
+        quantize = gen_config[Constants.QUANTIZE].lower()
+
+        if threads:
+            torch.set_num_threads(threads)
+
+        if quantize == "int8" and dtype != "float32":
+            logger.warning(
+                f"Dynamic int8 quantization needs float32 weights, ignoring dtype '{dtype}'.")
+            dtype = "float32"
+
+        model = AutoModelForCausalLM.from_pretrained(
             model_id,
-            device_map="auto"
-        )
-        # Create a text-generation pipeline
-        self.generator = pipeline(
-            "text-generation",
-            model=self.model,
-            tokenizer=self.tokenizer,
-            max_new_tokens=max_tokens,
-            do_sample=True,
-            temperature=temperature
+            token=hf_key,
+            torch_dtype=torch.bfloat16 if dtype == "bfloat16" else torch.float32,
+            # Dynamic quantization only runs on the CPU.
+            device_map="cpu" if quantize == "int8" else "auto"
         )
 
-    def generate(self, prompt: str) -> str:
+        if quantize == "int8":
+            # Weights of the linear layers stored as int8, activations quantized on the fly.
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif quantize != "none":
+            logger.warning(f"Unknown quantization '{quantize}', loading without it.")
+
+        if gen_config[Constants.COMPILE]:
+            # Compiled lazily on the first forward pass, dynamic to avoid recompiling per length.
+            model.forward = torch.compile(model.forward, dynamic=True)
+
+        logger.info(
+            f"Loaded '{model_id}' as {dtype}, quantization {quantize}, "
+            f"{torch.get_num_threads()} threads, compiled {gen_config[Constants.COMPILE]}.")
+        return model
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """Count the tokens of each text with the model's tokenizer.
+
+        Args:
+            texts (List[str]): The texts to measure.
+
+        Returns:
+            List[int]: The number of tokens of each text, words are counted in mock mode.
+        """
         if self.is_mock:
-            return self.mock_summary
+            return [len(text.split()) for text in texts]
+        if not texts:
+            return []
+
+        encoded = self.tokenizer(texts, add_special_tokens=False)["input_ids"]
+        return [len(ids) for ids in encoded]
+
+    def cache_prefix(self, prefix: str) -> None:
+        """Run the prefill of a static prompt prefix once and keep its past key values, reused by
+        every prompt starting with it.
+
+        Args:
+            prefix (str): The static start of the prompts, e.g. the template up to its first field.
+        """
+        if self.is_mock or not self.use_prefix_cache or not prefix or prefix in self.prefix_caches:
+            return
+
+        prefix_ids = self.tokenizer(prefix, return_tensors="pt")["input_ids"].to(self.model.device)
+        with torch.inference_mode():
+            past = self.model(input_ids=prefix_ids, use_cache=True).past_key_values
+        if isinstance(past, DynamicCache):
+            past = past.to_legacy_cache()
 
-        outputs = self.generator(prompt)
-        if isinstance(outputs, list) and "generated_text" in outputs[0]:
-            generated = str(outputs[0]["generated_text"])
-            response = generated[len(prompt):].strip()
-            return response
+        self.prefix_caches[prefix] = (prefix_ids, past)
+        logger.info(f"Cached the key values of a {prefix_ids.shape[1]} token prompt prefix.")
+
+    def prepare_inputs(self, prompts: List[str], use_prefix_cache: bool = True) -> dict:
+        """Tokenize the prompts for generate, starting from the cached prefix they share if any.
+
+        With a cached prefix the prompts are laid out as the prefix, then the left padding, then
+        the rest of each prompt, so the prefix keeps the positions it was cached at. The position
+        ids follow the attention mask, so the padding in between does not shift the rest.
+
+        Args:
+            prompts (List[str]): The full prompts.
+            use_prefix_cache (bool): Whether to start from a cached prefix, the draft model of the
+            assisted generation has no key values of it.
+
+        Returns:
+            dict: The input_ids, attention_mask and, with a cached prefix, past_key_values.
+        """
+        prefix = next((p for p in self.prefix_caches if use_prefix_cache and all(
+            prompt.startswith(p) for prompt in prompts)), None)
+        if prefix is None:
+            return self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.model.device)
+
+        prefix_ids, past = self.prefix_caches[prefix]
+        suffixes = self.tokenizer([prompt[len(prefix):] for prompt in prompts], return_tensors="pt",
+                                  padding=True, add_special_tokens=False).to(self.model.device)
+        batch_size = len(prompts)
+
+        # Broadcast views of the cached tensors, the cache only ever concatenates new key values.
+        cache = DynamicCache.from_legacy_cache(tuple(
+            (key.expand(batch_size, -1, -1, -1), value.expand(batch_size, -1, -1, -1))
+            for key, value in past))
+
+        return {
+            "input_ids": torch.cat([prefix_ids.expand(batch_size, -1), suffixes["input_ids"]], dim=1),
+            "attention_mask": torch.cat(
+                [torch.ones_like(prefix_ids).expand(batch_size, -1), suffixes["attention_mask"]], dim=1),
+            "past_key_values": cache
+        }
+
+    def assisted(self, prompts: List[str]) -> Optional[AssistedCounts]:
+        """Whether to generate the prompts with the draft model, which only assists single prompts.
+        Batches are generated without it, batching already sharing the decode steps.
+
+        Args:
+            prompts (List[str]): The prompts of the generation.
+
+        Returns:
+            Optional[AssistedCounts]: The counts to track the assisted generation with, None without.
+        """
+        if self.draft_model is None or len(prompts) != 1:
+            return None
+        return AssistedCounts()
+
+    def run_generate(self, counts: Optional[AssistedCounts], **kwargs: Any) -> torch.Tensor:
+        """Run the generation of the model in the current thread, assisted by the draft model
+        when counts are given.
+
+        Args:
+            counts (Optional[AssistedCounts]): The counts of the assisted generation, None without.
+            kwargs (Any): The arguments of generate.
+
+        Returns:
+            torch.Tensor: The prompt and generated token ids.
+        """
+        if counts is None:
+            return self.model.generate(**kwargs)
+
+        if self.draft_tokenizer is not None:
+            kwargs.update(tokenizer=self.tokenizer, assistant_tokenizer=self.draft_tokenizer)
+        assisted_counts.current = counts
+        try:
+            return self.model.generate(assistant_model=self.draft_model, **kwargs)
+        finally:
+            assisted_counts.current = None
+
+    def settings(self, count: int, max_new_tokens: Optional[int] = None,
+                 params: Optional[List[GenerationParams]] = None
+                 ) -> Tuple[List[int], List[float], List[List[str]]]:
+        """The token budget, temperature and stop sequences of each prompt, the configured ones
+        unless the parameters of the prompt set them.
+
+        Args:
+            count (int): The number of prompts.
+            max_new_tokens (Optional[int]): A cap on the budget of every prompt.
+            params (Optional[List[GenerationParams]]): The parameters of each prompt.
+
+        Returns:
+            Tuple[List[int], List[float], List[List[str]]]: The budgets, temperatures and stops.
+        """
+        params = params or [GenerationParams()] * count
+        cap = min(max_new_tokens or self.max_tokens, self.max_tokens)
+        budgets = [min(p.max_tokens or cap, cap) for p in params]
+        temperatures = [self.temperature if p.temperature is None else p.temperature for p in params]
+        stops = [p.stop or [] for p in params]
+        return budgets, temperatures, stops
+
+    def generation_kwargs(self, inputs: dict, budgets: List[int], temperatures: List[float],
+                          stops: List[List[str]], timer: FirstTokenTimer,
+                          cancels: Optional[List[threading.Event]] = None) -> dict:
+        """The arguments of generate for a batch, each prompt stopping at its own budget or stops,
+        or once cancelled.
+
+        Args:
+            inputs (dict): The prepared inputs of the batch.
+            budgets (List[int]): The maximum number of tokens of each prompt.
+            temperatures (List[float]): The sampling temperature of each prompt, 0 is greedy.
+            stops (List[List[str]]): The stop sequences of each prompt.
+            timer (FirstTokenTimer): The timer of the first token.
+            cancels (Optional[List[threading.Event]]): The cancellation event of each prompt, if any.
+
+        Returns:
+            dict: The keyword arguments of generate, without the inputs.
+        """
+        processors: List[LogitsProcessor] = [timer]
+        if len(set(temperatures)) == 1:
+            sampling: Dict[str, Any] = {"do_sample": temperatures[0] > 0}
+            if temperatures[0] > 0:
+                sampling["temperature"] = temperatures[0]
         else:
-            logger.error(
-                "Unexpected output format from language model pipeline.")
-            return ""
+            processors.append(RowTemperature(temperatures))
+            sampling = {"do_sample": True}
+
+        criteria: List[StoppingCriteria] = [
+            SummaryStop(self.tokenizer, inputs["input_ids"].shape[1], budgets, stops)]
+        if cancels:
+            criteria.append(Cancelled(cancels))
+
+        return {
+            "max_new_tokens": max(budgets),
+            "pad_token_id": self.tokenizer.pad_token_id,
+            "logits_processor": LogitsProcessorList(processors),
+            "stopping_criteria": StoppingCriteriaList(criteria),
+            **sampling
+        }
+
+    def generate(self, prompt: str, params: Optional[GenerationParams] = None) -> str:
+        return self.generate_batch([prompt], params=[params] if params else None)[0]
+
+    def warm_up(self, prompt: str, max_new_tokens: int) -> None:
+        """Run a short generation, so the first request does not pay for the lazy initializations.
+
+        Args:
+            prompt (str): The prompt to warm up with.
+            max_new_tokens (int): The number of tokens to generate.
+        """
+        self.generate_batch([prompt], max_new_tokens=max_new_tokens)
+
+    def generate_batch(self, prompts: List[str], max_new_tokens: Optional[int] = None,
+                       params: Optional[List[GenerationParams]] = None,
+                       cancels: Optional[List[threading.Event]] = None) -> List[str]:
+        """Generate the completions for a batch of prompts in a single padded forward pass, each
+        prompt stopping at its own budget, at the end of its summary or once cancelled.
+
+        Args:
+            prompts (List[str]): The full prompts to generate the completions for.
+            max_new_tokens (Optional[int]): The maximum number of tokens to generate, defaults to
+            the configured max_tokens.
+            params (Optional[List[GenerationParams]]): The generation parameters of each prompt,
+            the configured ones by default.
+            cancels (Optional[List[threading.Event]]): The event of each prompt, set when its caller
+            gives up, its completion is then cut short.
+
+        Returns:
+            List[str]: The completions without their prompt, in the same order as the prompts.
+        """
+        budgets, temperatures, stops = self.settings(len(prompts), max_new_tokens, params)
+        if self.is_mock:
+            completions = ["".join(self.mock_chunks()[:budget]) for budget in budgets]
+            if self.mock_token_seconds:
+                # The batch decodes its prompts together, one step per token.
+                start = time.perf_counter()
+                steps = max(len(completion.split()) for completion in completions)
+                for _ in range(steps):
+                    if cancels and all(cancel.is_set() for cancel in cancels):
+                        break
+                    time.sleep(self.mock_token_seconds)
+                self.record_timings(start, start + self.mock_token_seconds, time.perf_counter(),
+                                    sum(len(completion.split()) for completion in completions))
+            return [trim(completion, stop) for completion, stop in zip(completions, stops)]
+
+        start = time.perf_counter()
+        counts = self.assisted(prompts)
+        inputs = self.prepare_inputs(prompts, use_prefix_cache=counts is None)
+        timer = FirstTokenTimer()
+
+        with torch.inference_mode():
+            outputs = self.run_generate(
+                counts, **inputs, **self.generation_kwargs(inputs, budgets, temperatures, stops, timer, cancels))
+
+        # Only decode the newly generated tokens, the prompt is not echoed back.
+        completions = outputs[:, inputs["input_ids"].shape[1]:]
+        self.record_timings(start, timer.first_token, time.perf_counter(),
+                            int((completions != self.tokenizer.pad_token_id).sum()), counts)
+        return [
+            trim(text, stop) for text, stop in zip(
+                self.tokenizer.batch_decode(completions, skip_special_tokens=True), stops)
+        ]
+
+    @staticmethod
+    def record_timings(start: float, first_token: Optional[float], end: float, tokens: int,
+                       counts: Optional[AssistedCounts] = None) -> None:
+        """Record the prefill and decode durations of a generation, its decoding throughput and,
+        when assisted, the acceptance rate of the draft tokens, also on the spans of the current trace.
+
+        Args:
+            start (float): When the inputs started to be prepared.
+            first_token (Optional[float]): When the first token was ready, None if none was generated.
+            end (float): When the generation completed.
+            tokens (int): The number of tokens generated across the batch.
+            counts (Optional[AssistedCounts]): The counts of the assisted generation, None without.
+        """
+        acceptance = None
+        if counts is not None:
+            # The logits processors also run on the draft, the first token is the main model's.
+            first_token = counts.first_token
+            acceptance = counts.acceptance(tokens)
+        if first_token is None:
+            return
+
+        # The first token comes out of the prefill.
+        rate = (tokens - 1) / (end - first_token) if tokens > 1 and end > first_token else None
+        attributes: Dict[str, Any] = {"tokens": tokens}
+        if rate is not None:
+            attributes["tokens_per_second"] = round(rate, 2)
+        if acceptance is not None:
+            attributes["draft_acceptance"] = round(acceptance, 4)
+            DRAFT_ACCEPTANCE.observe(acceptance)
+            logger.info(
+                f"Assisted generation of {tokens} tokens at {rate or 0:.1f} tokens/sec, "
+                f"{acceptance:.0%} of the draft tokens accepted.")
+
+        get_tracer().record("lm.prefill", start, first_token)
+        get_tracer().record("lm.decode", first_token, end, **attributes)
+        PREFILL_SECONDS.observe(first_token - start)
+        DECODE_SECONDS.observe(end - first_token)
+        if rate is not None:
+            TOKENS_PER_SECOND.observe(rate)
+
+    def mock_chunks(self) -> List[str]:
+        words = self.mock_summary.split(" ")
+        return [word if i == len(words) - 1 else f"{word} " for i, word in enumerate(words)]
+
+    def iter_stream(self, prompt: str, params: Optional[GenerationParams] = None,
+                    cancel: Optional[threading.Event] = None) -> Iterator[str]:
+        """Blocking counterpart of generate_stream, generating on a thread of its own.
+
+        Args:
+            prompt (str): The full prompt to generate the completion for.
+            params (Optional[GenerationParams]): The generation parameters, the configured ones by default.
+            cancel (Optional[threading.Event]): Set when the caller gives up, ending the generation.
+
+        Yields:
+            Iterator[str]: The decoded text chunks of the completion up to its first stop, in order.
+        """
+        budgets, temperatures, stops = self.settings(1, params=[params] if params else None)
+        stop_filter = StopFilter(stops[0])
+        if self.is_mock:
+            for chunk in self.mock_chunks()[:budgets[0]]:
+                if cancel is not None and cancel.is_set():
+                    return
+                time.sleep(self.mock_token_seconds)
+                text = stop_filter.feed(chunk)
+                if text:
+                    yield text
+            text = stop_filter.flush()
+            if text:
+                yield text
+            return
+
+        start = time.perf_counter()
+        streamer = TextIteratorStreamer(
+            cast(AutoTokenizer, self.tokenizer), skip_prompt=True, skip_special_tokens=True)
+        counts = self.assisted([prompt])
+        inputs = self.prepare_inputs([prompt], use_prefix_cache=counts is None)
+        timer = FirstTokenTimer()
+        cancel = cancel or threading.Event()
+        errors: List[Exception] = []
+
+        def run() -> None:
+            try:
+                outputs = self.run_generate(
+                    counts,
+                    **inputs,
+                    streamer=streamer,
+                    **self.generation_kwargs(inputs, budgets, temperatures, stops, timer, [cancel])
+                )
+                self.record_timings(start, timer.first_token, time.perf_counter(),
+                                    outputs.shape[1] - inputs["input_ids"].shape[1], counts)
+            except Exception as e:
+                errors.append(e)
+                # Unblock the streamer if the generation fails before finishing it.
+                streamer.end()
+
+        thread = threading.Thread(target=run, name="stream-generation", daemon=True)
+        thread.start()
+        try:
+            # Drained to the end, the generation stops on its own right after the stop.
+            for text in streamer:
+                text = stop_filter.feed(text)
+                if text:
+                    yield text
+            text = stop_filter.flush()
+            if text:
+                yield text
+        finally:
+            # A consumer closing the stream early ends the generation at its next token.
+            if thread.is_alive():
+                cancel.set()
+
+        thread.join()
+        if errors:
+            raise errors[0]
+
+    async def generate_stream(self, prompt: str,
+                              params: Optional[GenerationParams] = None) -> AsyncIterator[str]:
+        """Generate the completion for the prompt, yielding decoded text chunks as soon as the
+        model produces them instead of waiting for the full generation.
+
+        Args:
+            prompt (str): The full prompt to generate the completion for.
+            params (Optional[GenerationParams]): The generation parameters, the configured ones by default.
+
+        Yields:
+            AsyncIterator[str]: The decoded text chunks of the completion up to its first stop, in order.
+        """
+        budgets, temperatures, stops = self.settings(1, params=[params] if params else None)
+        stop_filter = StopFilter(stops[0])
+        if self.is_mock:
+            for chunk in self.mock_chunks()[:budgets[0]]:
+                await asyncio.sleep(self.mock_token_seconds)
+                text = stop_filter.feed(chunk)
+                if text:
+                    yield text
+            text = stop_filter.flush()
+            if text:
+                yield text
+            return
+
+        start = time.perf_counter()
+        streamer = AsyncTextIteratorStreamer(
+            cast(AutoTokenizer, self.tokenizer), skip_prompt=True, skip_special_tokens=True)
+        counts = self.assisted([prompt])
+        timer = FirstTokenTimer()
+        cancel = threading.Event()
+
+        def run() -> Tuple[torch.Tensor, int]:
+            # Tokenizing and copying the prefix cache happen here too, off the event loop.
+            inputs = self.prepare_inputs([prompt], use_prefix_cache=counts is None)
+            outputs = self.run_generate(
+                counts, **inputs, streamer=streamer,
+                **self.generation_kwargs(inputs, budgets, temperatures, stops, timer, [cancel]))
+            return outputs, inputs["input_ids"].shape[1]
+
+        # Generation runs on the inference executor while the streamer is drained on the event loop.
+        generation = asyncio.ensure_future(run_in_executor(get_inference_executor(), run))
+        # Unblock the streamer if the generation fails or is cancelled before finishing it.
+        generation.add_done_callback(
+            lambda task: streamer.end() if task.cancelled() or task.exception() else None)
+
+        try:
+            # Drained to the end, the generation stops on its own right after the stop.
+            async for text in streamer:
+                text = stop_filter.feed(text)
+                if text:
+                    yield text
+            text = stop_filter.flush()
+            if text:
+                yield text
+        finally:
+            # Cancelled by a deadline or a disconnect, or closed early, the consumer no longer
+            # awaits the generation, which would otherwise run on to max_tokens on the executor.
+            if not generation.done():
+                cancel.set()
+
+        outputs, prompt_length = await generation
+        self.record_timings(start, timer.first_token, time.perf_counter(),
+                            outputs.shape[1] - prompt_length, counts)
+
+    def close(self) -> None:
+        """Nothing to release in process, the pooled and remote models stop their workers here.
+        """
+        pass
+
+    async def aclose(self) -> None:
+        """Nothing to release on the event loop, the remote model closes its asynchronous client here.
+        """
+        pass
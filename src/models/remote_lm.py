@@ -0,0 +1,151 @@
+import json
+import threading
+import time
+import uuid
+from typing import AsyncIterator, List, Optional
+
+import httpx
+from transformers import AutoTokenizer
+
+from dto.request import BatchGenerationRequest, CancelRequest, GenerationParams, GenerationRequest
+from models.cancellation import watch_cancels
+from utils.config import load_config
+from utils.constants import Constants
+from utils.logger import setup_logger
+from utils.readiness import TOKENIZER, get_readiness
+
+logger = setup_logger()
+
+
+class RemoteLanguageModel:
+    """Client of the inference server, with the same interface as the LanguageModel it replaces.
+    Only the tokenizer is loaded in process, to measure the prompts.
+    """
+
+    def __init__(self) -> None:
+        gen_config = load_config()[Constants.GENERATOR]
+        self.url = gen_config[Constants.SERVER_URL].rstrip("/")
+        # Generations can take minutes, only connecting is bounded.
+        timeout = httpx.Timeout(None, connect=10)
+        self.client = httpx.Client(base_url=self.url, timeout=timeout)
+        self.async_client = httpx.AsyncClient(base_url=self.url, timeout=timeout)
+
+        info = self.wait_for_server(gen_config[Constants.SERVER_WAIT])
+        self.model_id = info["model_id"]
+        self.is_mock = info["is_mock"]
+        self.replicas = info["replicas"]
+        self.max_tokens = info["max_tokens"]
+        self.context_window = info["context_window"]
+
+        if not self.is_mock:
+            with get_readiness().loading(TOKENIZER):
+                self.tokenizer = AutoTokenizer.from_pretrained(
+                    self.model_id, token=gen_config[Constants.HF_KEY])
+
+        logger.info(
+            f"Connected to the inference server at {self.url}, serving '{self.model_id}' "
+            f"with {self.replicas} replicas.")
+
+    def wait_for_server(self, wait_seconds: float) -> dict:
+        """Fetch the model served, retrying while the inference server starts up.
+
+        Args:
+            wait_seconds (float): The maximum time to wait for the server.
+
+        Returns:
+            dict: The model id, limits and number of replicas of the server.
+        """
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            try:
+                response = self.client.get("/info")
+                response.raise_for_status()
+                return response.json()
+            except httpx.HTTPError as e:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Inference server at {self.url} unavailable: {e}") from e
+                logger.info(f"Waiting for the inference server at {self.url}: {e}")
+                time.sleep(1)
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        if self.is_mock:
+            return [len(text.split()) for text in texts]
+        if not texts:
+            return []
+
+        encoded = self.tokenizer(texts, add_special_tokens=False)["input_ids"]
+        return [len(ids) for ids in encoded]
+
+    def cache_prefix(self, prefix: str) -> None:
+        self.client.post("/prefix", json={"prefix": prefix}).raise_for_status()
+
+    def generate(self, prompt: str, params: Optional[GenerationParams] = None) -> str:
+        return self.generate_batch([prompt], params=[params] if params else None)[0]
+
+    def warm_up(self, prompt: str, max_new_tokens: int) -> None:
+        self.generate_batch([prompt], max_new_tokens=max_new_tokens)
+
+    def cancel(self, batch_id: str, rows: List[int]) -> None:
+        try:
+            self.client.post("/cancel", json=CancelRequest(id=batch_id, rows=rows).model_dump()).raise_for_status()
+        except httpx.HTTPError as e:
+            logger.warning(f"Could not cancel prompts of batch {batch_id}: {e}")
+
+    def generate_batch(self, prompts: List[str], max_new_tokens: Optional[int] = None,
+                       params: Optional[List[GenerationParams]] = None,
+                       cancels: Optional[List[threading.Event]] = None) -> List[str]:
+        """Generate the completions of the batch on the inference server.
+
+        Args:
+            prompts (List[str]): The full prompts to generate the completions for.
+            max_new_tokens (Optional[int]): The maximum number of tokens to generate, defaults to
+            the configured max_tokens of the server.
+            params (Optional[List[GenerationParams]]): The generation parameters of each prompt.
+            cancels (Optional[List[threading.Event]]): The event of each prompt, set when its caller
+            gives up, the server is then told to cut it short.
+
+        Returns:
+            List[str]: The completions, in the same order as the prompts.
+        """
+        request = BatchGenerationRequest(prompts=prompts, max_new_tokens=max_new_tokens, params=params,
+                                         id=uuid.uuid4().hex if cancels else None)
+        done = threading.Event()
+        if cancels:
+            # The request blocks this thread, the cancellations are forwarded from another one.
+            threading.Thread(
+                target=watch_cancels, args=(cancels, done.wait, lambda rows: self.cancel(request.id, rows)),
+                name="remote-cancels", daemon=True).start()
+        try:
+            response = self.client.post("/generate", json=request.model_dump(exclude_none=True))
+        finally:
+            done.set()
+        response.raise_for_status()
+        return response.json()["completions"]
+
+    async def generate_stream(self, prompt: str,
+                              params: Optional[GenerationParams] = None) -> AsyncIterator[str]:
+        """Stream the completion of the prompt from the inference server.
+
+        Args:
+            prompt (str): The full prompt to generate the completion for.
+            params (Optional[GenerationParams]): The generation parameters.
+
+        Yields:
+            AsyncIterator[str]: The decoded text chunks of the completion, in order.
+        """
+        request = GenerationRequest(prompt=prompt, params=params)
+        # Cancelled or closed early, the stream is closed, which cancels the generation on the server.
+        async with self.async_client.stream(
+                "POST", "/generate/stream", json=request.model_dump(exclude_none=True)) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)["text"]
+
+    def close(self) -> None:
+        self.client.close()
+
+    async def aclose(self) -> None:
+        """Close the asynchronous client, on the event loop its connections belong to.
+        """
+        await self.async_client.aclose()
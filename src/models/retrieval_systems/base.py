@@ -1,11 +1,58 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Any, List, Mapping, Optional, Sequence, cast
 
-import chromadb
+from chromadb.base_types import Metadata
 
 from dto.response import Abstract
+from models.embeddings import get_embedding_model
+from models.vector_stores.base import open_store
 from utils.config import load_config
 from utils.constants import Constants
+from utils.executors import get_retrieval_executor, run_in_executor
+from utils.metrics import COLLECTION_DOCUMENTS
+
+
+def abstract_to_metadata(abstract: Abstract) -> Metadata:
+    """Build the metadata stored alongside the abstract's document in the vector store.
+
+    Args:
+        abstract (Abstract): The abstract to be stored.
+
+    Returns:
+        Metadata: The metadata of the abstract, the arxiv_id and abstract being the id and document.
+    """
+    return {
+        "my_id": abstract.id,
+        "title": abstract.title,
+        "authors": abstract.authors,
+        "year": abstract.year,
+        "categories": abstract.categories,
+        "pdf_url": abstract.pdf_url
+    }
+
+
+def metadata_to_abstract(arxiv_id: str, document: str, metadata: Optional[Mapping[str, Any]]) -> Abstract:
+    """Rebuild the abstract from a document stored in the vector store and its metadata.
+
+    Args:
+        arxiv_id (str): The id of the stored document.
+        document (str): The stored document, the abstract itself.
+        metadata (Optional[Mapping[str, Any]]): The metadata stored alongside the document.
+
+    Returns:
+        Abstract: The abstract.
+    """
+    meta = metadata or {}
+    return Abstract(
+        id=cast(str, meta.get("my_id", "")),
+        arxiv_id=arxiv_id,
+        title=cast(str, meta.get("title", "")),
+        authors=cast(str, meta.get("authors", "")),
+        year=cast(str, meta.get("year", "")),
+        categories=cast(str, meta.get("categories", "")),
+        abstract=document,
+        pdf_url=cast(str, meta.get("pdf_url", ""))
+    )
 
 
 class BaseRetrievalSystem(ABC):
@@ -23,13 +70,103 @@ class BaseRetrievalSystem(ABC):
         self.should_save = ret_config[Constants.SAVE]
         self.threshold = ret_config[Constants.THRESHOLD]
 
-        self.client = chromadb.PersistentClient(
-            path=self.save_folder
-        )
-        self.collection = self.client.get_or_create_collection(
-            self.collection_docs
-        )
+        # Documents and queries are embedded by the configured embedding model, the vector store
+        # is always given precomputed embeddings.
+        self.embedding_model = get_embedding_model()
+        self.collection = open_store(ret_config)
+        COLLECTION_DOCUMENTS.set_function(self.collection.count)
+
+    def close(self) -> None:
+        """Release the resources held by the retrieval system, before the server shuts down.
+        """
+        self.collection.close()
 
     @abstractmethod
-    def fetch(self, query: str, limit: int) -> List[Abstract]:
+    def fetch(self, query: str, limit: int, query_embedding: Optional[List[float]] = None) -> List[Abstract]:
         raise NotImplementedError("fetch method not implemented!")
+
+    def embed_query(self, query: str) -> List[float]:
+        """Embed the query with the same embedding model as the vector store, so the
+        embedding can be reused by the store query and the semantic cache.
+
+        Args:
+            query (str): The query posted by the user from the UI.
+
+        Returns:
+            List[float]: The embedding of the query.
+        """
+        return self.embedding_model.embed_query(query)
+
+    async def embed_query_async(self, query: str) -> List[float]:
+        """Async counterpart of embed_query, runs on the bounded retrieval executor.
+
+        Args:
+            query (str): The query posted by the user from the UI.
+
+        Returns:
+            List[float]: The embedding of the query.
+        """
+        return await run_in_executor(get_retrieval_executor(), self.embed_query, query)
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Embed the queries in a single batch, rather than one forward pass per query.
+
+        Args:
+            queries (List[str]): The queries to embed.
+
+        Returns:
+            List[List[float]]: The embeddings, in the same order as the queries.
+        """
+        return self.embedding_model.embed_documents(queries)
+
+    async def embed_queries_async(self, queries: List[str]) -> List[List[float]]:
+        return await run_in_executor(get_retrieval_executor(), self.embed_queries, queries)
+
+    def fetch_batch(self, queries: List[str], limit: int,
+                    query_embeddings: Optional[Sequence[Optional[List[float]]]] = None) -> List[List[Abstract]]:
+        """Fetch the documents of several queries, by default one query after the other. Systems
+        able to batch their sources should override this.
+
+        Args:
+            queries (List[str]): The queries to fetch the documents for.
+            limit (int): The maximum number of records to fetch per query.
+            query_embeddings (Optional[Sequence[Optional[List[float]]]]): The precomputed embeddings
+            of the queries.
+
+        Returns:
+            List[List[Abstract]]: The abstracts of each query, in the same order as the queries.
+        """
+        embeddings = query_embeddings or [None] * len(queries)
+        return [self.fetch(query, limit, embedding) for query, embedding in zip(queries, embeddings)]
+
+    async def fetch_batch_async(self, queries: List[str], limit: int,
+                                query_embeddings: Optional[Sequence[Optional[List[float]]]] = None
+                                ) -> List[List[Abstract]]:
+        """Async counterpart of fetch_batch, by default runs the blocking fetch_batch on the
+        bounded retrieval executor.
+
+        Args:
+            queries (List[str]): The queries to fetch the documents for.
+            limit (int): The maximum number of records to fetch per query.
+            query_embeddings (Optional[Sequence[Optional[List[float]]]]): The precomputed embeddings
+            of the queries.
+
+        Returns:
+            List[List[Abstract]]: The abstracts of each query, in the same order as the queries.
+        """
+        return await run_in_executor(get_retrieval_executor(), self.fetch_batch, queries, limit, query_embeddings)
+
+    async def fetch_async(self, query: str, limit: int,
+                          query_embedding: Optional[List[float]] = None) -> List[Abstract]:
+        """Async counterpart of fetch, by default runs the blocking fetch on the bounded
+        retrieval executor. Systems with natively async sources should override this.
+
+        Args:
+            query (str): The query posted by the user from the UI.
+            limit (int): The maximum number of records to fetch.
+            query_embedding (Optional[List[float]]): The precomputed embedding of the query.
+
+        Returns:
+            List[Abstract]: The list of abstracts to generate the summary for.
+        """
+        return await run_in_executor(get_retrieval_executor(), self.fetch, query, limit, query_embedding)
@@ -1,12 +1,18 @@
-import threading
-from typing import List, cast
-
-from chromadb.base_types import Metadata
+import asyncio
+import time
+from typing import Dict, List, Optional, Sequence
 
 from dto.response import Abstract
-from models.retrieval_systems.base import BaseRetrievalSystem
-from utils.api_client import fetch_metadata
+from models.retrieval_systems.base import BaseRetrievalSystem, abstract_to_metadata, metadata_to_abstract
+from models.retrieval_systems.lexical import BM25Index, reciprocal_rank_fusion
+from models.retrieval_systems.writer import PersistenceWriter
+from utils.api_client import fetch_metadata, fetch_metadata_async
+from utils.config import load_config
+from utils.constants import Constants
+from utils.executors import get_retrieval_executor, run_in_executor, submit_in_context
 from utils.logger import setup_logger
+from utils.metrics import RETRIEVAL_SECONDS, RETRIEVALS, RETRIEVED_ABSTRACTS
+from utils.tracing import span, traced
 
 logger = setup_logger()
 
@@ -27,23 +33,53 @@ class HybridRetrievalSystem(BaseRetrievalSystem):
         self.is_local = is_local
         self.is_remote = is_remote
 
-    def fetch(self, query: str, limit: int) -> List[Abstract]:
+        ret_config = load_config()[Constants.RETRIVER]
+
+        # Lexical index fused with the vector search, kept up to date by process_and_save.
+        self.lexical = None
+        if self.is_local and ret_config[Constants.LEXICAL]:
+            self.lexical = BM25Index()
+            self.lexical.build(self.collection)
+            self.rrf_k = ret_config[Constants.RRF_K]
+            self.lexical_min_match = ret_config[Constants.LEXICAL_MIN_MATCH]
+
+        # Launch the ArXiv request alongside the local query instead of after it.
+        self.speculative = self.is_local and self.is_remote and ret_config[Constants.SPECULATIVE]
+
+        self.writer = None
+        if self.should_save and self.is_remote:
+            self.writer = PersistenceWriter(
+                save=self.process_and_save,
+                max_pending=ret_config[Constants.SAVE_QUEUE],
+                batch_size=ret_config[Constants.SAVE_BATCH],
+                policy=ret_config[Constants.SAVE_POLICY]
+            )
+
+    def fetch(self, query: str, limit: int, query_embedding: Optional[List[float]] = None) -> List[Abstract]:
         """Fetch the documents from local, remote or both based on the query and limit of results.
 
         Args:
             query (str): The query posted by the user from the UI.
             limit (int): The maximum number of records to fetch.
+            query_embedding (Optional[List[float]]): The precomputed embedding of the query.
 
         Returns:
             List[Abstract]: The list of abstracts to generate the summary for.
         """
+        if self.speculative:
+            return self.fetch_speculative(query, limit, query_embedding)
+
+        start = time.perf_counter()
         local_abstracts, remote_abstracts = [], []
+        remote_done = None
 
         if self.is_local:
-            local_abstracts = self.fetch_local(query=query, limit=limit)
+            local_abstracts = self.fetch_local(
+                query=query, limit=limit, query_embedding=query_embedding)
             logger.info(
                 f"Fetched {len(local_abstracts)} from local store for the query.")
 
+        local_done = time.perf_counter()
         missing_abstracts = limit - len(local_abstracts)
 
         if self.is_remote and missing_abstracts > 0:
@@ -51,57 +87,337 @@ class HybridRetrievalSystem(BaseRetrievalSystem):
                 f"Fetching {missing_abstracts} from remote api for the query.")
             remote_abstracts = self.fetch_remote(
                 query=query, limit=missing_abstracts)
+            remote_done = time.perf_counter()
+
+        self.log_stages(start, local_done, remote_done,
+                        len(local_abstracts), len(remote_abstracts))
+        return (local_abstracts + remote_abstracts)
+
+    async def fetch_async(self, query: str, limit: int,
+                          query_embedding: Optional[List[float]] = None) -> List[Abstract]:
+        """Async counterpart of fetch, the vector store query is offloaded to the retrieval executor
+        and the ArXiv API is awaited directly.
+
+        Args:
+            query (str): The query posted by the user from the UI.
+            limit (int): The maximum number of records to fetch.
+            query_embedding (Optional[List[float]]): The precomputed embedding of the query.
+
+        Returns:
+            List[Abstract]: The list of abstracts to generate the summary for.
+        """
+        if self.speculative:
+            return await self.fetch_speculative_async(query, limit, query_embedding)
+
+        start = time.perf_counter()
+        local_abstracts, remote_abstracts = [], []
+        remote_done = None
+
+        if self.is_local:
+            local_abstracts = await run_in_executor(
+                get_retrieval_executor(), self.fetch_local, query, limit, query_embedding)
+            logger.info(
+                f"Fetched {len(local_abstracts)} from local store for the query.")
+
+        local_done = time.perf_counter()
+        missing_abstracts = limit - len(local_abstracts)
+
+        if self.is_remote and missing_abstracts > 0:
+            logger.info(
+                f"Fetching {missing_abstracts} from remote api for the query.")
+            remote_abstracts = await self.fetch_remote_async(
+                query=query, limit=missing_abstracts)
+            remote_done = time.perf_counter()
 
+        self.log_stages(start, local_done, remote_done,
+                        len(local_abstracts), len(remote_abstracts))
         return (local_abstracts + remote_abstracts)
 
-    def fetch_local(self, query: str, limit: int) -> List[Abstract]:
+    def fetch_speculative(self, query: str, limit: int,
+                          query_embedding: Optional[List[float]] = None) -> List[Abstract]:
+        """Fetch from the local store while the ArXiv request for the full limit is already in
+        flight on the retrieval executor, then top up the local results with the remote ones.
+
+        Args:
+            query (str): The query posted by the user from the UI.
+            limit (int): The maximum number of records to fetch.
+            query_embedding (Optional[List[float]]): The precomputed embedding of the query.
+
+        Returns:
+            List[Abstract]: The list of abstracts to generate the summary for.
+        """
+        start = time.perf_counter()
+        remote = submit_in_context(get_retrieval_executor(), self.fetch_remote, query, limit)
+
+        local_abstracts = self.fetch_local(
+            query=query, limit=limit, query_embedding=query_embedding)
+        local_done = time.perf_counter()
+
+        if len(local_abstracts) >= limit:
+            # Only cancelled if still queued, a request already sent is left to complete and
+            # its results are discarded.
+            remote.cancel()
+            self.log_stages(start, local_done, None, len(local_abstracts), 0)
+            return local_abstracts[:limit]
+
+        remote_abstracts = remote.result()
+        self.log_stages(start, local_done, time.perf_counter(),
+                        len(local_abstracts), len(remote_abstracts))
+        return self.merge(local_abstracts, remote_abstracts, limit)
+
+    async def fetch_speculative_async(self, query: str, limit: int,
+                                      query_embedding: Optional[List[float]] = None) -> List[Abstract]:
+        """Async counterpart of fetch_speculative, the ArXiv request is a task cancelled as soon as
+        the local results satisfy the limit.
+
+        Args:
+            query (str): The query posted by the user from the UI.
+            limit (int): The maximum number of records to fetch.
+            query_embedding (Optional[List[float]]): The precomputed embedding of the query.
+
+        Returns:
+            List[Abstract]: The list of abstracts to generate the summary for.
+        """
+        start = time.perf_counter()
+        remote = asyncio.ensure_future(self.fetch_remote_async(query=query, limit=limit))
+
+        try:
+            local_abstracts = await run_in_executor(
+                get_retrieval_executor(), self.fetch_local, query, limit, query_embedding)
+        except BaseException:
+            remote.cancel()
+            raise
+        local_done = time.perf_counter()
+
+        if len(local_abstracts) >= limit:
+            remote.cancel()
+            self.log_stages(start, local_done, None, len(local_abstracts), 0)
+            return local_abstracts[:limit]
+
+        remote_abstracts = await remote
+        self.log_stages(start, local_done, time.perf_counter(),
+                        len(local_abstracts), len(remote_abstracts))
+        return self.merge(local_abstracts, remote_abstracts, limit)
+
+    @staticmethod
+    def merge(local_abstracts: List[Abstract], remote_abstracts: List[Abstract],
+              limit: int) -> List[Abstract]:
+        """Top up the local abstracts with the remote ones not already among them.
+
+        Args:
+            local_abstracts (List[Abstract]): The abstracts from the local store, ranked first.
+            remote_abstracts (List[Abstract]): The abstracts from the ArXiv API.
+            limit (int): The maximum number of records to return.
+
+        Returns:
+            List[Abstract]: The merged abstracts, deduplicated by arxiv_id.
+        """
+        seen = {a.arxiv_id for a in local_abstracts}
+        merged = list(local_abstracts)
+        for abstract in remote_abstracts:
+            if len(merged) >= limit:
+                break
+            if abstract.arxiv_id not in seen:
+                seen.add(abstract.arxiv_id)
+                merged.append(abstract)
+
+        return merged
+
+    def log_stages(self, start: float, local_done: float, remote_done: Optional[float],
+                   n_local: int, n_remote: int) -> None:
+        """Log and record the per stage timings of a fetch, the remote wait being the time spent on
+        the ArXiv request after the local query completed, all of the request unless it was speculative.
+        """
+        self.record_stages(start, local_done, remote_done, n_local, n_remote)
+        local_ms = (local_done - start) * 1000
+        if remote_done is None:
+            logger.info(
+                f"Retrieval stages: local {local_ms:.1f}ms ({n_local} results), "
+                f"remote skipped, total {local_ms:.1f}ms.")
+            return
+
+        logger.info(
+            f"Retrieval stages: local {local_ms:.1f}ms ({n_local} results), "
+            f"remote wait {(remote_done - local_done) * 1000:.1f}ms ({n_remote} results), "
+            f"total {(remote_done - start) * 1000:.1f}ms.")
+
+    def record_stages(self, start: float, local_done: float, remote_done: Optional[float],
+                      n_local: int, n_remote: int, queries: int = 1, fallbacks: Optional[int] = None) -> None:
+        """Record the per stage timings of a fetch of one or more queries, and how many of them
+        fell back to the ArXiv API, all of them by default when it was called.
+        """
+        if fallbacks is None:
+            fallbacks = queries if remote_done is not None else 0
+        if self.is_local:
+            RETRIEVAL_SECONDS.observe(local_done - start, source="local")
+            RETRIEVED_ABSTRACTS.inc(n_local, source="local")
+        if remote_done is not None:
+            RETRIEVAL_SECONDS.observe(remote_done - local_done, source="remote")
+            RETRIEVED_ABSTRACTS.inc(n_remote, source="remote")
+        RETRIEVALS.inc(fallbacks, outcome="arxiv_fallback")
+        RETRIEVALS.inc(queries - fallbacks, outcome="local")
+
+    def fetch_local(self, query: str, limit: int, query_embedding: Optional[List[float]] = None) -> List[Abstract]:
         """The method to fetch the documents from local vector database.
 
         Args:
             query (str): The query posted by the user from the UI.
             limit (int): The maximum number of records to fetch.
+            query_embedding (Optional[List[float]]): The precomputed embedding of the query, embedded
+            here if not given.
 
         Returns:
             List[Abstract]: The list of abstracts to generate the summary for, from local storage.
         """
-        results = self.collection.query(query_texts=[query], n_results=limit)
+        if query_embedding is None:
+            query_embedding = self.embed_query(query)
+
+        return self.fetch_local_batch([query], limit, [query_embedding])[0]
+
+    @traced("retrieval.fetch_local")
+    def fetch_local_batch(self, queries: List[str], limit: int,
+                          query_embeddings: Optional[List[List[float]]] = None) -> List[List[Abstract]]:
+        """Fetch the documents of several queries from the local vector database, with a single
+        query of the collection and a single lookup of the documents only found lexically.
+
+        Args:
+            queries (List[str]): The queries to fetch the documents for.
+            limit (int): The maximum number of records to fetch per query.
+            query_embeddings (Optional[List[List[float]]]): The precomputed embeddings of the
+            queries, embedded here in one batch if not given.
 
-        # Safely extract lists or default to empty
+        Returns:
+            List[List[Abstract]]: The abstracts of each query from local storage, in the same order
+            as the queries.
+        """
+        if query_embeddings is None:
+            query_embeddings = self.embed_queries(queries)
+
+        results = self.collection.query(
+            query_embeddings=query_embeddings, n_results=limit)  # type: ignore
+
+        # Safely extract lists or default to empty, each being a list per query
         raw_docs = results.get("documents") or []
         raw_metas = results.get("metadatas") or []
         raw_ids = results.get("ids") or []
         raw_scores = results.get("distances") or []
 
-        # Each raw_* is a list of lists; take first list if present, else empty
-        docs = raw_docs[0] if raw_docs and isinstance(
-            raw_docs[0], list) else []
-        metadatas = raw_metas[0] if raw_metas and isinstance(
-            raw_metas[0], list) else []
-        ids = raw_ids[0] if raw_ids and isinstance(raw_ids[0], list) else []
-        scores = raw_scores[0] if raw_scores and isinstance(
-            raw_scores[0], list) else []
-
-        abstracts = []
-
-        for doc, meta, id_, score in zip(docs, metadatas, ids, scores):
-            if score > self.threshold:
-                # If score — the distance is greater than threshold
-                # Ignore
-                continue
-            abstract = Abstract(
-                id=cast(str, meta.get("my_id", "")),
-                arxiv_id=id_,
-                title=cast(str, meta.get("title", "")),
-                authors=cast(str, meta.get("authors", "")),
-                year=cast(str, meta.get("year", "")),
-                categories=cast(str, meta.get("categories", "")),
-                abstract=doc,
-                pdf_url=cast(str, meta.get("pdf_url", ""))
-            )
-            abstracts.append(abstract)
+        batch: List[Dict[str, Abstract]] = []
+        for i in range(len(queries)):
+            docs = raw_docs[i] if i < len(raw_docs) else []
+            metadatas = raw_metas[i] if i < len(raw_metas) else []
+            ids = raw_ids[i] if i < len(raw_ids) else []
+            scores = raw_scores[i] if i < len(raw_scores) else []
 
-        return abstracts
+            abstracts: Dict[str, Abstract] = {}
+            for doc, meta, id_, score in zip(docs, metadatas, ids, scores):
+                if score > self.threshold:
+                    # If score — the distance is greater than threshold
+                    # Ignore
+                    continue
+                abstracts[id_] = metadata_to_abstract(id_, doc, meta)
+            batch.append(abstracts)
+
+        if self.lexical is None:
+            return [list(abstracts.values()) for abstracts in batch]
+
+        # Fuse with the lexical matches, fetching the documents only found lexically.
+        vector_ids = [list(abstracts.keys()) for abstracts in batch]
+        lexical_ids = [[doc_id for doc_id, _ in self.lexical.search(
+            query, limit, min_match=self.lexical_min_match)] for query in queries]
+        missing = list(dict.fromkeys(
+            doc_id for abstracts, ids in zip(batch, lexical_ids)
+            for doc_id in ids if doc_id not in abstracts))
+        stored: Dict[str, Abstract] = {}
+        if missing:
+            found = self.collection.get(
+                ids=missing, include=["documents", "metadatas"])  # type: ignore
+            for id_, doc, meta in zip(found["ids"], found.get("documents") or [],
+                                      found.get("metadatas") or []):
+                stored[id_] = metadata_to_abstract(id_, doc, meta)
+
+        fetched = []
+        for abstracts, vector, lexical in zip(batch, vector_ids, lexical_ids):
+            for doc_id in lexical:
+                if doc_id not in abstracts and doc_id in stored:
+                    abstracts[doc_id] = stored[doc_id]
+            fused = reciprocal_rank_fusion([vector, lexical], k=self.rrf_k)
+            fetched.append(
+                [abstracts[doc_id] for doc_id, _ in fused if doc_id in abstracts][:limit])
+
+        return fetched
+
+    async def fetch_batch_async(self, queries: List[str], limit: int,
+                                query_embeddings: Optional[Sequence[Optional[List[float]]]] = None
+                                ) -> List[List[Abstract]]:
+        """Fetch the documents of several queries: a single batched query of the local store, then
+        the ArXiv API for the queries it could not satisfy, concurrently. Repeats of a query share
+        a single ArXiv request, and the abstracts fetched for several queries are persisted once.
+
+        Args:
+            queries (List[str]): The queries to fetch the documents for.
+            limit (int): The maximum number of records to fetch per query.
+            query_embeddings (Optional[Sequence[Optional[List[float]]]]): The precomputed embeddings
+            of the queries.
+
+        Returns:
+            List[List[Abstract]]: The abstracts of each query, in the same order as the queries.
+        """
+        start = time.perf_counter()
+        local: List[List[Abstract]] = [[] for _ in queries]
+        if self.is_local:
+            embeddings = None
+            if query_embeddings is not None and all(e is not None for e in query_embeddings):
+                embeddings = list(query_embeddings)
+            local = await run_in_executor(
+                get_retrieval_executor(), self.fetch_local_batch, queries, limit, embeddings)
+        local_done = time.perf_counter()
+
+        if not self.is_remote:
+            self.record_stages(start, local_done, None, sum(map(len, local)), 0, len(queries))
+            logger.info(
+                f"Batch retrieval of {len(queries)} queries: local "
+                f"{(local_done - start) * 1000:.1f}ms, remote skipped.")
+            return local
+
+        # The most results any copy of each distinct query misses.
+        needed: Dict[str, int] = {}
+        texts: Dict[str, str] = {}
+        for query, abstracts in zip(queries, local):
+            missing = limit - len(abstracts)
+            if missing > 0:
+                key = " ".join(query.lower().split())
+                texts.setdefault(key, query)
+                needed[key] = max(needed.get(key, 0), missing)
+
+        keys = list(needed)
+        with span("retrieval.fetch_remote", queries=len(keys)):
+            fetched = await asyncio.gather(*(
+                fetch_metadata_async(query=texts[key], max_results=needed[key]) for key in keys))
+        remote = dict(zip(keys, fetched))
+
+        if self.writer is not None and fetched:
+            unique = {a.arxiv_id: a for abstracts in fetched for a in abstracts}
+            # Persisted by the background writer, off the request path
+            self.writer.submit(list(unique.values()))
 
+        results = []
+        for query, abstracts in zip(queries, local):
+            key = " ".join(query.lower().split())
+            results.append(self.merge(abstracts, remote.get(key, []), limit))
+
+        n_fallbacks = sum(len(abstracts) < limit for abstracts in local)
+        n_local = sum(map(len, local))
+        self.record_stages(start, local_done, time.perf_counter() if keys else None, n_local,
+                           sum(map(len, results)) - n_local, len(queries), n_fallbacks)
+
+        logger.info(
+            f"Batch retrieval of {len(queries)} queries: local {(local_done - start) * 1000:.1f}ms, "
+            f"{len(keys)} remote requests for {n_fallbacks} queries, "
+            f"total {(time.perf_counter() - start) * 1000:.1f}ms.")
+        return results
+
+    @traced("retrieval.fetch_remote")
     def fetch_remote(self, query: str, limit: int) -> List[Abstract]:
         """The method to fetch the documents from the ArXiv API based on query and number of results.
         Optionally updates local store.
@@ -115,39 +431,60 @@ class HybridRetrievalSystem(BaseRetrievalSystem):
         """
         abstracts = fetch_metadata(query=query, max_results=limit)
 
-        if self.should_save:
-            # Create a separate thread to persist vectors
-            threading.Thread(
-                target=self.process_and_save,
-                args=(abstracts,),
-                daemon=True
-            ).start()
+        if self.writer is not None:
+            # Persisted by the background writer, off the request path
+            self.writer.submit(abstracts)
+
+        return abstracts
+
+    @traced("retrieval.fetch_remote")
+    async def fetch_remote_async(self, query: str, limit: int) -> List[Abstract]:
+        """Async counterpart of fetch_remote.
+
+        Args:
+            query (str): The query posted by the user from the UI.
+            limit (int): The maximum number of records to fetch.
+
+        Returns:
+            List[Abstract]: The list of abstracts to generate the summary for.
+        """
+        abstracts = await fetch_metadata_async(query=query, max_results=limit)
+
+        if self.writer is not None:
+            # Persisted by the background writer, off the request path
+            self.writer.submit(abstracts)
 
         return abstracts
 
     def process_and_save(self, abstracts: List[Abstract]) -> None:
-        """Process to update the metadata and documents in the vector store.
+        """Process to update the metadata and documents in the vector store. Abstracts already
+        stored are skipped, so that they are not embedded again.
 
         Args:
             abstracts (List[Abstract]): The remote abstracts to update the store.
         """
-        # Update the chromadb store async
-        documents = [a.abstract for a in abstracts]
         ids = [a.arxiv_id for a in abstracts]
-        metadatas = [
-            cast(Metadata, {
-                "my_id": a.id,
-                "title": a.title,
-                "authors": a.authors,
-                "year": a.year,
-                "categories": a.categories,
-                "pdf_url": a.pdf_url
-            })
-            for a in abstracts
-        ]
-
-        self.collection.add(
+        existing = set(self.collection.get(ids=ids, include=[])["ids"])
+        abstracts = [a for a in abstracts if a.arxiv_id not in existing]
+        if not abstracts:
+            return
+
+        documents = [a.abstract for a in abstracts]
+        self.collection.upsert(
             documents=documents,
-            ids=ids,
-            metadatas=metadatas
+            embeddings=self.embedding_model.embed_documents(documents),  # type: ignore
+            ids=[a.arxiv_id for a in abstracts],
+            metadatas=[abstract_to_metadata(a) for a in abstracts]
         )
+        if self.lexical is not None:
+            self.lexical.add_abstracts(abstracts)
+
+        logger.info(
+            f"Persisted {len(abstracts)} new abstracts, skipped {len(existing)} already stored.")
+
+    def close(self) -> None:
+        """Drain the pending writes to the vector store, then close it.
+        """
+        if self.writer is not None:
+            self.writer.close()
+        super().close()
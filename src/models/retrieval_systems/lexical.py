@@ -0,0 +1,164 @@
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+from dto.response import Abstract
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were "
+    "we with which our their these those using via into can not".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def index_text(title: str, abstract: str, authors: str) -> str:
+    return f"{title} {abstract} {authors}"
+
+
+class BM25Index:
+    """In-process inverted index scoring the stored abstracts with BM25 over their title, abstract
+    and authors, kept alongside the vector store to recall documents the embeddings miss.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.doc_terms: Dict[str, List[str]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.total_length = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, doc_id: str, text: str) -> None:
+        """Index a document, replacing its previous version if already indexed.
+
+        Args:
+            doc_id (str): The id of the document, its arxiv_id.
+            text (str): The text to index.
+        """
+        tokens = tokenize(text)
+        counts = Counter(tokens)
+
+        with self.lock:
+            self.remove_locked(doc_id)
+            for term, tf in counts.items():
+                self.postings[term][doc_id] = tf
+            self.doc_terms[doc_id] = list(counts.keys())
+            self.doc_lengths[doc_id] = len(tokens)
+            self.total_length += len(tokens)
+
+    def add_abstracts(self, abstracts: List[Abstract]) -> None:
+        for abstract in abstracts:
+            self.add(abstract.arxiv_id, index_text(
+                abstract.title, abstract.abstract, abstract.authors))
+
+    def remove_locked(self, doc_id: str) -> None:
+        if doc_id not in self.doc_lengths:
+            return
+
+        for term in self.doc_terms.pop(doc_id):
+            postings = self.postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+
+    def search(self, query: str, limit: int, min_match: float = 0.0) -> List[Tuple[str, float]]:
+        """Score the documents containing the query terms.
+
+        Args:
+            query (str): The query posted by the user.
+            limit (int): The maximum number of documents to return.
+            min_match (float): The minimum fraction of the distinct query terms a document must
+            contain to be returned.
+
+        Returns:
+            List[Tuple[str, float]]: The document ids and their scores, best first.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        required = math.ceil(min_match * len(terms))
+
+        scores: Dict[str, float] = defaultdict(float)
+        matched: Dict[str, int] = defaultdict(int)
+
+        with self.lock:
+            n_docs = len(self.doc_lengths)
+            if n_docs == 0:
+                return []
+            avg_length = self.total_length / n_docs
+
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+                    matched[doc_id] += 1
+
+        ranked = sorted(
+            ((doc_id, score) for doc_id, score in scores.items() if matched[doc_id] >= required),
+            key=lambda item: item[1], reverse=True)
+        return ranked[:limit]
+
+    def build(self, collection, page_size: int = 1000) -> None:
+        """Index every document already in the collection, page by page.
+
+        Args:
+            collection (Collection): The vector store collection.
+            page_size (int): The number of documents fetched per page.
+        """
+        start = time.perf_counter()
+        offset = 0
+        while True:
+            page = collection.get(include=["documents", "metadatas"],
+                                  limit=page_size, offset=offset)
+            ids = page.get("ids") or []
+            if not ids:
+                break
+
+            documents = page.get("documents") or [""] * len(ids)
+            metadatas = page.get("metadatas") or [{}] * len(ids)
+            for id_, doc, meta in zip(ids, documents, metadatas):
+                meta = meta or {}
+                self.add(id_, index_text(
+                    str(meta.get("title", "")), doc or "", str(meta.get("authors", ""))))
+
+            offset += len(ids)
+
+        logger.info(
+            f"Built the lexical index of {len(self)} documents in {time.perf_counter() - start:.2f}s.")
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int) -> List[Tuple[str, float]]:
+    """Fuse several rankings of document ids, each contributing 1 / (k + rank) per document.
+
+    Args:
+        rankings (List[List[str]]): The rankings to fuse, best first.
+        k (int): The constant dampening the weight of the top ranks.
+
+    Returns:
+        List[Tuple[str, float]]: The document ids and their fused scores, best first.
+    """
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
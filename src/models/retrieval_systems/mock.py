@@ -1,5 +1,6 @@
+import asyncio
 from time import sleep
-from typing import List
+from typing import List, Optional, Sequence
 
 from dto.response import Abstract
 from models.retrieval_systems.base import BaseRetrievalSystem
@@ -9,13 +10,32 @@ class MockRetrievalSystem(BaseRetrievalSystem):
     def __init__(self) -> None:
         super().__init__()
 
-    def fetch(self, query: str, limit: int) -> List[Abstract]:
+    def fetch(self, query: str, limit: int, query_embedding: Optional[List[float]] = None) -> List[Abstract]:
         # Simulate a loading for UI
         sleep(0.5)
 
+        return self.mock_abstracts(limit)
+
+    async def fetch_async(self, query: str, limit: int,
+                          query_embedding: Optional[List[float]] = None) -> List[Abstract]:
+        # Simulate a loading for UI without holding a thread
+        await asyncio.sleep(0.5)
+
+        return self.mock_abstracts(limit)
+
+    async def fetch_batch_async(self, queries: List[str], limit: int,
+                                query_embeddings: Optional[Sequence[Optional[List[float]]]] = None
+                                ) -> List[List[Abstract]]:
+        # A single simulated loading for the whole batch
+        await asyncio.sleep(0.5)
+
+        return [self.mock_abstracts(limit) for _ in queries]
+
+    def mock_abstracts(self, limit: int) -> List[Abstract]:
         return [
             Abstract(
                 id="UT",
+                arxiv_id="1807.03819v3",
                 title="Universal Transformers",
                 authors="Mostafa Dehghani, Stephan Gouws, Oriol Vinyals, Jakob Uszkoreit, Łukasz Kaiser",
                 year="2019",
@@ -30,6 +50,7 @@ class MockRetrievalSystem(BaseRetrievalSystem):
             ),
             Abstract(
                 id="TR",
+                arxiv_id="2307.05979v1",
                 title="Transformers in Reinforcement Learning: A Survey",
                 authors="Pranav Agarwal, Aamer Abdul Rahman, Pierre-Luc St-Charles, Simon J.D. Prince, Samira Ebrahimi Kahou",
                 year="2023",
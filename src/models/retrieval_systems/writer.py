@@ -0,0 +1,133 @@
+import queue
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dto.response import Abstract
+from utils.logger import setup_logger
+from utils.tracing import Span, continue_trace, current_span, get_tracer
+
+logger = setup_logger()
+
+DROP_NEWEST = "drop_newest"
+DROP_OLDEST = "drop_oldest"
+
+
+class PersistenceWriter:
+    """Single background writer persisting the remote abstracts to the vector store. Submissions
+    go through a bounded queue and are coalesced into batches, so that bursts of remote fetches
+    neither spawn threads nor write concurrently with each other.
+    """
+
+    def __init__(self, save: Callable[[List[Abstract]], None], max_pending: int,
+                 batch_size: int, policy: str = DROP_NEWEST) -> None:
+        """The constructor to start the writer thread.
+
+        Args:
+            save (Callable[[List[Abstract]], None]): Persists a deduplicated batch of abstracts.
+            max_pending (int): The maximum number of submissions waiting to be written.
+            batch_size (int): The maximum number of abstracts coalesced into a single write.
+            policy (str): What to drop when the queue is full, drop_newest|drop_oldest.
+        """
+        self.save = save
+        self.batch_size = batch_size
+        self.policy = policy
+        self.dropped = 0
+        # Set by the writer once it took the shutdown sentinel while coalescing a batch.
+        self.stopping = False
+
+        # Each submission along with the span it was submitted from.
+        self.pending: "queue.Queue[Optional[Tuple[List[Abstract], Optional[Span]]]]" = queue.Queue(
+            maxsize=max_pending)
+        self.thread = threading.Thread(
+            target=self.run, name="persistence-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, abstracts: List[Abstract]) -> bool:
+        """Queue the abstracts to be persisted, without blocking the caller.
+
+        Args:
+            abstracts (List[Abstract]): The abstracts to persist.
+
+        Returns:
+            bool: Whether the abstracts were queued, False if they were dropped.
+        """
+        if not abstracts:
+            return True
+
+        submission = (abstracts, current_span())
+        try:
+            self.pending.put_nowait(submission)
+            return True
+        except queue.Full:
+            pass
+
+        self.dropped += 1
+        if self.policy == DROP_OLDEST:
+            try:
+                oldest = self.pending.get_nowait()
+                if oldest is None:
+                    # Closing: the shutdown sentinel goes back, its place is not for the submission.
+                    self.pending.put(None)
+                    raise queue.Full
+                self.pending.put_nowait(submission)
+                logger.warning(
+                    f"Persistence queue full, dropped the oldest submission ({self.dropped} so far).")
+                return True
+            except (queue.Empty, queue.Full):
+                pass
+
+        logger.warning(
+            f"Persistence queue full, dropped {len(abstracts)} abstracts ({self.dropped} so far).")
+        return False
+
+    def collect(self) -> Optional[Tuple[List[Abstract], List[Optional[Span]]]]:
+        """Block for the next submission and coalesce the ones already waiting behind it.
+
+        Returns:
+            Optional[Tuple[List[Abstract], List[Optional[Span]]]]: The abstracts to write
+            deduplicated by arxiv_id and the spans they were submitted from, None once closed.
+        """
+        if self.stopping:
+            return None
+        first = self.pending.get()
+        if first is None:
+            return None
+
+        batch: Dict[str, Abstract] = {a.arxiv_id: a for a in first[0]}
+        parents = [first[1]]
+        while len(batch) < self.batch_size:
+            try:
+                submission = self.pending.get_nowait()
+            except queue.Empty:
+                break
+            if submission is None:
+                # Write what was collected, then stop on the next collect. Not put back, as the
+                # queue may have filled up meanwhile.
+                self.stopping = True
+                break
+            batch.update((a.arxiv_id, a) for a in submission[0])
+            parents.append(submission[1])
+
+        return list(batch.values()), parents
+
+    def run(self) -> None:
+        while True:
+            collected = self.collect()
+            if collected is None:
+                return
+
+            batch, parents = collected
+            try:
+                # Traced as part of the request of the first submission, linked to the others.
+                with continue_trace(parents[0]), get_tracer().span(
+                        "retrieval.persist", links=parents[1:], abstracts=len(batch)):
+                    self.save(batch)
+            except Exception as e:
+                logger.error(f"Failed to persist {len(batch)} abstracts: {e}")
+
+    def close(self) -> None:
+        """Stop the writer once everything queued so far has been written.
+        """
+        self.pending.put(None)
+        self.thread.join()
+        logger.info("Persistence writer drained.")
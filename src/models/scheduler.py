@@ -0,0 +1,205 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+
+from dto.request import GenerationParams
+from models.lm import LanguageModel
+from utils.config import load_config
+from utils.constants import Constants
+from utils.executors import get_inference_executor
+from utils.logger import setup_logger
+from utils.tracing import Span, continue_trace, current_span, get_tracer
+
+logger = setup_logger()
+config = load_config()
+
+
+class PendingFuture(Future):
+    """The future of a queued prompt. Cancelling it also sets its event, as a future whose batch is
+    already running can no longer be cancelled, the generation then cuts the prompt short.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.cancel_event = threading.Event()
+
+    def cancel(self) -> bool:
+        self.cancel_event.set()
+        return super().cancel()
+
+
+# A queued prompt, its generation parameters, the future of its completion and the span it was
+# submitted from.
+Pending = Tuple[str, Optional[GenerationParams], PendingFuture, Optional[Span]]
+
+
+class BatchScheduler:
+    """Inference scheduler in front of the LanguageModel, that collects the prompts arriving
+    within a short window and runs them as a single batched generation, routing each completion
+    back to its caller.
+    """
+
+    def __init__(self, lang_model: LanguageModel,
+                 max_batch_size: Optional[int] = None,
+                 max_wait_ms: Optional[float] = None) -> None:
+        """The constructor to start the scheduling thread.
+
+        Args:
+            lang_model (LanguageModel): The language model to run the batches on.
+            max_batch_size (Optional[int]): The maximum number of prompts per batch. Defaults to
+            the configured batch_size.
+            max_wait_ms (Optional[float]): The maximum time to wait for a batch to fill up after
+            its first prompt arrived. Defaults to the configured batch_wait_ms.
+        """
+        gen_config = config[Constants.GENERATOR]
+        self.lang_model = lang_model
+        self.max_batch_size = max_batch_size or gen_config[Constants.BATCH_SIZE]
+        self.max_wait = (max_wait_ms if max_wait_ms is not None
+                         else gen_config[Constants.BATCH_WAIT_MS]) / 1000
+
+        # One batch runs per replica of the model, the next batch fills up while they are busy.
+        self.slots = threading.Semaphore(lang_model.replicas)
+
+        self.pending: "queue.Queue[Optional[Pending]]" = queue.Queue()
+        self.thread = threading.Thread(
+            target=self.run, name="batch-scheduler", daemon=True)
+        self.thread.start()
+
+        logger.info(
+            f"Batch scheduler started with max batch size {self.max_batch_size} "
+            f"and max wait {self.max_wait * 1000:.0f}ms.")
+
+    def submit(self, prompt: str, params: Optional[GenerationParams] = None) -> "Future[str]":
+        """Queue a prompt for the next batch.
+
+        Args:
+            prompt (str): The full prompt to generate the completion for.
+            params (Optional[GenerationParams]): The generation parameters of the prompt, which
+            is batched with prompts of other parameters all the same.
+
+        Returns:
+            Future[str]: The future resolved with the completion once its batch has run, cancelling
+            it stops the generation of the prompt.
+        """
+        future = PendingFuture()
+        self.pending.put((prompt, params, future, current_span()))
+        return future
+
+    async def generate(self, prompt: str, params: Optional[GenerationParams] = None) -> str:
+        """Awaitable counterpart of LanguageModel.generate, batched with the other in-flight prompts.
+
+        Args:
+            prompt (str): The full prompt to generate the completion for.
+            params (Optional[GenerationParams]): The generation parameters of the prompt.
+
+        Returns:
+            str: The generated completion.
+        """
+        # Cancelling the caller cancels the wrapped future, and so the generation of the prompt.
+        return await asyncio.wrap_future(self.submit(prompt, params))
+
+    def collect(self) -> Optional[List[Pending]]:
+        """Block for the first prompt, then keep collecting until the batch is full or the
+        wait window has passed.
+
+        Returns:
+            Optional[List[Pending]]: The batch to run, None once the scheduler is closed.
+        """
+        item = self.pending.get()
+        if item is None:
+            return None
+
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Run what was collected, then stop on the next collect.
+                self.pending.put(None)
+                break
+            batch.append(item)
+
+        return batch
+
+    def run(self) -> None:
+        """The scheduling loop, as many batches as the model has replicas run at a time on the
+        inference executor, so that the prompts arriving meanwhile form the next, larger batch.
+        """
+        while True:
+            self.slots.acquire()
+            batch = self.collect()
+            if batch is None:
+                self.slots.release()
+                return
+
+            # Skip the prompts whose callers have already given up.
+            batch = [(prompt, params, future, parent) for prompt, params, future, parent in batch
+                     if future.set_running_or_notify_cancel()]
+            if not batch:
+                self.slots.release()
+                continue
+
+            prompts = [prompt for prompt, _, _, _ in batch]
+            # Each prompt keeps its own budget, temperature and stops within the batch.
+            params = ([params or GenerationParams() for _, params, _, _ in batch]
+                      if any(params for _, params, _, _ in batch) else None)
+            generation = get_inference_executor().submit(
+                self.run_batch, prompts, params, [parent for _, _, _, parent in batch],
+                [future.cancel_event for _, _, future, _ in batch])
+            generation.add_done_callback(
+                lambda generation, batch=batch: self.complete(batch, generation))
+
+    def run_batch(self, prompts: List[str], params: Optional[List[GenerationParams]],
+                  parents: List[Optional[Span]], cancels: List[threading.Event]) -> List[str]:
+        """Run the batch in a span of the trace of its first prompt, linked to the others.
+
+        Args:
+            prompts (List[str]): The prompts of the batch.
+            params (Optional[List[GenerationParams]]): The generation parameters of each prompt.
+            parents (List[Optional[Span]]): The spans the prompts were submitted from.
+            cancels (List[threading.Event]): The events set when the callers of the prompts give up.
+
+        Returns:
+            List[str]: The completions, in the same order as the prompts.
+        """
+        with continue_trace(parents[0]), get_tracer().span(
+                "lm.generate", links=parents[1:], batch_size=len(prompts)):
+            return self.lang_model.generate_batch(prompts, params=params, cancels=cancels)
+
+    def complete(self, batch: List[Pending], generation: "Future[List[str]]") -> None:
+        """Route the completions of a finished batch back to their callers.
+
+        Args:
+            batch (List[Pending]): The prompts of the batch and their futures.
+            generation (Future[List[str]]): The finished generation of the batch.
+        """
+        self.slots.release()
+        try:
+            completions = generation.result()
+        except Exception as e:
+            logger.error(f"Batched generation of {len(batch)} prompts failed: {e}")
+            for _, _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        logger.info(f"Generated a batch of {len(batch)} prompts.")
+        for (_, _, future, _), completion in zip(batch, completions):
+            future.set_result(completion)
+
+    def close(self) -> None:
+        """Stop the scheduler once the already queued prompts have been generated.
+        """
+        self.pending.put(None)
+        self.thread.join()
+        # Wait for the batches still running.
+        for _ in range(self.lang_model.replicas):
+            self.slots.acquire()
@@ -0,0 +1,140 @@
+"""Where a generated summary ends: at a stop sequence of the request, or when the LM goes on past
+the summary. That is when it starts another section of the prompt, lists the sources again or a
+block of bare citations, or emits a run of blank lines.
+
+Every built in stop starts at a newline, so the streamed text is only held back from a newline on,
+while what follows it could still turn into a stop.
+"""
+import re
+from typing import List, Optional, Sequence
+
+# The sections of the prompt templates, the LM writing one of them is past the summary.
+SECTION_NAMES = ("Sources", "Summary", "Instructions", "Query", "References")
+
+STOP_PATTERNS = [
+    # Another section of the prompt.
+    re.compile(r"\n[ \t]*(?:" + "|".join(SECTION_NAMES) + r")[ \t]*:"),
+    # A source in the format of the prompt, [ID] - "abstract".
+    re.compile(r"\n[ \t]*\[[^\]\n]+\][ \t]*-[ \t]*\""),
+    # A complete line of bare citations.
+    re.compile(r"\n[ \t]*(?:\[[^\]\n]+\][ \t,;.]*)+\n"),
+    # Two blank lines in a row.
+    re.compile(r"\n[ \t]*\n[ \t]*\n"),
+]
+
+# The start of a line that could still become a source or a line of bare citations.
+CITATIONS_PREFIX = re.compile(r"[ \t]*(?:\[[^\]\n]*\]?[ \t,;.]*)*(?:-[ \t]*)?")
+SECTION_PREFIX = re.compile(r"[ \t]*([A-Za-z]*)([ \t]*)")
+
+
+def find_stop(text: str, stops: Sequence[str] = ()) -> Optional[int]:
+    """Find where the summary ends in the generated text.
+
+    Args:
+        text (str): The text generated so far.
+        stops (Sequence[str]): The stop sequences of the request.
+
+    Returns:
+        Optional[int]: The position of the earliest stop, None if there is none yet.
+    """
+    positions = [match.start() for match in (pattern.search(text) for pattern in STOP_PATTERNS) if match]
+    positions.extend(position for position in (text.find(stop) for stop in stops) if position >= 0)
+    return min(positions) if positions else None
+
+
+def trim(text: str, stops: Sequence[str] = ()) -> str:
+    """The summary in the generated text, up to its first stop.
+    """
+    position = find_stop(text, stops)
+    return (text if position is None else text[:position]).strip()
+
+
+def could_stop(tail: str) -> bool:
+    """Whether the text from a newline on could still become a built in stop as more is generated.
+    """
+    *blank, last = tail.split("\n")[1:]
+    if any(line.strip() for line in blank):
+        return False
+    if CITATIONS_PREFIX.fullmatch(last):
+        return True
+
+    section = SECTION_PREFIX.fullmatch(last)
+    if section is None:
+        return False
+    word, space = section.groups()
+    # After a space only the colon can follow, the word must then be complete.
+    return any(name == word if space else name.startswith(word) for name in SECTION_NAMES)
+
+
+def held_from(text: str, stops: Sequence[str] = ()) -> int:
+    """The position from which the text could still be the start of a stop, and is held back.
+
+    Args:
+        text (str): The text generated so far, without a complete stop.
+        stops (Sequence[str]): The stop sequences of the request.
+
+    Returns:
+        int: The position up to which the text can be sent, its length if all of it.
+    """
+    held = len(text)
+    # The trailing partial matches of the stop sequences.
+    for stop in stops:
+        for length in range(min(len(stop) - 1, len(text)), 0, -1):
+            if stop.startswith(text[-length:]):
+                held = min(held, len(text) - length)
+                break
+
+    # The built in stops span at most a few lines.
+    newline = len(text)
+    for _ in range(3):
+        newline = text.rfind("\n", 0, newline)
+        if newline < 0:
+            break
+        if could_stop(text[newline:]):
+            held = min(held, newline)
+    return held
+
+
+class StopFilter:
+    """Relays the chunks of a streamed generation up to the first stop, holding back the text that
+    could still turn into one until it is known not to.
+    """
+
+    def __init__(self, stops: Optional[List[str]] = None) -> None:
+        self.stops = stops or []
+        self.text = ""
+        self.sent = 0
+        self.stopped = False
+
+    def feed(self, chunk: str) -> str:
+        """Add a generated chunk.
+
+        Args:
+            chunk (str): The next chunk of the generation.
+
+        Returns:
+            str: The text that can be sent, possibly empty.
+        """
+        if self.stopped:
+            return ""
+        self.text += chunk
+        # What was sent has no stop, one can only start from the held back text on.
+        start = max(self.sent - 1, 0)
+        position = find_stop(self.text[start:], self.stops)
+        if position is not None:
+            self.stopped = True
+            end = start + position
+        else:
+            end = held_from(self.text, self.stops)
+        released = self.text[self.sent:max(end, self.sent)]
+        self.sent = max(end, self.sent)
+        return released.rstrip() if self.stopped else released
+
+    def flush(self) -> str:
+        """The text held back when the generation ends without a stop.
+        """
+        if self.stopped:
+            return ""
+        released = self.text[self.sent:]
+        self.sent = len(self.text)
+        return released.rstrip()
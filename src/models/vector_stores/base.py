@@ -0,0 +1,94 @@
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Sequence
+
+from utils.config import load_config
+from utils.constants import Constants
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+# The fields get can return along with the ids.
+FIELDS = ("embeddings", "documents", "metadatas")
+
+
+class VectorStore(ABC):
+    """The storage of the documents, their embeddings and metadata behind the retrieval systems,
+    with the subset of the Chroma collection interface they use. Distances are squared L2, as in
+    the default space of Chroma, so the retriever threshold applies to every backend.
+    """
+
+    @abstractmethod
+    def count(self) -> int:
+        raise NotImplementedError("count method not implemented!")
+
+    @abstractmethod
+    def upsert(self, ids: List[str], embeddings: Any, documents: List[str],
+               metadatas: List[Any]) -> None:
+        """Add the documents, replacing the ones already stored under the same ids.
+
+        Args:
+            ids (List[str]): The ids of the documents, their arxiv_id.
+            embeddings (Any): The embeddings of the documents, one per row.
+            documents (List[str]): The documents, the abstracts.
+            metadatas (List[Any]): The metadata of each document.
+        """
+        raise NotImplementedError("upsert method not implemented!")
+
+    @abstractmethod
+    def query(self, query_embeddings: List[List[float]], n_results: int) -> Dict[str, List[List[Any]]]:
+        """Find the nearest documents of each query.
+
+        Args:
+            query_embeddings (List[List[float]]): The embeddings of the queries.
+            n_results (int): The maximum number of results per query.
+
+        Returns:
+            Dict[str, List[List[Any]]]: The ids, documents, metadatas and distances of the results
+            of each query, nearest first.
+        """
+        raise NotImplementedError("query method not implemented!")
+
+    @abstractmethod
+    def get(self, ids: Optional[List[str]] = None, include: Sequence[str] = ("documents", "metadatas"),
+            limit: Optional[int] = None, offset: int = 0) -> Dict[str, List[Any]]:
+        """Get documents by id, or a page of the documents in storage order.
+
+        Args:
+            ids (Optional[List[str]]): The ids to get, the ones not stored are left out.
+            include (Sequence[str]): The fields to return along with the ids, among FIELDS.
+            limit (Optional[int]): The maximum number of documents of a page, without ids.
+            offset (int): The number of documents to skip, without ids.
+
+        Returns:
+            Dict[str, List[Any]]: The ids and included fields of the documents found.
+        """
+        raise NotImplementedError("get method not implemented!")
+
+    def close(self) -> None:
+        pass
+
+
+def open_store(ret_config: Optional[Dict[str, Any]] = None) -> VectorStore:
+    """Open the configured vector store backend, importing only the selected one.
+
+    Args:
+        ret_config (Optional[Dict[str, Any]]): The retriever configuration, the loaded one by default.
+
+    Returns:
+        VectorStore: The store of the documents.
+    """
+    ret_config = ret_config or load_config()[Constants.RETRIVER]
+    backend = ret_config[Constants.BACKEND].lower()
+    logger.info(f"Opening the '{backend}' vector store under {ret_config[Constants.SAVE_FOLDER]}.")
+
+    if backend == "mmap":
+        from models.vector_stores.mmap_store import MmapStore
+
+        return MmapStore(
+            os.path.join(ret_config[Constants.SAVE_FOLDER], ret_config[Constants.COL_DOC]),
+            ret_config[Constants.IVF_LISTS], ret_config[Constants.IVF_PROBES])
+
+    from models.vector_stores.chroma import open_chroma
+
+    return open_chroma(ret_config)
@@ -0,0 +1,49 @@
+from typing import Any, Dict, List, Optional, Sequence
+
+import chromadb
+
+from models.vector_stores.base import VectorStore
+from models.vector_stores.shards import ShardedCollection
+from utils.constants import Constants
+
+
+class ChromaStore(VectorStore):
+    """A single Chroma collection, persisted by chromadb as sqlite and HNSW files.
+    """
+
+    def __init__(self, collection: Any) -> None:
+        self.collection = collection
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def upsert(self, ids: List[str], embeddings: Any, documents: List[str],
+               metadatas: List[Any]) -> None:
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def query(self, query_embeddings: List[List[float]], n_results: int) -> Dict[str, List[List[Any]]]:
+        return self.collection.query(
+            query_embeddings=query_embeddings, n_results=n_results,
+            include=["documents", "metadatas", "distances"])  # type: ignore
+
+    def get(self, ids: Optional[List[str]] = None, include: Sequence[str] = ("documents", "metadatas"),
+            limit: Optional[int] = None, offset: int = 0) -> Dict[str, List[Any]]:
+        if ids is not None and not ids:
+            return {"ids": [], **{field: [] for field in include}}
+        return self.collection.get(ids=ids, include=list(include), limit=limit, offset=offset)  # type: ignore
+
+
+def open_chroma(ret_config: Dict[str, Any]) -> VectorStore:
+    """Open the Chroma store of the configuration, sharded by category if enabled.
+
+    Args:
+        ret_config (Dict[str, Any]): The retriever configuration.
+
+    Returns:
+        VectorStore: The collection, or the ShardedCollection of its shards.
+    """
+    client = chromadb.PersistentClient(path=ret_config[Constants.SAVE_FOLDER])
+    if ret_config[Constants.SHARDED]:
+        return ShardedCollection(client, ret_config[Constants.COL_DOC], ret_config[Constants.SAVE_FOLDER],
+                                 ret_config[Constants.SHARDS_PER_QUERY])
+    return ChromaStore(client.get_or_create_collection(ret_config[Constants.COL_DOC]))
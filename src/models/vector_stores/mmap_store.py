@@ -0,0 +1,476 @@
+"""An in-process vector store of memory-mapped files. The workers of a host share its pages through
+the page cache instead of each holding a copy, and it opens in milliseconds whatever its size.
+
+The files under its folder:
+- embeddings.f16: the embeddings as float16 rows, and norms.f32 their squared norms.
+- A column per field, the ids, documents and each metadata key: the utf-8 values back to back in
+  <name>.data, located by the (start, length) pairs of <name>.index.
+- hashes.u64: the 64-bit hash of the id of each row. keys.u64 and keys.i32 hold the hashes in sorted
+  order and the row of each, to find documents by id.
+- The IVF index: the centroids in ivf_centroids.f32 and the list of each row in ivf_assign.i32. The
+  rows sorted by list are in ivf_rows.i32, bounded by ivf_offsets.i64.
+- replaced.i64: the rows superseded by a later upsert of their id, left out of every result.
+- meta.json: the dimension, the number of rows and replaced rows, how many rows the sorted keys
+  and IVF lists cover, and the generation counted up by every write, for the readers to remap.
+
+Rows are only ever appended, an upsert of a stored id appending its new version and recording the
+old row as replaced. The files are written past the rows published by meta.json, or replaced whole
+by compact, so the rows a snapshot maps never change under it. The space of replaced rows is not
+reclaimed.
+
+The tail is the rows past the ones covered by the sorted keys and the IVF lists. It is scanned
+exhaustively until it outgrows a fraction of the store, then compact folds it in. A query searches
+the lists closest to it, along with the tail.
+"""
+import fcntl
+import hashlib
+import json
+import math
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from models.vector_stores.base import FIELDS, VectorStore
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+META_FILE = "meta.json"
+LOCK_FILE = "write.lock"
+ID_COLUMN = "ids"
+DOCUMENT_COLUMN = "documents"
+# The prefix of the metadata columns, keeping them apart from the ids and documents.
+METADATA_PREFIX = "meta."
+
+# The tail is folded in once it holds this many rows, or a sixteenth of the store if more.
+MIN_TAIL = 4096
+TAIL_FRACTION = 1 / 16
+# Smaller stores are scanned exhaustively, without IVF lists.
+MIN_TRAIN = 1024
+# The lists are trained again once the store has grown this many times since their training.
+RETRAIN_GROWTH = 4
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 65536
+# The rows whose distances are computed at a time, bounding the float32 copies of the embeddings.
+CHUNK = 65536
+# The bytes of a (start, length) pair of a column index.
+PAIR_SIZE = 16
+
+
+def load_array(path: str, dtype: Any, width: int = 0) -> np.ndarray:
+    """Map a file of fixed size values read only, as rows of width values if given.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return np.zeros((0, width) if width else 0, dtype=dtype)
+    # A plain view of the map, indexing a memmap is several times slower and the view keeps it open.
+    array = np.asarray(np.memmap(path, dtype=dtype, mode="r"))
+    return array.reshape(-1, width) if width else array
+
+
+def append_bytes(path: str, data: bytes) -> None:
+    with open(path, "ab") as f:
+        f.write(data)
+
+
+def write_at(path: str, offset: int, data: bytes) -> None:
+    # Written at the position of the rows rather than appended, so that the leftovers of an
+    # interrupted write past the published rows are overwritten.
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        os.pwrite(fd, data, offset)
+    finally:
+        os.close(fd)
+
+
+def replace_array(path: str, values: np.ndarray) -> None:
+    # Replaced rather than rewritten, the processes still mapping the old file keep a consistent copy.
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(np.ascontiguousarray(values).tobytes())
+    os.replace(f"{path}.tmp", path)
+
+
+def hash_ids(ids: Sequence[str]) -> np.ndarray:
+    return np.array([int.from_bytes(hashlib.blake2b(id_.encode("utf-8"), digest_size=8).digest(), "little")
+                     for id_ in ids], dtype=np.uint64)
+
+
+def nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """The index of the closest centroid of each vector, in squared L2 distance.
+    """
+    assigned = np.empty(len(vectors), dtype=np.int32)
+    squared = (centroids * centroids).sum(axis=1)
+    for start in range(0, len(vectors), CHUNK):
+        chunk = np.asarray(vectors[start:start + CHUNK], dtype=np.float32)
+        assigned[start:start + CHUNK] = np.argmin(squared - 2 * chunk @ centroids.T, axis=1)
+    return assigned
+
+
+def kmeans(vectors: np.ndarray, k: int, seed: int = 0) -> np.ndarray:
+    """Train k centroids with Lloyd's algorithm, empty clusters being reseeded at random vectors.
+
+    Args:
+        vectors (np.ndarray): The training vectors, one per row.
+        k (int): The number of centroids.
+        seed (int): The seed of the initial centroids.
+
+    Returns:
+        np.ndarray: The centroids, one per row.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assigned = nearest(vectors, centroids)
+        order = np.argsort(assigned, kind="stable")
+        counts = np.bincount(assigned, minlength=k)
+        filled = np.flatnonzero(counts)
+        sums = np.add.reduceat(vectors[order], np.concatenate(([0], np.cumsum(counts)[:-1]))[filled])
+        centroids[filled] = sums / counts[filled, None]
+        empty = np.flatnonzero(counts == 0)
+        centroids[empty] = vectors[rng.choice(len(vectors), len(empty))]
+    return centroids
+
+
+class Column:
+    """A column of strings, their utf-8 bytes appended to the data and located by the pair of their row.
+    """
+
+    def __init__(self, folder: str, name: str) -> None:
+        self.data_path = os.path.join(folder, f"{name}.data")
+        self.index_path = os.path.join(folder, f"{name}.index")
+        self.index = load_array(self.index_path, np.uint64, 2)
+        self.data = load_array(self.data_path, np.uint8)
+
+    def value(self, row: int) -> str:
+        if row >= len(self.index):
+            return ""
+        start, length = (int(v) for v in self.index[row])
+        return bytes(self.data[start:start + length]).decode("utf-8")
+
+    def write(self, rows: Sequence[int], values: Sequence[str]) -> None:
+        """Write the values of the rows, each pair at the position of its row. The column grows to
+        the last of the rows, the rows it skips, such as the earlier rows of a column added
+        later, being empty.
+
+        Args:
+            rows (Sequence[int]): The rows, past the ones published.
+            values (Sequence[str]): The value of each row.
+        """
+        if not len(rows):
+            return
+        encoded = [value.encode("utf-8") for value in values]
+        start = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        lengths = np.array([len(data) for data in encoded], dtype=np.uint64)
+        pairs = np.stack([start + np.cumsum(lengths) - lengths, lengths], axis=1).astype(np.uint64)
+        append_bytes(self.data_path, b"".join(encoded))
+
+        positions = np.asarray(rows, dtype=np.int64)
+        order = np.argsort(positions, kind="stable")
+        positions, pairs = positions[order], pairs[order]
+        first, end = int(positions[0]), int(positions[-1]) + 1
+        stored = os.path.getsize(self.index_path) // PAIR_SIZE if os.path.exists(self.index_path) else 0
+        # The rows from the end of the column or the first row to the last, the gaps being empty.
+        block_start = min(first, stored)
+        block = np.zeros((end - block_start, 2), dtype=np.uint64)
+        if block_start < first:
+            write_at(self.index_path, block_start * PAIR_SIZE, block[:first - block_start].tobytes())
+            block = block[first - block_start:]
+        if end - first == len(positions):
+            write_at(self.index_path, first * PAIR_SIZE, pairs.tobytes())
+        else:
+            block[positions - first] = pairs
+            write_at(self.index_path, first * PAIR_SIZE, block.tobytes())
+
+
+class Snapshot:
+    """The files of the store mapped as of a version of its meta, replaced as a whole when the
+    store changes. The writes past its rows, or to replaced files, leave what it maps unchanged.
+    """
+
+    def __init__(self, folder: str, meta: Dict[str, Any]) -> None:
+        self.meta = meta
+        count, dim = meta["count"], meta["dim"]
+        self.count = count
+        self.embeddings = load_array(os.path.join(folder, "embeddings.f16"), np.float16, dim)[:count] \
+            if dim else np.zeros((0, 0), dtype=np.float16)
+        self.norms = load_array(os.path.join(folder, "norms.f32"), np.float32)[:count]
+        self.hashes = load_array(os.path.join(folder, "hashes.u64"), np.uint64)[:count]
+        self.keys = load_array(os.path.join(folder, "keys.u64"), np.uint64)
+        self.key_rows = load_array(os.path.join(folder, "keys.i32"), np.int32)
+        # The rows not covered by the sorted keys yet, the latest row of an id winning.
+        self.tail_keys = {int(h): row for row, h in enumerate(self.hashes[meta["keyed"]:], start=meta["keyed"])}
+        replaced = load_array(os.path.join(folder, "replaced.i64"), np.int64)[:meta["replaced"]]
+        self.live = count - len(replaced)
+        self.superseded: Optional[np.ndarray] = None
+        if len(replaced):
+            self.superseded = np.zeros(count, dtype=bool)
+            self.superseded[replaced] = True
+
+        self.indexed = meta["indexed"]
+        self.centroids = np.asarray(load_array(os.path.join(folder, "ivf_centroids.f32"), np.float32, dim)) \
+            if dim and self.indexed else np.zeros((0, dim), dtype=np.float32)
+        self.centroid_norms = (self.centroids * self.centroids).sum(axis=1)
+        self.ivf_rows = load_array(os.path.join(folder, "ivf_rows.i32"), np.int32)
+        self.ivf_offsets = load_array(os.path.join(folder, "ivf_offsets.i64"), np.int64)
+
+        self.ids = Column(folder, ID_COLUMN)
+        self.documents = Column(folder, DOCUMENT_COLUMN)
+        self.metadata = {key: Column(folder, METADATA_PREFIX + key) for key in meta["columns"]}
+
+    def find(self, ids: Sequence[str]) -> np.ndarray:
+        """The row of each id, -1 for the ones not stored.
+        """
+        hashes = hash_ids(ids)
+        # The tail first, holding the latest version of the ids upserted since the keys were sorted.
+        rows = np.array([self.tail_keys.get(int(key), -1) for key in hashes], dtype=np.int64)
+        if len(self.keys):
+            positions = np.minimum(np.searchsorted(self.keys, hashes), len(self.keys) - 1)
+            found = (rows < 0) & (self.keys[positions] == hashes)
+            rows[found] = self.key_rows[positions[found]]
+        # Only a hash collision would find another document.
+        for i, row in enumerate(rows):
+            if row >= 0 and self.ids.value(int(row)) != ids[i]:
+                rows[i] = -1
+        return rows
+
+    def live_rows(self) -> np.ndarray:
+        """The rows not superseded, in storage order.
+        """
+        return np.arange(self.count) if self.superseded is None else np.flatnonzero(~self.superseded)
+
+    def metadata_of(self, row: int) -> Dict[str, str]:
+        return {key: column.value(row) for key, column in self.metadata.items()}
+
+    def candidates(self, query: np.ndarray, probes: int) -> Optional[np.ndarray]:
+        """The rows to search for the query: those of its closest lists and the tail, None for all.
+        """
+        if not len(self.centroids) or probes >= len(self.centroids):
+            return None
+        closest = np.argpartition(self.centroid_norms - 2 * self.centroids @ query, probes)[:probes]
+        lists = [self.ivf_rows[self.ivf_offsets[i]:self.ivf_offsets[i + 1]] for i in closest]
+        return np.concatenate(lists + [np.arange(self.indexed, self.count, dtype=np.int32)])
+
+    def search(self, query: np.ndarray, n_results: int, probes: int) -> List[Tuple[float, int]]:
+        """The nearest rows of the query and their squared L2 distances, nearest first.
+        """
+        rows = self.candidates(query, probes)
+        squared = float(query @ query)
+        distances: List[np.ndarray] = []
+        if rows is None:
+            for start in range(0, self.count, CHUNK):
+                chunk = np.asarray(self.embeddings[start:start + CHUNK], dtype=np.float32)
+                distances.append(self.norms[start:start + CHUNK] + squared - 2 * chunk @ query)
+            rows = np.arange(self.count)
+        else:
+            rows = np.sort(rows)
+            for start in range(0, len(rows), CHUNK):
+                chunk_rows = rows[start:start + CHUNK]
+                chunk = np.asarray(self.embeddings[chunk_rows], dtype=np.float32)
+                distances.append(self.norms[chunk_rows] + squared - 2 * chunk @ query)
+        if not len(rows):
+            return []
+
+        all_distances = np.concatenate(distances)
+        if self.superseded is not None:
+            all_distances[self.superseded[rows]] = np.inf
+        n = min(n_results, int(np.isfinite(all_distances).sum()))
+        if not n:
+            return []
+        top = np.argpartition(all_distances, n - 1)[:n]
+        top = top[np.argsort(all_distances[top])]
+        return [(max(float(all_distances[i]), 0.0), int(rows[i])) for i in top]
+
+
+class MmapStore(VectorStore):
+    """The documents in memory-mapped files, searched with an IVF index over float16 embeddings.
+    Several processes may read and write the same store, the writes being serialized by a file lock.
+    """
+
+    def __init__(self, folder: str, ivf_lists: int = 0, ivf_probes: int = 8) -> None:
+        """
+        Args:
+            folder (str): The folder of the files of the store, created if missing.
+            ivf_lists (int): The number of IVF lists, 0 picks about the square root of the documents.
+            ivf_probes (int): The number of lists searched per query.
+        """
+        self.folder = folder
+        self.ivf_lists = ivf_lists
+        self.ivf_probes = ivf_probes
+        os.makedirs(folder, exist_ok=True)
+        self.lock = threading.Lock()
+        self.version: Optional[int] = None
+        self.snapshot = self.current()
+        logger.info(
+            f"Opened the mmap store {folder} with {self.snapshot.live} documents "
+            f"and {len(self.snapshot.centroids)} IVF lists.")
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.folder, META_FILE)
+
+    def read_meta(self) -> Dict[str, Any]:
+        if not os.path.exists(self.meta_path):
+            return {"dim": 0, "count": 0, "keyed": 0, "indexed": 0, "trained": 0, "replaced": 0, "columns": [],
+                    "generation": 0}
+        with open(self.meta_path) as f:
+            return json.load(f)
+
+    def write_meta(self, meta: Dict[str, Any]) -> None:
+        # Written last, the files it points into are complete by then.
+        meta["generation"] = meta.get("generation", 0) + 1
+        with open(f"{self.meta_path}.tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(f"{self.meta_path}.tmp", self.meta_path)
+
+    def current(self) -> Snapshot:
+        """The snapshot of the latest version of the store, remapped after a write of any process.
+        The generation of the meta tells the versions apart, as the writes of a same timestamp tick
+        of the filesystem leave its modification time unchanged.
+        """
+        meta = self.read_meta()
+        version = meta.get("generation", 0)
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.snapshot = Snapshot(self.folder, meta)
+                    self.version = version
+        return self.snapshot
+
+    @contextmanager
+    def writing(self) -> Iterator[Dict[str, Any]]:
+        """Hold the write lock of the store over the block, yielding its latest meta.
+        """
+        with self.lock, open(os.path.join(self.folder, LOCK_FILE), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield self.read_meta()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def count(self) -> int:
+        return self.current().live
+
+    def upsert(self, ids: List[str], embeddings: Any, documents: List[str],
+               metadatas: List[Any]) -> None:
+        """Append the documents, recording the rows of the ones already stored as replaced.
+        """
+        # The last occurrence of a duplicate id wins.
+        latest = {id_: i for i, id_ in enumerate(ids)}
+        order = list(latest.values())
+        if not order:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)[order]
+        ids = [ids[i] for i in order]
+        documents = [documents[i] for i in order]
+        metadatas = [dict(metadatas[i] or {}) for i in order]
+
+        with self.writing() as meta:
+            if not meta["dim"]:
+                meta["dim"] = int(vectors.shape[1])
+            if vectors.shape[1] != meta["dim"]:
+                raise ValueError(f"Embeddings of dimension {vectors.shape[1]}, the store holds {meta['dim']}.")
+
+            replaced = Snapshot(self.folder, meta).find(ids)
+            replaced = replaced[replaced >= 0]
+            count, dim = meta["count"], meta["dim"]
+            rows = list(range(count, count + len(ids)))
+
+            halves = vectors.astype(np.float16)
+            norms = (halves.astype(np.float32) ** 2).sum(axis=1).astype(np.float32)
+            write_at(os.path.join(self.folder, "embeddings.f16"), count * dim * 2, halves.tobytes())
+            write_at(os.path.join(self.folder, "norms.f32"), count * 4, norms.tobytes())
+            write_at(os.path.join(self.folder, "hashes.u64"), count * 8, hash_ids(ids).tobytes())
+            write_at(os.path.join(self.folder, "replaced.i64"), meta["replaced"] * 8, replaced.tobytes())
+
+            Column(self.folder, ID_COLUMN).write(rows, ids)
+            Column(self.folder, DOCUMENT_COLUMN).write(rows, documents)
+            keys = list(dict.fromkeys(meta["columns"] + [key for metadata in metadatas for key in metadata]))
+            for key in keys:
+                Column(self.folder, METADATA_PREFIX + key).write(
+                    rows, ["" if metadata.get(key) is None else str(metadata[key]) for metadata in metadatas])
+
+            meta["columns"] = keys
+            meta["count"] += len(ids)
+            meta["replaced"] += len(replaced)
+            tail = meta["count"] - min(meta["keyed"], meta["indexed"] or meta["count"])
+            if tail > max(MIN_TAIL, meta["count"] * TAIL_FRACTION):
+                self.compact_locked(meta)
+            self.write_meta(meta)
+
+    def compact(self) -> None:
+        """Fold the tail into the sorted keys and the IVF lists now, e.g. after a bulk load.
+        """
+        with self.writing() as meta:
+            self.compact_locked(meta)
+            self.write_meta(meta)
+
+    def compact_locked(self, meta: Dict[str, Any]) -> None:
+        snapshot = Snapshot(self.folder, meta)
+        count = meta["count"]
+        live = snapshot.live_rows()
+        order = live[np.argsort(snapshot.hashes[live], kind="stable")].astype(np.int32)
+        replace_array(os.path.join(self.folder, "keys.u64"), snapshot.hashes[order])
+        replace_array(os.path.join(self.folder, "keys.i32"), order)
+        meta["keyed"] = count
+
+        if len(live) < MIN_TRAIN:
+            return
+        lists = self.ivf_lists or max(1, int(math.sqrt(len(live))))
+        assign_path = os.path.join(self.folder, "ivf_assign.i32")
+        trained = meta["trained"]
+        if not trained or count >= trained * RETRAIN_GROWTH or \
+                (self.ivf_lists and self.ivf_lists != len(snapshot.centroids)):
+            rng = np.random.default_rng(0)
+            sample = np.sort(rng.choice(live, min(len(live), max(KMEANS_SAMPLE, 64 * lists)), replace=False))
+            centroids = kmeans(np.asarray(snapshot.embeddings[sample], dtype=np.float32), min(lists, len(sample)))
+            replace_array(os.path.join(self.folder, "ivf_centroids.f32"), centroids.astype(np.float32))
+            replace_array(assign_path, nearest(snapshot.embeddings, centroids))
+            meta["trained"] = count
+            logger.info(f"Trained {len(centroids)} IVF lists on {len(sample)} of {count} documents.")
+        else:
+            write_at(assign_path, meta["indexed"] * 4,
+                     nearest(snapshot.embeddings[meta["indexed"]:], snapshot.centroids).tobytes())
+
+        # The lists hold the live rows only, every row keeping its assignment.
+        assigned = load_array(assign_path, np.int32)[:count][live]
+        lists = len(load_array(os.path.join(self.folder, "ivf_centroids.f32"), np.float32, meta["dim"]))
+        replace_array(os.path.join(self.folder, "ivf_rows.i32"),
+                      live[np.argsort(assigned, kind="stable")].astype(np.int32))
+        replace_array(os.path.join(self.folder, "ivf_offsets.i64"), np.concatenate(
+            ([0], np.cumsum(np.bincount(assigned, minlength=lists)))).astype(np.int64))
+        meta["indexed"] = count
+
+    def query(self, query_embeddings: List[List[float]], n_results: int) -> Dict[str, List[List[Any]]]:
+        snapshot = self.current()
+        results: Dict[str, List[List[Any]]] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for query in np.asarray(query_embeddings, dtype=np.float32):
+            hits = snapshot.search(query, n_results, self.ivf_probes) if snapshot.live else []
+            results["distances"].append([distance for distance, _ in hits])
+            results["ids"].append([snapshot.ids.value(row) for _, row in hits])
+            results["documents"].append([snapshot.documents.value(row) for _, row in hits])
+            results["metadatas"].append([snapshot.metadata_of(row) for _, row in hits])
+        return results
+
+    def get(self, ids: Optional[List[str]] = None, include: Sequence[str] = ("documents", "metadatas"),
+            limit: Optional[int] = None, offset: int = 0) -> Dict[str, List[Any]]:
+        snapshot = self.current()
+        if ids is not None:
+            rows = [int(row) for row in snapshot.find(ids) if row >= 0] if ids and snapshot.count else []
+        else:
+            live = snapshot.live_rows()
+            rows = live[offset:] if limit is None else live[offset:offset + limit]
+            rows = [int(row) for row in rows]
+
+        found: Dict[str, List[Any]] = {"ids": [snapshot.ids.value(row) for row in rows]}
+        for field in include:
+            if field not in FIELDS:
+                raise ValueError(f"Unknown field '{field}', expected one of {FIELDS}.")
+            if field == "embeddings":
+                found[field] = [np.asarray(snapshot.embeddings[row], dtype=np.float32) for row in rows]
+            elif field == "documents":
+                found[field] = [snapshot.documents.value(row) for row in rows]
+            else:
+                found[field] = [snapshot.metadata_of(row) for row in rows]
+        return found
@@ -0,0 +1,341 @@
+"""Partitioning of the vector store into a Chroma collection per primary ArXiv category, so that a
+query only searches the few shards it is routed to instead of the whole store.
+
+A document goes to the shard of its first category, the primary one in the ArXiv feeds. The router
+keeps the centroid of each shard, the mean of its normalized embeddings, and sends a query to the
+shards whose centroids are the most similar to it. The shards are queried in parallel and their
+results merged by distance, behind the same VectorStore interface as a single collection.
+"""
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from models.vector_stores.base import VectorStore
+from utils.executors import get_shard_executor, submit_in_context
+from utils.logger import setup_logger
+from utils.metrics import SHARD_QUERIES
+
+logger = setup_logger()
+
+SHARD_SEPARATOR = "__"
+UNCATEGORIZED = "uncategorized"
+CENTROIDS_FILE = "shard_centroids.json"
+# The most seconds between saves of the centroids while documents are added, they are saved on
+# close too.
+CENTROIDS_SAVE_SECONDS = 30
+# The characters allowed in the name of a Chroma collection.
+INVALID_NAME_CHARS = re.compile(r"[^A-Za-z0-9._-]")
+
+
+def primary_category(categories: Optional[str]) -> str:
+    """The primary category of a document, the first of its comma separated categories.
+
+    Args:
+        categories (Optional[str]): The categories of the document, e.g. "cs.CL, cs.LG".
+
+    Returns:
+        str: The primary category, uncategorized if there is none.
+    """
+    first = (categories or "").split(",")[0].strip()
+    return first or UNCATEGORIZED
+
+
+def shard_name(collection_docs: str, category: str) -> str:
+    return f"{collection_docs}{SHARD_SEPARATOR}{INVALID_NAME_CHARS.sub('_', category)}"
+
+
+class CentroidRouter:
+    """The centroid of each shard, kept as the sum and count of its normalized embeddings so that
+    it is updated incrementally as documents are added, and persisted next to the store.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Args:
+            path (str): The JSON file the centroids are persisted to.
+        """
+        self.path = path
+        self.sums: Dict[str, np.ndarray] = {}
+        self.counts: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        # The stacked centroids, rebuilt on the first route after a change.
+        self.matrix: Optional[np.ndarray] = None
+        self.names: List[str] = []
+        # Whether the centroids changed since they were last saved, and when that was.
+        self.dirty = False
+        self.saved_at = time.monotonic()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                for name, entry in json.load(f).items():
+                    self.sums[name] = np.asarray(entry["sum"], dtype=np.float32)
+                    self.counts[name] = int(entry["count"])
+
+    def __contains__(self, shard: str) -> bool:
+        return shard in self.counts
+
+    def add(self, shard: str, embeddings: Any, sign: int = 1) -> None:
+        """Account for documents added to the shard, or removed from it with a sign of -1.
+
+        Args:
+            shard (str): The name of the shard.
+            embeddings (Any): The embeddings of the documents, one per row.
+            sign (int): 1 for added documents, -1 for removed ones.
+        """
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if not len(vectors):
+            return
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        total = sign * (vectors / np.maximum(norms, 1e-12)).sum(axis=0)
+
+        with self.lock:
+            self.sums[shard] = self.sums[shard] + total if shard in self.sums else total
+            self.counts[shard] = self.counts.get(shard, 0) + sign * len(vectors)
+            if self.counts[shard] <= 0:
+                del self.sums[shard], self.counts[shard]
+            self.matrix = None
+            self.dirty = True
+
+    def save(self) -> None:
+        with self.lock:
+            entries = {name: {"count": self.counts[name], "sum": self.sums[name].tolist()}
+                       for name in self.counts}
+            self.dirty = False
+            self.saved_at = time.monotonic()
+        # Written to a temporary file first so an interruption never leaves a partial file.
+        with open(f"{self.path}.tmp", "w") as f:
+            json.dump(entries, f)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def route(self, embedding: Sequence[float], shards: Sequence[str], k: int) -> List[str]:
+        """Pick the shards to search for a query.
+
+        Args:
+            embedding (Sequence[float]): The embedding of the query.
+            shards (Sequence[str]): The names of the existing shards.
+            k (int): The number of shards to search, 0 searches all of them.
+
+        Returns:
+            List[str]: The k shards with the centroids most similar to the query, along with the
+            shards without a centroid yet, whose content is unknown.
+        """
+        if not k or len(shards) <= k:
+            return list(shards)
+
+        with self.lock:
+            if self.matrix is None:
+                self.names = list(self.sums)
+                sums = np.stack([self.sums[name] for name in self.names]) if self.names else \
+                    np.zeros((0, len(embedding)), dtype=np.float32)
+                self.matrix = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+            matrix, names = self.matrix, self.names
+
+        candidates = set(shards)
+        unknown = [shard for shard in shards if shard not in self.counts]
+        similarities = matrix @ np.asarray(embedding, dtype=np.float32)
+        ranked = [names[i] for i in np.argsort(-similarities) if names[i] in candidates]
+        return ranked[:k] + unknown
+
+
+class ShardedCollection(VectorStore):
+    """A collection partitioned into a Chroma collection per primary category.
+    """
+
+    def __init__(self, client: Any, collection_docs: str, save_folder: str,
+                 shards_per_query: int) -> None:
+        """
+        Args:
+            client (Any): The Chroma client of the store.
+            collection_docs (str): The name of the unsharded collection, the prefix of the shards.
+            save_folder (str): The folder of the store, where the centroids are persisted.
+            shards_per_query (int): The number of shards searched per query, 0 searches all of them.
+        """
+        self.client = client
+        self.prefix = f"{collection_docs}{SHARD_SEPARATOR}"
+        self.shards_per_query = shards_per_query
+        self.lock = threading.Lock()
+        self.shards = {collection.name: collection for collection in client.list_collections()
+                       if collection.name.startswith(self.prefix)}
+
+        self.router = CentroidRouter(os.path.join(save_folder, CENTROIDS_FILE))
+        missing = [name for name in self.shards if name not in self.router]
+        for name in missing:
+            self.build_centroid(name)
+        if missing:
+            self.router.save()
+
+        logger.info(
+            f"Opened {len(self.shards)} shards of '{collection_docs}', searching "
+            f"{shards_per_query or 'all'} per query.")
+
+    def build_centroid(self, name: str, page_size: int = 1000) -> None:
+        """Compute the centroid of a shard from its stored embeddings, page by page.
+        """
+        offset = 0
+        while True:
+            page = self.shards[name].get(include=["embeddings"], limit=page_size, offset=offset)
+            embeddings = page.get("embeddings")
+            if embeddings is None or not len(embeddings):
+                break
+            self.router.add(name, embeddings)
+            offset += len(embeddings)
+
+    def shard(self, category: str) -> Any:
+        """The collection of a category, created on its first document.
+        """
+        name = shard_name(self.prefix[:-len(SHARD_SEPARATOR)], category)
+        with self.lock:
+            if name not in self.shards:
+                self.shards[name] = self.client.get_or_create_collection(name)
+                logger.info(f"Created the shard '{name}'.")
+            return self.shards[name]
+
+    def count(self) -> int:
+        return sum(collection.count() for collection in list(self.shards.values()))
+
+    def locate(self, ids: List[str]) -> Dict[str, Tuple[List[str], List[Any]]]:
+        """Find the shards the documents are stored in, looking in every shard in parallel.
+
+        Returns:
+            Dict[str, Tuple[List[str], List[Any]]]: The ids found in each shard, with their embeddings.
+        """
+        futures = {name: submit_in_context(get_shard_executor(), collection.get, ids=ids, include=["embeddings"])
+                   for name, collection in list(self.shards.items())}
+        located = {}
+        for name, future in futures.items():
+            page = future.result()
+            if page["ids"]:
+                located[name] = (page["ids"], list(page["embeddings"]))
+        return located
+
+    def upsert(self, ids: List[str], embeddings: Any, documents: List[str],
+               metadatas: List[Any]) -> None:
+        """Write the documents to the shards of their primary categories, updating the centroids
+        with the documents not stored yet. A document whose primary category changed is moved,
+        deleted from its previous shard so that queries do not return it twice.
+        """
+        groups: Dict[str, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            category = primary_category((metadata or {}).get("categories"))
+            groups.setdefault(category, []).append(i)
+
+        targets = {ids[i]: self.shard(category).name for category, indices in groups.items() for i in indices}
+        existing = set()
+        for name, (found, found_embeddings) in self.locate(ids).items():
+            moved = [row for row, id_ in enumerate(found) if targets[id_] != name]
+            existing.update(id_ for id_ in found if targets[id_] == name)
+            if moved:
+                self.shards[name].delete(ids=[found[row] for row in moved])
+                self.router.add(name, [found_embeddings[row] for row in moved], sign=-1)
+
+        for category, indices in groups.items():
+            collection = self.shard(category)
+            shard_ids = [ids[i] for i in indices]
+            shard_embeddings = [embeddings[i] for i in indices]
+            collection.upsert(
+                ids=shard_ids,
+                embeddings=shard_embeddings,
+                documents=[documents[i] for i in indices],
+                metadatas=[metadatas[i] for i in indices]
+            )
+            self.router.add(collection.name, [embedding for id_, embedding in zip(shard_ids, shard_embeddings)
+                                              if id_ not in existing])
+
+        # Saved now and then rather than on every write, the routing uses the centroids in memory.
+        if time.monotonic() - self.router.saved_at >= CENTROIDS_SAVE_SECONDS:
+            self.router.save()
+
+    def close(self) -> None:
+        """Save the centroids changed since their last save.
+        """
+        if self.router.dirty:
+            self.router.save()
+
+    def query(self, query_embeddings: List[List[float]], n_results: int) -> Dict[str, List[List[Any]]]:
+        """Search the shards each query is routed to, in parallel, merging their results by distance.
+
+        Args:
+            query_embeddings (List[List[float]]): The embeddings of the queries.
+            n_results (int): The maximum number of results per query.
+
+        Returns:
+            Dict[str, List[List[Any]]]: The ids, documents, metadatas and distances of the results
+            of each query, nearest first, as returned by a single collection.
+        """
+        names = list(self.shards)
+        routed: Dict[str, List[int]] = {}
+        for i, embedding in enumerate(query_embeddings):
+            for name in self.router.route(embedding, names, self.shards_per_query):
+                routed.setdefault(name, []).append(i)
+
+        # Each shard is queried once, for all the queries routed to it.
+        futures = {name: submit_in_context(
+            get_shard_executor(), self.shards[name].query,
+            query_embeddings=[query_embeddings[i] for i in indices], n_results=n_results)
+            for name, indices in routed.items()}
+
+        hits: List[List[tuple]] = [[] for _ in query_embeddings]
+        for name, future in futures.items():
+            results = future.result()
+            SHARD_QUERIES.inc(len(routed[name]), shard=name[len(self.prefix):])
+            for row, i in enumerate(routed[name]):
+                hits[i].extend(zip(results["distances"][row], results["ids"][row],
+                                   results["documents"][row], results["metadatas"][row]))
+
+        merged: Dict[str, List[List[Any]]] = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for query_hits in hits:
+            query_hits = sorted(query_hits, key=lambda hit: hit[0])[:n_results]
+            merged["distances"].append([hit[0] for hit in query_hits])
+            merged["ids"].append([hit[1] for hit in query_hits])
+            merged["documents"].append([hit[2] for hit in query_hits])
+            merged["metadatas"].append([hit[3] for hit in query_hits])
+        return merged
+
+    def get(self, ids: Optional[List[str]] = None, include: Sequence[str] = ("documents", "metadatas"),
+            limit: Optional[int] = None, offset: int = 0) -> Dict[str, List[Any]]:
+        """Get documents by id from every shard, or page through the shards one after the other.
+
+        Args:
+            ids (Optional[List[str]]): The ids to get, in any shard.
+            include (Sequence[str]): The fields to return along with the ids.
+            limit (Optional[int]): The maximum number of documents of a page, without ids.
+            offset (int): The number of documents to skip, without ids.
+
+        Returns:
+            Dict[str, List[Any]]: The ids and included fields of the documents found.
+        """
+        found: Dict[str, List[Any]] = {"ids": [], **{field: [] for field in include}}
+        collections = list(self.shards.values())
+        if ids is not None:
+            if not ids:
+                return found
+            pages = [submit_in_context(get_shard_executor(), collection.get, ids=ids, include=list(include))
+                     for collection in collections]
+            pages = [page.result() for page in pages]
+        else:
+            pages = []
+            for collection in collections:
+                if limit is not None and limit <= 0:
+                    break
+                size = collection.count()
+                if offset >= size:
+                    offset -= size
+                    continue
+                page = collection.get(include=list(include), limit=limit, offset=offset)
+                pages.append(page)
+                offset = 0
+                if limit is not None:
+                    limit -= len(page["ids"])
+
+        for page in pages:
+            found["ids"].extend(page["ids"])
+            for field in include:
+                values = page.get(field)
+                found[field].extend(values if values is not None else [])
+        return found
+
@@ -0,0 +1,340 @@
+import asyncio
+import itertools
+import threading
+import time
+from concurrent.futures import Future, wait
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import torch.multiprocessing as mp
+
+from dto.request import GenerationParams
+from models.cancellation import watch_cancels
+from models.inference_worker import (CANCEL, CHUNK, ERROR, GENERATE, PING, PONG, PREFIX, READY, RESULT,
+                                     STREAM, worker_main)
+from models.lm import LanguageModel
+from utils.config import load_config
+from utils.constants import Constants
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+# Receives the messages answering a request, returns True once the request is complete.
+Handler = Callable[[str, Any], bool]
+
+
+class WorkerHandle:
+    """The pool's side of an inference worker process: its pipe, the requests in flight on it and
+    the thread routing its messages back to their handlers.
+    """
+
+    def __init__(self, index: int, context: Any, shared: Optional[LanguageModel], config: dict) -> None:
+        """Start the worker process and hand it the model.
+
+        Args:
+            index (int): The index of the worker in the pool.
+            context (Any): The multiprocessing context to start the process with.
+            shared (Optional[LanguageModel]): The model with its weights in shared memory, None
+            for the worker to load its own.
+            config (dict): The configuration of the pool.
+        """
+        self.index = index
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=worker_main, args=(child_conn, config), name=f"inference-worker-{index}", daemon=True)
+        self.process.start()
+        child_conn.close()
+
+        self.lock = threading.Lock()
+        self.pending: Dict[int, Handler] = {}
+        self.ready = False
+        self.last_pong = time.monotonic()
+        # The seconds the worker had spent on its current request at its last pong, None when idle.
+        self.busy_for: Optional[float] = None
+
+        self.conn.send(shared)
+        self.reader = threading.Thread(
+            target=self.read, name=f"inference-reader-{index}", daemon=True)
+        self.reader.start()
+
+    @property
+    def load(self) -> int:
+        return len(self.pending)
+
+    def submit(self, request_id: int, op: str, payload: Any, handler: Optional[Handler]) -> None:
+        with self.lock:
+            if handler is not None:
+                self.pending[request_id] = handler
+            self.conn.send((request_id, op, payload))
+
+    def read(self) -> None:
+        while True:
+            try:
+                request_id, kind, payload = self.conn.recv()
+            except (EOFError, OSError):
+                break
+
+            if kind == READY:
+                self.ready = True
+                self.last_pong = time.monotonic()
+                logger.info(f"Inference worker {self.index} ready, pid {payload}.")
+            elif kind == PONG:
+                self.last_pong = time.monotonic()
+                self.busy_for = payload
+            else:
+                handler = self.pending.get(request_id)
+                if handler is not None and handler(kind, payload):
+                    with self.lock:
+                        self.pending.pop(request_id, None)
+
+        self.fail_pending(f"Inference worker {self.index} exited")
+
+    def fail_pending(self, reason: str) -> None:
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for handler in pending.values():
+            handler(ERROR, reason)
+
+    def stop(self, timeout: float) -> None:
+        try:
+            with self.lock:
+                self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+
+class InferencePool:
+    """Runs the language model in a pool of worker processes, so that a stalled generation does not
+    block the web process and several batches generate at the same time. Batches go to the least
+    loaded worker; crashed, unresponsive or stuck workers are restarted by a health check thread.
+
+    The model is loaded once and its weights put in shared memory, so the replicas do not each
+    hold a copy. Quantized and compiled models cannot be shared, each worker then loads its own.
+    It has the same interface as the LanguageModel it replaces.
+    """
+
+    def __init__(self) -> None:
+        gen_config = load_config()[Constants.GENERATOR]
+        self.replicas = gen_config[Constants.REPLICAS]
+        self.health_interval = gen_config[Constants.HEALTH_INTERVAL]
+        self.health_timeout = gen_config[Constants.HEALTH_TIMEOUT]
+        self.generation_timeout = gen_config[Constants.GENERATION_TIMEOUT]
+
+        # The tokenizer, limits and shared weights, the workers run the generations.
+        self.lang_model = LanguageModel()
+        self.is_mock = self.lang_model.is_mock
+        self.max_tokens = self.lang_model.max_tokens
+        self.context_window = self.lang_model.context_window
+
+        self.shared: Optional[LanguageModel] = None
+        if (not self.is_mock and gen_config[Constants.QUANTIZE].lower() == "none"
+                and not gen_config[Constants.COMPILE]):
+            self.lang_model.model.share_memory()
+            if self.lang_model.draft_model is not None:
+                self.lang_model.draft_model.share_memory()
+            self.shared = self.lang_model
+
+        self.context = mp.get_context("spawn")
+        self.config = load_config()
+        self.ids = itertools.count()
+        self.prefixes: List[str] = []
+        self.restarts = 0
+        self.workers = [self.start_worker(i) for i in range(self.replicas)]
+
+        self.closed = threading.Event()
+        self.monitor = threading.Thread(
+            target=self.check_health, name="inference-health", daemon=True)
+        self.monitor.start()
+
+        logger.info(
+            f"Started {self.replicas} inference workers, "
+            f"{'sharing the weights' if self.shared else 'each loading the weights'}.")
+
+    def start_worker(self, index: int) -> WorkerHandle:
+        worker = WorkerHandle(index, self.context, self.shared, self.config)
+        for prefix in self.prefixes:
+            worker.submit(next(self.ids), PREFIX, prefix, None)
+        return worker
+
+    def check_health(self) -> None:
+        """Ping the workers periodically, restarting the ones that exited, stopped answering or
+        have been busy on a single request for longer than the generation timeout.
+        """
+        while not self.closed.wait(self.health_interval):
+            for i, worker in enumerate(self.workers):
+                if not worker.process.is_alive():
+                    reason = f"exited with code {worker.process.exitcode}"
+                elif worker.ready and time.monotonic() - worker.last_pong > self.health_timeout:
+                    reason = f"did not answer the health check for {self.health_timeout}s"
+                elif self.generation_timeout and (worker.busy_for or 0) > self.generation_timeout:
+                    reason = f"was stuck on a request for over {self.generation_timeout}s"
+                else:
+                    try:
+                        worker.submit(next(self.ids), PING, None, None)
+                    except (BrokenPipeError, OSError):
+                        pass
+                    continue
+
+                logger.error(f"Inference worker {i} {reason}, restarting it.")
+                # Failed first, so that its callers get the reason rather than the exit it causes.
+                worker.fail_pending(f"Inference worker {i} {reason}")
+                worker.stop(timeout=0)
+                self.restarts += 1
+                if not self.closed.is_set():
+                    self.workers[i] = self.start_worker(i)
+
+    def health(self) -> List[Dict[str, Any]]:
+        """The state of each worker.
+
+        Returns:
+            List[Dict[str, Any]]: The pid, liveness, readiness, load and busy time of each worker.
+        """
+        return [{
+            "index": worker.index,
+            "pid": worker.process.pid,
+            "alive": worker.process.is_alive(),
+            "ready": worker.ready,
+            "in_flight": worker.load,
+            "busy_seconds": None if worker.busy_for is None else round(worker.busy_for, 1)
+        } for worker in self.workers]
+
+    def least_loaded(self) -> WorkerHandle:
+        alive = [worker for worker in self.workers if worker.process.is_alive()] or self.workers
+        # Workers still loading are only used once all the ready ones are busy.
+        return min(alive, key=lambda worker: (worker.load, not worker.ready))
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        return self.lang_model.count_tokens(texts)
+
+    def cache_prefix(self, prefix: str) -> None:
+        """Have every worker cache the prefix, including the ones restarted later.
+
+        Args:
+            prefix (str): The static start of the prompts.
+        """
+        if prefix in self.prefixes:
+            return
+        self.prefixes.append(prefix)
+        for worker in self.workers:
+            worker.submit(next(self.ids), PREFIX, prefix, None)
+
+    def generate(self, prompt: str, params: Optional[GenerationParams] = None) -> str:
+        return self.generate_batch([prompt], params=[params] if params else None)[0]
+
+    def cancel(self, worker: WorkerHandle, request_id: int, rows: Optional[List[int]] = None) -> None:
+        """Have the worker cut short prompts of a request, whose callers gave up.
+
+        Args:
+            worker (WorkerHandle): The worker the request was sent to.
+            request_id (int): The id of the request.
+            rows (Optional[List[int]]): The positions of the prompts in the request, all of them by default.
+        """
+        try:
+            worker.submit(next(self.ids), CANCEL, (request_id, rows), None)
+        except (BrokenPipeError, OSError):
+            # The worker exited, its requests are failed and it is restarted by the health check.
+            pass
+
+    def submit_batch(self, worker: WorkerHandle, request_id: int, prompts: List[str],
+                     max_new_tokens: Optional[int],
+                     params: Optional[List[GenerationParams]] = None) -> "Future[List[str]]":
+        future: "Future[List[str]]" = Future()
+
+        def handle(kind: str, payload: Any) -> bool:
+            if kind == RESULT:
+                future.set_result(payload)
+            elif kind == ERROR:
+                future.set_exception(RuntimeError(payload))
+            return True
+
+        worker.submit(request_id, GENERATE, (prompts, max_new_tokens, params), handle)
+        return future
+
+    def warm_up(self, prompt: str, max_new_tokens: int) -> None:
+        """Run a short generation on every worker at once.
+
+        Args:
+            prompt (str): The prompt to warm up with.
+            max_new_tokens (int): The number of tokens to generate.
+        """
+        futures = [self.submit_batch(worker, next(self.ids), [prompt], max_new_tokens)
+                   for worker in self.workers]
+        for future in futures:
+            future.result()
+
+    def generate_batch(self, prompts: List[str], max_new_tokens: Optional[int] = None,
+                       params: Optional[List[GenerationParams]] = None,
+                       cancels: Optional[List[threading.Event]] = None) -> List[str]:
+        """Generate the completions of the batch on the least loaded worker.
+
+        Args:
+            prompts (List[str]): The full prompts to generate the completions for.
+            max_new_tokens (Optional[int]): The maximum number of tokens to generate, defaults to
+            the configured max_tokens.
+            params (Optional[List[GenerationParams]]): The generation parameters of each prompt.
+            cancels (Optional[List[threading.Event]]): The event of each prompt, set when its caller
+            gives up, the worker is then told to cut it short.
+
+        Returns:
+            List[str]: The completions, in the same order as the prompts.
+        """
+        worker, request_id = self.least_loaded(), next(self.ids)
+        future = self.submit_batch(worker, request_id, prompts, max_new_tokens, params)
+        if cancels:
+            watch_cancels(cancels, lambda timeout: bool(wait([future], timeout).done),
+                          lambda rows: self.cancel(worker, request_id, rows))
+        return future.result()
+
+    async def generate_stream(self, prompt: str,
+                              params: Optional[GenerationParams] = None) -> AsyncIterator[str]:
+        """Stream the completion of the prompt from the least loaded worker.
+
+        Args:
+            prompt (str): The full prompt to generate the completion for.
+            params (Optional[GenerationParams]): The generation parameters.
+
+        Yields:
+            AsyncIterator[str]: The decoded text chunks of the completion, in order.
+        """
+        loop = asyncio.get_running_loop()
+        chunks: "asyncio.Queue[tuple]" = asyncio.Queue()
+
+        def handle(kind: str, payload: Any) -> bool:
+            loop.call_soon_threadsafe(chunks.put_nowait, (kind, payload))
+            return kind != CHUNK
+
+        worker, request_id = self.least_loaded(), next(self.ids)
+        worker.submit(request_id, STREAM, (prompt, params), handle)
+        finished = False
+        try:
+            while True:
+                kind, payload = await chunks.get()
+                if kind == CHUNK:
+                    yield payload
+                    continue
+                finished = True
+                if kind == ERROR:
+                    raise RuntimeError(payload)
+                return
+        finally:
+            # Cancelled or closed before the end, the worker would otherwise go on generating.
+            if not finished:
+                self.cancel(worker, request_id)
+
+    def close(self) -> None:
+        """Stop the health checks and the workers, letting them finish their current request.
+        """
+        self.closed.set()
+        self.monitor.join()
+        for worker in self.workers:
+            worker.stop(timeout=30)
+        logger.info("Inference workers stopped.")
+
+    async def aclose(self) -> None:
+        """Nothing to release on the event loop, the workers are stopped by close.
+        """
+        pass
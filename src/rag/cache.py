@@ -0,0 +1,181 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from dto.request import GenerationParams
+from dto.response import QueryResponse
+from utils.config import load_config
+from utils.constants import Constants
+from utils.logger import setup_logger
+from utils.metrics import CACHE_HIT_RATE, CACHE_LOOKUPS
+
+logger = setup_logger()
+config = load_config()
+
+
+def is_custom(params: Optional[GenerationParams]) -> bool:
+    """Whether the request sets any generation parameter, its response then differs from the
+    default one and is only cached under its exact key, never matched by the semantic tier.
+    """
+    return params is not None and bool(params.model_dump(exclude_none=True))
+
+
+class CacheEntry:
+    """A cached response along with what is needed to match and expire it.
+    """
+
+    def __init__(self, response: QueryResponse, limit: int, embedding: Optional[np.ndarray]) -> None:
+        self.response = response
+        self.limit = limit
+        self.embedding = embedding
+        self.created_at = time.monotonic()
+
+
+class ResponseCache:
+    """LRU cache of generated responses in front of the Engine. The exact tier is keyed on the
+    normalized query, the limit and the retrieved ArXiv ids, the optional semantic tier matches
+    near-duplicate queries on the cosine distance of their embeddings.
+    """
+
+    def __init__(self) -> None:
+        cache_config = config[Constants.CACHE]
+        self.enabled = cache_config[Constants.ENABLED]
+        self.max_entries = cache_config[Constants.MAX_ENTRIES]
+        self.ttl = cache_config[Constants.TTL_SECONDS]
+        self.semantic = self.enabled and cache_config[Constants.SEMANTIC]
+        self.semantic_distance = cache_config[Constants.SEMANTIC_DISTANCE]
+
+        self.entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        CACHE_HIT_RATE.set_function(self.hit_rate)
+
+    @staticmethod
+    def make_key(query: str, limit: int, arxiv_ids: List[str],
+                 params: Optional[GenerationParams] = None) -> str:
+        """Build the exact tier key, independent of the casing, spacing and retrieval order.
+
+        Args:
+            query (str): The query posted by the user.
+            limit (int): The maximum number of abstracts requested.
+            arxiv_ids (List[str]): The ids of the retrieved abstracts.
+            params (Optional[GenerationParams]): The generation parameters set by the request.
+
+        Returns:
+            str: The cache key.
+        """
+        normalized = " ".join(query.lower().split())
+        key = f"{normalized}|{limit}|{','.join(sorted(set(arxiv_ids)))}"
+        if is_custom(params):
+            assert params is not None
+            key += f"|{json.dumps(params.model_dump(exclude_none=True), sort_keys=True)}"
+        return key
+
+    def is_expired(self, entry: CacheEntry) -> bool:
+        return time.monotonic() - entry.created_at > self.ttl
+
+    def get(self, key: str) -> Optional[QueryResponse]:
+        """Look up the exact tier.
+
+        Args:
+            key (str): The key built with make_key.
+
+        Returns:
+            Optional[QueryResponse]: The cached response, None on a miss.
+        """
+        if not self.enabled:
+            return None
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.is_expired(entry):
+                del self.entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(tier="exact", result="miss")
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            CACHE_LOOKUPS.inc(tier="exact", result="hit")
+            return entry.response.model_copy(update={"cache": "HIT"})
+
+    def get_similar(self, embedding: List[float], limit: int) -> Optional[QueryResponse]:
+        """Look up the semantic tier for a previous query with the same limit, whose embedding
+        is within the configured cosine distance.
+
+        Args:
+            embedding (List[float]): The embedding of the query.
+            limit (int): The maximum number of abstracts requested.
+
+        Returns:
+            Optional[QueryResponse]: The response of the closest cached query, None on a miss.
+        """
+        if not self.semantic:
+            return None
+
+        query = self.normalize(embedding)
+        best_key, best_distance = None, self.semantic_distance
+
+        with self.lock:
+            for key, entry in list(self.entries.items()):
+                if self.is_expired(entry):
+                    del self.entries[key]
+                    continue
+                if entry.limit != limit or entry.embedding is None:
+                    continue
+
+                distance = 1.0 - float(np.dot(query, entry.embedding))
+                if distance <= best_distance:
+                    best_key, best_distance = key, distance
+
+            if best_key is None:
+                CACHE_LOOKUPS.inc(tier="semantic", result="miss")
+                return None
+
+            self.entries.move_to_end(best_key)
+            self.hits += 1
+            CACHE_LOOKUPS.inc(tier="semantic", result="hit")
+            logger.info(f"Semantic cache hit at distance {best_distance:.4f}.")
+            return self.entries[best_key].response.model_copy(update={"cache": "HIT-SEMANTIC"})
+
+    def put(self, key: str, response: QueryResponse, limit: int,
+            embedding: Optional[List[float]] = None) -> None:
+        """Store a generated response, evicting the least recently used ones above the size limit.
+
+        Args:
+            key (str): The key built with make_key.
+            response (QueryResponse): The generated response.
+            limit (int): The maximum number of abstracts requested.
+            embedding (Optional[List[float]]): The embedding of the query for the semantic tier.
+        """
+        if not self.enabled:
+            return
+
+        vector = self.normalize(embedding) if embedding is not None else None
+
+        with self.lock:
+            self.entries[key] = CacheEntry(response, limit, vector)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        logger.info(
+            f"Cached response, {len(self.entries)} entries with a hit rate of {self.hit_rate():.2%}.")
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @staticmethod
+    def normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
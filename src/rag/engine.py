@@ -1,6 +1,12 @@
-from dto.response import QueryResponse
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from dto.request import GenerationParams
+from dto.response import Abstract, BatchQueryResult, QueryResponse, StreamEvent
+from rag.cache import ResponseCache, is_custom
 from rag.handler import Generator, Retriever
 from utils.logger import setup_logger
+from utils.readiness import get_readiness
 
 logger = setup_logger()
 
@@ -16,8 +22,58 @@ class Engine:
         """
         self.retriever = Retriever()
         self.generator = Generator()
+        self.cache = ResponseCache()
+
+        # Both load in the background, requests wait for the components they need.
+        self.retriever.start_loading()
+        self.generator.start_loading()
+
+    def readiness(self) -> Tuple[bool, Dict[str, Any]]:
+        """Whether the engine can serve traffic, which it can as soon as retrieval is usable as the
+        requests then wait for the language model.
+
+        Returns:
+            Tuple[bool, Dict[str, Any]]: Whether retrieval is ready, and the state of each component.
+        """
+        readiness = get_readiness()
+        report = readiness.report()
+        report["generation_ready"] = readiness.is_ready(self.generator.components)
+        return readiness.is_ready(self.retriever.components), report
+
+    @property
+    def semantic(self) -> bool:
+        """Whether the semantic tier of the cache is looked up, never with the mock retrieval
+        system as it would load the embedding model only for the cache.
+        """
+        return self.cache.semantic and not self.retriever.mock
+
+    async def lookup_similar(self, query: str, limit: int, params: Optional[GenerationParams] = None
+                             ) -> Tuple[Optional[QueryResponse], Optional[List[float]]]:
+        """Embed the query and look up the semantic tier of the cache, when enabled.
+
+        Args:
+            query (str): The query posted by the user from the UI.
+            limit (int): The maximum number of results requested.
+            params (Optional[GenerationParams]): The generation parameters of the request, the
+            semantic tier only holds responses generated with the default ones.
 
-    def generate_response(self, query: str, limit: int) -> QueryResponse:
+        Returns:
+            Tuple[Optional[QueryResponse], Optional[List[float]]]: The cached response if any, and the
+            query embedding to be reused by the retrieval.
+        """
+        if not self.semantic or is_custom(params):
+            return None, None
+
+        try:
+            embedding = await self.retriever.embed_query_async(query)
+        except Exception as e:
+            # A failed embedding is a cache miss, the request goes on uncached.
+            logger.warning(f"Embedding the query for the semantic cache failed: {e}")
+            return None, None
+        return self.cache.get_similar(embedding, limit), embedding
+
+    async def generate_response(self, query: str, limit: int,
+                                params: Optional[GenerationParams] = None) -> QueryResponse:
         """The full RAG flow of retrieving the content from both the vector stores and ArXiv API
         and generating a summary using the configured LM.
 
@@ -25,23 +81,188 @@ class Engine:
             query (str): The query posted by the user from the UI.
             max_results (int): The maximum number of results across vector store and API combined to
             generate the results from.
+            params (Optional[GenerationParams]): The generation parameters of the request.
 
         Returns:
             QueryResponse: The response to be sent back to the user.
         """
+        # A near-duplicate query skips both the retrieval and the generation.
+        cached, embedding = await self.lookup_similar(query=query, limit=limit, params=params)
+        if cached is not None:
+            return cached
+
         # Check the vector store for relevant documents & fetch the missing number of documents from ArXiv
-        abstracts = self.retriever.fetch(query=query, limit=limit)
+        abstracts = await self.retriever.fetch_async(
+            query=query, limit=limit, query_embedding=embedding)
+
+        key = self.cache.make_key(
+            query, limit, [abstract.arxiv_id for abstract in abstracts], params)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
 
         # Combine together for the actual generation using the LM.
-        summary = self.generator.summarize(query=query, abstracts=abstracts)
+        summary = await self.generator.summarize_async(query=query, abstracts=abstracts, params=params)
 
         # Process the obtained response
         response = QueryResponse(
             summary=summary,
             abstracts=abstracts
         )
+        if summary:
+            self.cache.put(key, response, limit, embedding)
 
         logger.info(
             f"Query: {query}, generated content from {len(abstracts)} sources.")
 
         return response
+
+    async def generate_response_stream(self, query: str, limit: int,
+                                       params: Optional[GenerationParams] = None) -> AsyncIterator[StreamEvent]:
+        """Generator based counterpart of generate_response, that yields the retrieved abstracts
+        as soon as they are available followed by the summary chunks as the LM produces them.
+
+        Args:
+            query (str): The query posted by the user from the UI.
+            limit (int): The maximum number of results across vector store and API combined to
+            generate the results from.
+            params (Optional[GenerationParams]): The generation parameters of the request.
+
+        Yields:
+            AsyncIterator[StreamEvent]: An "abstracts" event, followed by "token" events and a final
+            "done" event.
+        """
+        cached, embedding = await self.lookup_similar(query=query, limit=limit, params=params)
+        if cached is None:
+            abstracts = await self.retriever.fetch_async(
+                query=query, limit=limit, query_embedding=embedding)
+            key = self.cache.make_key(
+                query, limit, [abstract.arxiv_id for abstract in abstracts], params)
+            cached = self.cache.get(key)
+
+        if cached is not None:
+            # Replay the cached summary as a single chunk.
+            yield StreamEvent(event="abstracts", data=cached.abstracts)
+            yield StreamEvent(event="token", data=cached.summary)
+            yield StreamEvent(event="done", data="")
+            return
+
+        yield StreamEvent(event="abstracts", data=abstracts)
+
+        chunks = []
+        async for chunk in self.generator.summarize_stream(query=query, abstracts=abstracts, params=params):
+            chunks.append(chunk)
+            yield StreamEvent(event="token", data=chunk)
+
+        summary = "".join(chunks).strip()
+        if summary:
+            self.cache.put(key, QueryResponse(
+                summary=summary, abstracts=abstracts), limit, embedding)
+
+        logger.info(
+            f"Query: {query}, streamed content from {len(abstracts)} sources.")
+
+        yield StreamEvent(event="done", data="")
+
+    async def generate_response_batch(self, queries: List[str], limit: int,
+                                      params: Optional[List[Optional[GenerationParams]]] = None
+                                      ) -> AsyncIterator[BatchQueryResult]:
+        """Batch counterpart of generate_response for many queries at once: the queries are embedded
+        in one pass and retrieved with a single query of the vector store, their prompts are queued
+        together for batched generation, and each result is yielded as soon as it completes.
+
+        Args:
+            queries (List[str]): The queries of the batch request.
+            limit (int): The maximum number of results across vector store and API combined to
+            generate each result from.
+            params (Optional[List[Optional[GenerationParams]]]): The generation parameters of each query.
+
+        Yields:
+            AsyncIterator[BatchQueryResult]: The result of each query, in completion order, cache hits
+            first.
+        """
+        params = params or [None] * len(queries)
+        embeddings: Optional[List[List[float]]] = None
+        todo = list(range(len(queries)))
+        if self.semantic:
+            try:
+                embeddings = await self.retriever.embed_queries_async(queries)
+            except Exception as e:
+                logger.warning(f"Embedding the queries for the semantic cache failed: {e}")
+        if embeddings is not None:
+            todo = []
+            for i, embedding in enumerate(embeddings):
+                cached = None if is_custom(params[i]) else self.cache.get_similar(embedding, limit)
+                if cached is not None:
+                    yield BatchQueryResult(index=i, query=queries[i], response=cached)
+                else:
+                    todo.append(i)
+        if not todo:
+            return
+
+        fetched = await self.retriever.fetch_batch_async(
+            queries=[queries[i] for i in todo], limit=limit,
+            query_embeddings=[embeddings[i] for i in todo] if embeddings is not None else None)
+
+        # Repeats of a query with the same sources and parameters are generated once.
+        groups: Dict[str, Tuple[List[int], List[Abstract]]] = {}
+        for i, abstracts in zip(todo, fetched):
+            key = self.cache.make_key(
+                queries[i], limit, [abstract.arxiv_id for abstract in abstracts], params[i])
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield BatchQueryResult(index=i, query=queries[i], response=cached)
+            elif key in groups:
+                groups[key][0].append(i)
+            else:
+                groups[key] = ([i], abstracts)
+        if not groups:
+            return
+
+        keys = list(groups)
+        futures = await self.generator.summarize_batch_async(
+            queries=[queries[groups[key][0][0]] for key in keys],
+            abstracts=[groups[key][1] for key in keys],
+            params=[params[groups[key][0][0]] for key in keys])
+
+        async def labelled(key: str, future: "asyncio.Future[str]") -> Tuple[str, Optional[str], Optional[str]]:
+            try:
+                return key, await future, None
+            except Exception as e:
+                return key, None, f"{type(e).__name__}: {e}"
+
+        tasks = [asyncio.ensure_future(labelled(key, future)) for key, future in zip(keys, futures)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                key, summary, error = await next_done
+                indices, abstracts = groups[key]
+                response = None
+                if summary is not None:
+                    response = QueryResponse(summary=summary, abstracts=abstracts)
+                    if summary:
+                        self.cache.put(key, response, limit,
+                                       embeddings[indices[0]] if embeddings is not None
+                                       and not is_custom(params[indices[0]]) else None)
+                for i in indices:
+                    yield BatchQueryResult(index=i, query=queries[i], response=response, error=error)
+        finally:
+            # Cancels the prompts not generated yet when the client leaves or the deadline passes.
+            for task, future in zip(tasks, futures):
+                task.cancel()
+                future.cancel()
+
+        logger.info(
+            f"Batch of {len(queries)} queries, generated {len(keys)} summaries.")
+
+    def close(self) -> None:
+        """Release the resources held by the engine before the server shuts down.
+        """
+        self.generator.close()
+        self.retriever.close()
+
+    async def aclose(self) -> None:
+        """Release the resources held by the engine off the event loop, as flushing the writes and
+        stopping the workers block, then the asynchronous clients of the model on it.
+        """
+        await asyncio.to_thread(self.close)
+        await self.generator.aclose()
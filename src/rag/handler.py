@@ -1,40 +1,120 @@
+import asyncio
 import os
-from typing import List
+import threading
+from concurrent.futures import Future
+from string import Formatter
+from typing import AsyncIterator, Callable, List, Optional, Sequence
 
+from dto.request import GenerationParams
 from dto.response import Abstract
-from models.lm import LanguageModel
-from models.retrieval_systems.hybrid import HybridRetrievalSystem
-from models.retrieval_systems.mock import MockRetrievalSystem
+from rag.packer import SOURCE_SEPARATOR, ContextPacker, format_source
 from utils.config import load_config
 from utils.constants import Constants
+from utils.executors import get_retrieval_executor, run_in_executor
 from utils.logger import setup_logger
+from utils.metrics import PROMPT_BUILD_SECONDS
+from utils.readiness import CHROMA, EMBEDDING_MODEL, LM, WARMUP, get_readiness
+from utils.tracing import span, traced
 
 logger = setup_logger()
 config = load_config()
 
 
+def load_in_background(name: str, load: Callable[[], None]) -> Future:
+    """Run the loading of a component on a thread of its own, so the server accepts requests
+    meanwhile.
+
+    Args:
+        name (str): The name of the loading thread.
+        load (Callable[[], None]): Loads the component.
+
+    Returns:
+        Future: Resolved once loaded, or with the error of the loading.
+    """
+    loaded: Future = Future()
+
+    def run() -> None:
+        try:
+            load()
+            loaded.set_result(None)
+        except Exception as e:
+            logger.error(f"Loading in {name} failed: {e}")
+            loaded.set_exception(e)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return loaded
+
+
+def has_loaded(loaded: Optional[Future]) -> bool:
+    """Whether a component loaded successfully, without waiting for a load still in progress.
+
+    Args:
+        loaded (Optional[Future]): The loading of the component, None if it was never started.
+
+    Returns:
+        bool: True once the component is loaded.
+    """
+    return loaded is not None and loaded.done() and loaded.exception() is None
+
+
 class Retriever:
     """The retriever that is responsible to handle both the vector store and the ArXiv API fallback
     to generate the final List[Abstract] list for the generator to generate the cited summary.
     """
 
     def __init__(self) -> None:
+        self.components = [EMBEDDING_MODEL, CHROMA]
+        get_readiness().register(*self.components)
+        self.loaded: Optional[Future] = None
+        # Unrecognized modes default to the mock retrieval system, which needs no embedding model.
+        self.mock = config[Constants.RETRIVER][Constants.MODE].lower() not in ("local", "remote", "hybrid")
+
+    def start_loading(self) -> None:
+        self.loaded = load_in_background("retriever-loader", self.load)
+
+    def load(self) -> None:
+        """Load the embedding model and open the vector store, importing them only now as they
+        are slow to import. The mock retrieval system needs neither.
+        """
         ret_config = config[Constants.RETRIVER]
         mode = ret_config[Constants.MODE].lower()
-        logger.info(f"Creating a '{mode}' retrieval system instance.")
-
-        if mode == "mock":
-            self.system = MockRetrievalSystem()
-        elif mode == "local":
-            self.system = HybridRetrievalSystem(is_local=True, is_remote=False)
-        elif mode == "remote":
-            self.system = HybridRetrievalSystem(is_local=False, is_remote=True)
-        elif mode == "hybrid":
-            self.system = HybridRetrievalSystem(is_local=True, is_remote=True)
-        else:
-            logger.warning(
-                f"'{mode}' is not recognized; defaulting to mock retrieval.")
-            self.system = MockRetrievalSystem()
+
+        with get_readiness().loading(EMBEDDING_MODEL):
+            from models.embeddings import get_embedding_model
+
+            # The embedding model itself is only loaded on its first use, which would download it.
+            if mode != "mock":
+                get_embedding_model().embed_documents(["warm up"])
+
+        with get_readiness().loading(CHROMA):
+            from models.retrieval_systems.hybrid import HybridRetrievalSystem
+            from models.retrieval_systems.mock import MockRetrievalSystem
+
+            logger.info(f"Creating a '{mode}' retrieval system instance.")
+
+            if mode == "mock":
+                self.system = MockRetrievalSystem()
+            elif mode == "local":
+                self.system = HybridRetrievalSystem(is_local=True, is_remote=False)
+            elif mode == "remote":
+                self.system = HybridRetrievalSystem(is_local=False, is_remote=True)
+            elif mode == "hybrid":
+                self.system = HybridRetrievalSystem(is_local=True, is_remote=True)
+            else:
+                logger.warning(
+                    f"'{mode}' is not recognized; defaulting to mock retrieval.")
+                self.system = MockRetrievalSystem()
+
+    def wait(self) -> None:
+        """Block until the retrieval system is loaded, raises if the loading failed. Returns at
+        once if the loading was never started.
+        """
+        if self.loaded is not None:
+            self.loaded.result()
+
+    async def wait_async(self) -> None:
+        if self.loaded is not None:
+            await asyncio.wrap_future(self.loaded)
 
     def fetch(self, query: str, limit: int) -> List[Abstract]:
         """Method to fetch from both the cached vector storage and arxiv api according to the query
@@ -47,7 +127,70 @@ class Retriever:
         Returns:
             List[Abstract]: The list of relevant abstracts returned.
         """
-        return self.system.fetch(query=query, limit=limit)
+        self.wait()
+        with span("retriever.fetch", limit=limit):
+            return self.system.fetch(query=query, limit=limit)
+
+    async def fetch_async(self, query: str, limit: int,
+                          query_embedding: Optional[List[float]] = None) -> List[Abstract]:
+        """Async counterpart of fetch.
+
+        Args:
+            query (str): The query from the UI by the user
+            limit (int): The maximum number of results
+            query_embedding (Optional[List[float]]): The precomputed embedding of the query.
+
+        Returns:
+            List[Abstract]: The list of relevant abstracts returned.
+        """
+        await self.wait_async()
+        with span("retriever.fetch", limit=limit):
+            return await self.system.fetch_async(query=query, limit=limit, query_embedding=query_embedding)
+
+    async def fetch_batch_async(self, queries: List[str], limit: int,
+                                query_embeddings: Optional[Sequence[Optional[List[float]]]] = None
+                                ) -> List[List[Abstract]]:
+        """Fetch the abstracts of several queries at once.
+
+        Args:
+            queries (List[str]): The queries from the batch request.
+            limit (int): The maximum number of results per query.
+            query_embeddings (Optional[Sequence[Optional[List[float]]]]): The precomputed embeddings
+            of the queries.
+
+        Returns:
+            List[List[Abstract]]: The abstracts of each query, in the same order as the queries.
+        """
+        await self.wait_async()
+        with span("retriever.fetch", limit=limit, queries=len(queries)):
+            return await self.system.fetch_batch_async(
+                queries=queries, limit=limit, query_embeddings=query_embeddings)
+
+    async def embed_queries_async(self, queries: List[str]) -> List[List[float]]:
+        await self.wait_async()
+        with span("retriever.embed", queries=len(queries)):
+            return await self.system.embed_queries_async(queries)
+
+    async def embed_query_async(self, query: str) -> List[float]:
+        """Embed the query with the embedding function of the vector store.
+
+        Args:
+            query (str): The query from the UI by the user
+
+        Returns:
+            List[float]: The embedding of the query.
+        """
+        await self.wait_async()
+        with span("retriever.embed"):
+            return await self.system.embed_query_async(query)
+
+    def close(self) -> None:
+        """Flush the pending writes of the retrieval system, if it was loaded. A load still in
+        progress is not waited for, nothing was written yet.
+        """
+        if not has_loaded(self.loaded):
+            return
+        self.system.close()
 
 
 class Generator:
@@ -61,23 +204,227 @@ class Generator:
             "prompt_templates", config["generator"]["template"])
         with open(prompt_path, "r") as f:
             self.base_prompt = f.read()
-        self.lang_model = LanguageModel()
 
-    def summarize(self, query: str, abstracts: List[Abstract]) -> str:
+        gen_config = config[Constants.GENERATOR]
+        self.warmup_tokens = gen_config[Constants.WARMUP_TOKENS]
+        self.max_tokens = gen_config[Constants.MAX_TOKENS]
+        self.output_tokens_base = gen_config[Constants.OUTPUT_TOKENS_BASE]
+        self.output_tokens_per_source = gen_config[Constants.OUTPUT_TOKENS_PER_SOURCE]
+        self.max_temperature = gen_config[Constants.MAX_TEMPERATURE]
+        self.max_stop_sequences = gen_config[Constants.MAX_STOP_SEQUENCES]
+        self.components = [LM, WARMUP] if self.warmup_tokens else [LM]
+        get_readiness().register(*self.components)
+        self.loaded: Optional[Future] = None
+
+    def start_loading(self) -> None:
+        self.loaded = load_in_background("generator-loader", self.load)
+
+    def load(self) -> None:
+        """Load the language model and its scheduler, importing them only now as torch and
+        transformers are slow to import, then warm it up with a short generation.
+        """
+        gen_config = config[Constants.GENERATOR]
+
+        with get_readiness().loading(LM):
+            from models.lm import LanguageModel
+            from models.remote_lm import RemoteLanguageModel
+            from models.scheduler import BatchScheduler
+            from models.worker_pool import InferencePool
+
+            inference = gen_config[Constants.INFERENCE].lower()
+            if inference == "pool":
+                self.lang_model = InferencePool()
+            elif inference == "remote":
+                self.lang_model = RemoteLanguageModel()
+            else:
+                self.lang_model = LanguageModel()
+            self.scheduler = BatchScheduler(self.lang_model)
+            # The template up to its first field is the same for every request.
+            self.lang_model.cache_prefix(next(Formatter().parse(self.base_prompt))[0])
+
+            budget = gen_config[Constants.PROMPT_BUDGET]
+            window = self.lang_model.context_window
+            if budget and window and window > self.lang_model.max_tokens:
+                # Leave room in the context window for the output tokens.
+                budget = min(budget, window - self.lang_model.max_tokens)
+            self.packer = ContextPacker(
+                self.base_prompt, self.lang_model.count_tokens, budget,
+                gen_config[Constants.MIN_SOURCE_TOKENS]) if budget else None
+
+        if self.warmup_tokens:
+            # A failed warm-up is reported, the model is usable regardless.
+            try:
+                with get_readiness().loading(WARMUP):
+                    self.lang_model.warm_up(
+                        self.build_prompt(query="", abstracts=[]), self.warmup_tokens)
+            except Exception as e:
+                logger.warning(f"Warm-up generation failed: {e}")
+
+    def wait(self) -> None:
+        """Block until the language model is loaded, raises if the loading failed. Returns at
+        once if the loading was never started.
+        """
+        if self.loaded is not None:
+            self.loaded.result()
+
+    async def wait_async(self) -> None:
+        if self.loaded is not None:
+            await asyncio.wrap_future(self.loaded)
+
+    def build_prompt(self, query: str, abstracts: List[Abstract]) -> str:
+        """Fill the configured prompt template with the query and the retrieved sources.
+
+        Args:
+            query (str): The original query posted by the user for LM guidance.
+            abstracts (List[Abstract]): The list of abstracts relevant to the query provided by the user,
+            best first, packed into the configured prompt budget.
+
+        Returns:
+            str: The prompt to be sent to the LM.
+        """
+        with PROMPT_BUILD_SECONDS.time(), span("generator.build_prompt", sources=len(abstracts)):
+            if self.packer is not None:
+                sources_str = self.packer.pack(query=query, abstracts=abstracts)
+            else:
+                sources_str = SOURCE_SEPARATOR.join(
+                    format_source(abstract.id, abstract.abstract) for abstract in abstracts
+                )
+            return self.base_prompt.format(
+                query=query, sources=sources_str)
+
+    async def build_prompt_async(self, query: str, abstracts: List[Abstract]) -> str:
+        """Build the prompt on the retrieval executor, as packing the sources tokenizes them.
+
+        Args:
+            query (str): The original query posted by the user for LM guidance.
+            abstracts (List[Abstract]): The abstracts relevant to the query, best first.
+
+        Returns:
+            str: The prompt to be sent to the LM.
+        """
+        return await run_in_executor(get_retrieval_executor(), self.build_prompt, query=query, abstracts=abstracts)
+
+    def resolve_params(self, params: Optional[GenerationParams], sources: int) -> GenerationParams:
+        """Bound the generation parameters of a request by the configuration, the output budget
+        growing with the number of sources to summarize unless the request sets its own.
+
+        Args:
+            params (Optional[GenerationParams]): The generation parameters of the request, if any.
+            sources (int): The number of sources in the prompt.
+
+        Returns:
+            GenerationParams: The parameters to generate with, with the token budget always set.
+        """
+        params = params or GenerationParams()
+        max_tokens = params.max_tokens
+        if max_tokens is None and (self.output_tokens_base or self.output_tokens_per_source):
+            max_tokens = self.output_tokens_base + self.output_tokens_per_source * sources
+        temperature = params.temperature
+        if temperature is not None:
+            temperature = min(temperature, self.max_temperature)
+
+        return GenerationParams(
+            max_tokens=min(max_tokens or self.max_tokens, self.max_tokens),
+            temperature=temperature,
+            stop=params.stop[:self.max_stop_sequences] if params.stop else None
+        )
+
+    @traced("generator.summarize")
+    def summarize(self, query: str, abstracts: List[Abstract],
+                  params: Optional[GenerationParams] = None) -> str:
         """Use the LM to generate the cited summary from the list of abstracts retrieved by the retriever.
 
         Args:
             query (str): The original query posted by the user for LM guidance.
             abstracts (List[Abstract]): The list of abstracts relevant to the query provided by the user.
+            params (Optional[GenerationParams]): The generation parameters of the request.
 
         Returns:
             str: The cited summary returned by the LM.
         """
-        sources_str = "\n\n".join(
-            f"[{abstract.id}] - \"{abstract.abstract}\"" for abstract in abstracts
-        )
-        prompt = self.base_prompt.format(
-            query=query, sources=sources_str)
+        self.wait()
+        prompt = self.build_prompt(query=query, abstracts=abstracts)
 
         # Use the language model (mock or real) to generate summary
-        return self.lang_model.generate(prompt)
+        with span("lm.generate", batch_size=1):
+            return self.lang_model.generate(prompt, self.resolve_params(params, len(abstracts)))
+
+    @traced("generator.summarize")
+    async def summarize_async(self, query: str, abstracts: List[Abstract],
+                              params: Optional[GenerationParams] = None) -> str:
+        """Async counterpart of summarize, the prompt is batched with the other concurrent requests
+        by the scheduler before running on the dedicated inference executor.
+
+        Args:
+            query (str): The original query posted by the user for LM guidance.
+            abstracts (List[Abstract]): The list of abstracts relevant to the query provided by the user.
+            params (Optional[GenerationParams]): The generation parameters of the request.
+
+        Returns:
+            str: The cited summary returned by the LM.
+        """
+        await self.wait_async()
+        prompt = await self.build_prompt_async(query=query, abstracts=abstracts)
+
+        return await self.scheduler.generate(prompt, self.resolve_params(params, len(abstracts)))
+
+    async def summarize_batch_async(self, queries: List[str], abstracts: List[List[Abstract]],
+                                    params: Optional[List[Optional[GenerationParams]]] = None
+                                    ) -> "List[asyncio.Future[str]]":
+        """Queue the prompts of several queries at once, so that the scheduler runs them in as few
+        batches as possible.
+
+        Args:
+            queries (List[str]): The original queries posted by the user for LM guidance.
+            abstracts (List[List[Abstract]]): The abstracts relevant to each query.
+            params (Optional[List[Optional[GenerationParams]]]): The generation parameters of each query.
+
+        Returns:
+            List[asyncio.Future[str]]: The futures of the cited summaries, in the same order as the
+            queries, each resolved as soon as its batch has run.
+        """
+        await self.wait_async()
+        prompts = await asyncio.gather(*(self.build_prompt_async(query=query, abstracts=sources)
+                                         for query, sources in zip(queries, abstracts)))
+
+        return [
+            asyncio.wrap_future(self.scheduler.submit(prompt, self.resolve_params(query_params, len(sources))))
+            for prompt, sources, query_params in zip(prompts, abstracts, params or [None] * len(prompts))
+        ]
+
+    async def summarize_stream(self, query: str, abstracts: List[Abstract],
+                               params: Optional[GenerationParams] = None) -> AsyncIterator[str]:
+        """Streaming counterpart of summarize, yields the cited summary in chunks as the LM
+        generates it.
+
+        Args:
+            query (str): The original query posted by the user for LM guidance.
+            abstracts (List[Abstract]): The list of abstracts relevant to the query provided by the user.
+            params (Optional[GenerationParams]): The generation parameters of the request.
+
+        Yields:
+            AsyncIterator[str]: The chunks of the cited summary, in order.
+        """
+        await self.wait_async()
+        with span("generator.summarize", streamed=True):
+            prompt = await self.build_prompt_async(query=query, abstracts=abstracts)
+
+            async for chunk in self.lang_model.generate_stream(
+                    prompt, self.resolve_params(params, len(abstracts))):
+                yield chunk
+
+    def close(self) -> None:
+        """Stop the batch scheduler once the queued prompts are generated, then the model, if it
+        was loaded. A load still in progress, such as the download of the model, is not waited for.
+        """
+        if not has_loaded(self.loaded):
+            return
+        self.scheduler.close()
+        self.lang_model.close()
+
+    async def aclose(self) -> None:
+        """Close the asynchronous clients of the model, if it was loaded.
+        """
+        if not has_loaded(self.loaded):
+            return
+        await self.lang_model.aclose()
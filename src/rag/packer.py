@@ -0,0 +1,138 @@
+import re
+from typing import Callable, List, Set, Tuple
+
+from dto.response import Abstract
+from models.retrieval_systems.lexical import tokenize
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(\[])")
+SOURCE_SEPARATOR = "\n\n"
+
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence for sentence in SENTENCE_PATTERN.split(text.strip()) if sentence]
+
+
+def format_source(abstract_id: str, text: str) -> str:
+    return f"[{abstract_id}] - \"{text}\""
+
+
+class ContextPacker:
+    """Fits the sources of the prompt into a token budget, measured with the model's tokenizer.
+    Sources are taken in retrieval order, best first, each getting an equal share of what is left
+    of the budget. Abstracts over their share keep only their sentences most relevant to the query,
+    and the lowest ranked sources are dropped when the budget cannot fit them all.
+    """
+
+    def __init__(self, template: str, count_tokens: Callable[[List[str]], List[int]],
+                 budget: int, min_source_tokens: int) -> None:
+        """The constructor of the packer.
+
+        Args:
+            template (str): The prompt template, with the {query} and {sources} fields.
+            count_tokens (Callable[[List[str]], List[int]]): Counts the tokens of each text.
+            budget (int): The maximum number of tokens of the whole prompt.
+            min_source_tokens (int): The fewest tokens kept of a source, lower ranked sources are
+            dropped rather than trimmed below it.
+        """
+        self.template = template
+        self.count_tokens = count_tokens
+        self.budget = budget
+        self.min_source_tokens = min_source_tokens
+        self.separator_tokens = count_tokens([SOURCE_SEPARATOR])[0]
+
+    def pack(self, query: str, abstracts: List[Abstract]) -> str:
+        """Build the sources of the prompt within the token budget.
+
+        Args:
+            query (str): The original query posted by the user, to rank the sentences.
+            abstracts (List[Abstract]): The retrieved abstracts, best first.
+
+        Returns:
+            str: The sources to fill the template with.
+        """
+        entries = [format_source(abstract.id, abstract.abstract) for abstract in abstracts]
+        overhead, *entry_tokens = self.count_tokens(
+            [self.template.format(query=query, sources="")] + entries)
+        original = overhead + sum(entry_tokens) + self.separator_tokens * max(len(entries) - 1, 0)
+        if original <= self.budget:
+            return SOURCE_SEPARATOR.join(entries)
+
+        available = self.budget - overhead
+        if available <= 0:
+            logger.warning(
+                f"The prompt budget of {self.budget} tokens cannot fit the template, sending no sources.")
+            return ""
+
+        n_fit = min(len(abstracts), max(
+            1, available // (self.min_source_tokens + self.separator_tokens)))
+        query_terms = set(tokenize(query))
+
+        packed: List[str] = []
+        remaining = available
+        for i in range(n_fit):
+            share = remaining // (n_fit - i) - self.separator_tokens
+            if entry_tokens[i] <= share:
+                entry, used = entries[i], entry_tokens[i]
+            else:
+                entry, used = self.compress(abstracts[i], query_terms, share)
+            if entry:
+                packed.append(entry)
+                remaining -= used + self.separator_tokens
+
+        # Tokens do not add up exactly across the joins, drop the last sources until it fits.
+        sources = SOURCE_SEPARATOR.join(packed)
+        final = self.count_tokens([self.template.format(query=query, sources=sources)])[0]
+        while final > self.budget and len(packed) > 1:
+            packed.pop()
+            sources = SOURCE_SEPARATOR.join(packed)
+            final = self.count_tokens([self.template.format(query=query, sources=sources)])[0]
+
+        logger.info(
+            f"Packed {len(packed)}/{len(abstracts)} sources into {final} prompt tokens, "
+            f"saved {original - final} of {original} tokens.")
+        return sources
+
+    def compress(self, abstract: Abstract, query_terms: Set[str], budget: int) -> Tuple[str, int]:
+        """Extract the sentences of the abstract most relevant to the query within the budget,
+        kept in their original order.
+
+        Args:
+            abstract (Abstract): The abstract to compress.
+            query_terms (Set[str]): The terms of the query.
+            budget (int): The maximum number of tokens of the formatted source.
+
+        Returns:
+            Tuple[str, int]: The formatted source and its number of tokens, empty if nothing fits.
+        """
+        sentences = split_sentences(abstract.abstract)
+        wrapper, *sentence_tokens = self.count_tokens(
+            [format_source(abstract.id, "")] + sentences)
+        if not sentences or budget <= wrapper:
+            return "", 0
+
+        def relevance(i: int) -> int:
+            return len(query_terms.intersection(tokenize(sentences[i])))
+
+        # Most relevant first, earlier sentences first among equals.
+        ranked = sorted(range(len(sentences)), key=lambda i: (-relevance(i), i))
+
+        chosen, used = [], wrapper
+        for i in ranked:
+            if used + sentence_tokens[i] <= budget:
+                chosen.append(i)
+                used += sentence_tokens[i]
+
+        if chosen:
+            text = " ".join(sentences[i] for i in sorted(chosen))
+            return format_source(abstract.id, text), used
+
+        # Even the most relevant sentence is over the budget, cut it proportionally by words.
+        best = ranked[0]
+        words = sentences[best].split()
+        keep = len(words) * (budget - wrapper) // max(sentence_tokens[best], 1)
+        if keep <= 0:
+            return "", 0
+        return format_source(abstract.id, " ".join(words[:keep]) + " ..."), budget
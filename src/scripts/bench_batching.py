@@ -0,0 +1,92 @@
+"""Benchmark the requests/sec of the LM with and without the dynamic batching scheduler at
+different numbers of concurrent clients.
+
+Run from the src/ directory:
+    python -m scripts.bench_batching --models mock gpt2 --concurrency 1 4 16
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List
+
+from models.lm import LanguageModel
+from models.scheduler import BatchScheduler
+from utils.config import load_config
+from utils.constants import Constants
+from utils.executors import get_inference_executor, run_in_executor, shutdown_executors
+
+PROMPT = (
+    "Summarize the following source in one sentence.\n\nSources:\n[UT] - \"Universal Transformers "
+    "generalize the standard Transformer by introducing recurrence over depth.\"\n\nSummary:"
+)
+
+
+async def drive(generate, concurrency: int, requests: int) -> float:
+    """Send the requests from the given number of concurrent clients.
+
+    Returns:
+        float: The achieved requests per second.
+    """
+    remaining = iter(range(requests))
+
+    async def client() -> None:
+        for _ in remaining:
+            await generate(PROMPT)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return requests / (time.perf_counter() - start)
+
+
+async def bench_model(lang_model: LanguageModel, concurrency: List[int], requests: int,
+                      batch_size: int, wait_ms: float) -> List[Dict]:
+    scheduler = BatchScheduler(
+        lang_model, max_batch_size=batch_size, max_wait_ms=wait_ms)
+
+    async def unbatched(prompt: str) -> str:
+        return await run_in_executor(get_inference_executor(), lang_model.generate, prompt)
+
+    results = []
+    for clients in concurrency:
+        baseline = await drive(unbatched, clients, requests)
+        batched = await drive(scheduler.generate, clients, requests)
+        results.append({
+            "clients": clients,
+            "unbatched_rps": round(baseline, 3),
+            "batched_rps": round(batched, 3),
+            "speedup": round(batched / baseline, 2)
+        })
+
+    scheduler.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=["mock", "gpt2"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32,
+                        help="Number of requests sent per concurrency level.")
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--wait-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    gen_config = load_config()[Constants.GENERATOR]
+    gen_config[Constants.MAX_TOKENS] = args.max_tokens
+
+    report = {}
+    for model_key in args.models:
+        gen_config[Constants.LM] = model_key
+        lang_model = LanguageModel()
+        report[model_key] = asyncio.run(bench_model(
+            lang_model, args.concurrency, args.requests, args.batch_size, args.wait_ms))
+
+    shutdown_executors()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Benchmark the CPU inference modes of the LM: the load time, peak RSS, prefill latency and
+tokens/sec of each model key in each mode.
+
+Every model and mode is loaded in a fresh process so that the peak RSS is its own.
+
+Run from the src/ directory:
+    python -m scripts.bench_cpu --models gpt2 phi --modes fp32 bf16 int8 --compile --threads 8
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+from utils.config import load_config
+from utils.constants import Constants
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+PROMPT = (
+    "You are a helpful assistant tasked with summarizing academic content.\n\nSources:\n"
+    "[UT] - \"Universal Transformers generalize the standard Transformer by introducing recurrence "
+    "over depth, combining the parallelism of self attention with the inductive bias of recurrent "
+    "networks, and improve the generalization on algorithmic and language understanding tasks.\"\n\n"
+    "Summary:"
+)
+
+# The generator options of each mode.
+MODES = {
+    "fp32": {Constants.DTYPE: "float32", Constants.QUANTIZE: "none"},
+    "bf16": {Constants.DTYPE: "bfloat16", Constants.QUANTIZE: "none"},
+    "int8": {Constants.DTYPE: "float32", Constants.QUANTIZE: "int8"},
+}
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench(model_key: str, mode: str, compile_forward: bool, threads: int,
+          new_tokens: int, repeats: int) -> Dict:
+    """Load the model in the mode and measure it, run in its own process.
+
+    Returns:
+        Dict: The measurements of the model in the mode.
+    """
+    import torch
+
+    from models.lm import LanguageModel
+
+    gen_config = load_config()[Constants.GENERATOR]
+    gen_config.update(MODES[mode])
+    gen_config[Constants.LM] = model_key
+    gen_config[Constants.COMPILE] = compile_forward
+    gen_config[Constants.THREADS] = threads
+    gen_config[Constants.MAX_TOKENS] = new_tokens
+
+    start = time.perf_counter()
+    lang_model = LanguageModel()
+    load_seconds = time.perf_counter() - start
+
+    result: Dict = {
+        "model": model_key,
+        "mode": mode + ("+compile" if compile_forward else ""),
+        "load_seconds": round(load_seconds, 3),
+        "prefill_ms": None,
+        "tokens_per_sec": None,
+    }
+
+    if not lang_model.is_mock:
+        inputs = lang_model.tokenizer(PROMPT, return_tensors="pt").to(lang_model.model.device)
+
+        with torch.inference_mode():
+            # Warm up, which also triggers the compilation.
+            lang_model.model(**inputs, use_cache=True)
+            lang_model.model.generate(**inputs, max_new_tokens=2, do_sample=False,
+                                      pad_token_id=lang_model.tokenizer.pad_token_id)
+
+            prefill = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                lang_model.model(**inputs, use_cache=True)
+                prefill.append(time.perf_counter() - start)
+
+            decode = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                outputs = lang_model.model.generate(
+                    **inputs, max_new_tokens=new_tokens, min_new_tokens=new_tokens,
+                    do_sample=False, pad_token_id=lang_model.tokenizer.pad_token_id)
+                generated = outputs.shape[1] - inputs["input_ids"].shape[1]
+                decode.append(generated / (time.perf_counter() - start))
+
+        result["prompt_tokens"] = inputs["input_ids"].shape[1]
+        result["prefill_ms"] = round(statistics.median(prefill) * 1000, 2)
+        result["tokens_per_sec"] = round(statistics.median(decode), 2)
+        result["threads"] = torch.get_num_threads()
+
+    result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    return result
+
+
+def run_isolated(model_key: str, mode: str, compile_forward: bool, threads: int,
+                 new_tokens: int, repeats: int) -> Dict:
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        try:
+            return pool.submit(bench, model_key, mode, compile_forward, threads,
+                               new_tokens, repeats).result()
+        except Exception as e:
+            return {"model": model_key, "mode": mode, "error": str(e)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=["mock", "gpt2"],
+                        help="Model keys among mock|gpt2|phi|mistral.")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--compile", action="store_true",
+                        help="Also measure each mode with the compiled forward pass.")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Intra-op threads, 0 keeps the torch default.")
+    parser.add_argument("--new-tokens", type=int, default=32,
+                        help="Number of tokens generated to measure tokens/sec.")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    report: List[Dict] = []
+    for model_key in args.models:
+        # The mock model has no weights, a single run is enough.
+        modes = ["fp32"] if model_key == "mock" else args.modes
+        for mode in modes:
+            for compile_forward in ([False, True] if args.compile and model_key != "mock" else [False]):
+                result = run_isolated(model_key, mode, compile_forward, args.threads,
+                                      args.new_tokens, args.repeats)
+                logger.info(f"Benchmarked {result}")
+                report.append(result)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
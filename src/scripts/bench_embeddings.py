@@ -0,0 +1,77 @@
+"""Benchmark the configured embedding model: latency per query (uncached and from the LRU cache)
+and time per 1k documents, optionally against chromadb's stock embedding function as a baseline.
+
+Run from the src/ directory:
+    python -m scripts.bench_embeddings --documents 1000 --queries 100 --baseline
+"""
+import argparse
+import json
+import statistics
+import time
+from typing import Callable, Dict, List
+
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+
+from models.embeddings import EmbeddingModel
+from scripts.feeds import synthesize_feed
+from utils.atom_parser import parse_feed
+
+
+def bench(embed_documents: Callable[[List[str]], object], embed_query: Callable[[str], object],
+          documents: List[str], queries: List[str]) -> Dict:
+    # Load the weights outside of the measurements.
+    embed_documents(documents[:1])
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        embed_query(query)
+        latencies.append(time.perf_counter() - start)
+
+    cached = []
+    for query in queries:
+        start = time.perf_counter()
+        embed_query(query)
+        cached.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    embed_documents(documents)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "query_p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "query_p95_ms": round(statistics.quantiles(latencies, n=20)[-1] * 1000, 3),
+        "repeated_query_p50_ms": round(statistics.median(cached) * 1000, 3),
+        "seconds_per_1k_documents": round(elapsed / len(documents) * 1000, 3)
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--baseline", action="store_true",
+                        help="Also measure chromadb's stock embedding function.")
+    args = parser.parse_args()
+
+    abstracts = parse_feed(synthesize_feed(args.documents, seed=1))
+    documents = [abstract.abstract for abstract in abstracts]
+    queries = [abstract.title for abstract in abstracts[:args.queries]]
+
+    model = EmbeddingModel()
+    report = {
+        f"{model.backend}:{model.model_name}": bench(
+            model.embed_documents, model.embed_query, documents, queries)
+    }
+
+    if args.baseline:
+        stock = DefaultEmbeddingFunction()
+        report["chromadb-default"] = bench(
+            stock, lambda query: stock([query]), documents, queries)  # type: ignore
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
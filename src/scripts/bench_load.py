@@ -0,0 +1,384 @@
+"""End to end load test of the service, fully offline: the server runs in process against a fake
+ArXiv API, the mock LM with a per token latency and a Chroma store seeded with synthetic
+abstracts, while concurrent clients drive /ask.
+
+The report is printed as JSON: the requests/sec, the latency percentiles, the errors by status,
+and the percentiles of each stage from the Server-Timing header. The queries are replayed from a
+log, JSON lines with a query field (or a title, as in requests.jsonl) or plain text lines. Compare
+with the report of a previous release with --baseline, which exits with 1 on a regression.
+
+Run from the src/ directory:
+    python -m scripts.bench_load --replay ../requests.jsonl --concurrency 16 --requests 200
+    python -m scripts.bench_load --output new.json --baseline old.json --tolerance 0.1
+    python -m scripts.bench_load --lm gpt2 --set generator.batch_size=16 --set retriever.speculative=False
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import yaml
+
+from utils.admission import DEADLINE_HEADER
+from utils.config import load_config
+from utils.constants import Constants
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+QUERIES = [
+    "transformers for reinforcement learning",
+    "retrieval augmented generation",
+    "graph neural networks for molecules",
+    "contrastive representation learning",
+    "quantization of large language models",
+    "diffusion models for image generation",
+    "federated learning privacy",
+    "sparse attention for long documents",
+]
+
+# The metrics compared against the baseline, and whether higher values are better.
+COMPARED = {
+    "requests_per_sec": True,
+    "latency_ms.p50": False,
+    "latency_ms.p95": False,
+    "latency_ms.p99": False,
+}
+
+
+def percentile(values: List[float], q: float) -> float:
+    """The q-th percentile of the values, interpolated between the closest ranks.
+    """
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(statistics.fmean(values), 2),
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(max(values), 2),
+    }
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """The milliseconds of each stage of a Server-Timing header.
+    """
+    stages = {}
+    for metric in header.split(","):
+        name, _, params = metric.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and name:
+                stages[name] = float(value)
+    return stages
+
+
+def load_queries(path: Optional[str], field: Optional[str]) -> List[str]:
+    """Read the queries to replay, in order.
+
+    Args:
+        path (Optional[str]): The query log, the built in queries if None.
+        field (Optional[str]): The field of the JSON lines holding the query, else the first of
+        query, title and body present.
+
+    Returns:
+        List[str]: The queries.
+    """
+    if path is None:
+        return list(QUERIES)
+
+    queries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                queries.append(line)
+                continue
+            if isinstance(record, str):
+                queries.append(record)
+                continue
+            keys = [field] if field else ["query", "title", "body"]
+            query = next((record[key] for key in keys if record.get(key)), None)
+            if query:
+                queries.append(query)
+    return queries
+
+
+def configure(args: argparse.Namespace, store: str, arxiv_url: str) -> Dict[str, Any]:
+    """Override the loaded configuration for the benchmark, before the server modules read it.
+
+    Returns:
+        Dict[str, Any]: The configuration the server runs with.
+    """
+    config = load_config()
+    config[Constants.ARXIV][Constants.URL] = arxiv_url
+    config[Constants.ARXIV][Constants.CACHE] = args.arxiv_cache
+    config[Constants.ARXIV][Constants.CACHE_PATH] = os.path.join(store, "arxiv_cache.sqlite3")
+    config[Constants.GENERATOR][Constants.LM] = args.lm
+    config[Constants.GENERATOR][Constants.MOCK_TOKEN_MS] = args.token_ms
+    config[Constants.GENERATOR][Constants.INFERENCE] = "local"
+    config[Constants.RETRIVER][Constants.MODE] = args.mode
+    config[Constants.RETRIVER][Constants.SAVE_FOLDER] = store
+    config[Constants.CACHE][Constants.ENABLED] = args.cache
+    # Only the Server-Timing header of the traces is needed.
+    config[Constants.TRACING][Constants.ENABLED] = True
+    config[Constants.TRACING][Constants.PATH] = ""
+    config[Constants.TRACING][Constants.SERVER_TIMING] = True
+
+    for override in args.set:
+        key, _, value = override.partition("=")
+        section, _, option = key.partition(".")
+        config[section][option] = yaml.safe_load(value)
+    return config
+
+
+def seed_store(documents: int, seed: int) -> int:
+    """Store synthetic abstracts in the configured collection, so that queries can hit locally.
+
+    Returns:
+        int: The number of documents in the collection.
+    """
+    from models.embeddings import get_embedding_model
+    from models.vector_stores.base import open_store
+    from scripts.feeds import synthesize_feed
+    from scripts.ingest import upsert
+    from utils.atom_parser import parse_feed
+
+    ret_config = load_config()[Constants.RETRIVER]
+    collection = open_store(ret_config)
+    if documents:
+        abstracts = parse_feed(synthesize_feed(documents, seed=seed))
+        embeddings = get_embedding_model().embed_documents([a.abstract for a in abstracts])
+        upsert(collection, abstracts, embeddings)
+    return collection.count()
+
+
+class ServerThread:
+    """Runs the FastAPI server with uvicorn on an event loop and thread of its own, so the clients
+    do not share its loop.
+    """
+
+    def __init__(self, port: int) -> None:
+        import uvicorn
+
+        from app import server
+
+        self.url = f"http://127.0.0.1:{port}"
+        self.uvicorn = uvicorn.Server(uvicorn.Config(
+            server, host="127.0.0.1", port=port, log_level="warning", timeout_keep_alive=30))
+        self.thread = threading.Thread(target=self.uvicorn.run, name="bench-server", daemon=True)
+
+    def start(self, timeout: float) -> None:
+        """Start the server and wait until it is ready, models loaded.
+        """
+        self.thread.start()
+        deadline = time.monotonic() + timeout
+        with httpx.Client(base_url=self.url) as client:
+            while time.monotonic() < deadline:
+                try:
+                    if client.get("/ready").status_code == 200 and client.post(
+                            "/ask", json={"query": "warm up"}, timeout=timeout).status_code == 200:
+                        return
+                except httpx.HTTPError:
+                    pass
+                time.sleep(0.5)
+        raise RuntimeError(f"The server was not ready within {timeout}s")
+
+    def close(self) -> None:
+        self.uvicorn.should_exit = True
+        self.thread.join()
+
+
+async def drive(url: str, queries: List[str], concurrency: int, requests: int,
+                timeout: float) -> Dict[str, Any]:
+    """Send the requests from the given number of concurrent clients, each sending its next query
+    as soon as its previous response is complete.
+
+    Returns:
+        Dict[str, Any]: The throughput, latencies, errors and stage timings of the run.
+    """
+    latencies: List[float] = []
+    waits: List[float] = []
+    stages: Dict[str, List[float]] = {}
+    statuses: Dict[str, int] = {}
+    cache_hits = 0
+    remaining = iter(range(requests))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        async def user() -> None:
+            nonlocal cache_hits
+            for i in remaining:
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/ask", json={"query": queries[i % len(queries)]},
+                                                 headers={DEADLINE_HEADER: str(timeout)})
+                    status = str(response.status_code)
+                except httpx.HTTPError as e:
+                    response, status = None, type(e).__name__
+                elapsed = (time.perf_counter() - start) * 1000
+
+                statuses[status] = statuses.get(status, 0) + 1
+                if response is None or response.status_code != 200:
+                    continue
+                latencies.append(elapsed)
+                waits.append(float(response.headers.get("X-Queue-Wait-Ms", 0)))
+                cache_hits += response.headers.get("X-Cache") == "HIT"
+                for name, ms in parse_server_timing(response.headers.get("Server-Timing", "")).items():
+                    stages.setdefault(name, []).append(ms)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        duration = time.perf_counter() - start
+        admission = (await client.get("/admission")).json()
+
+    return {
+        "requests": requests,
+        "ok": len(latencies),
+        "statuses": statuses,
+        "duration_seconds": round(duration, 3),
+        "requests_per_sec": round(len(latencies) / duration, 3),
+        "cache_hits": cache_hits,
+        "latency_ms": summarize(latencies),
+        "queue_wait_ms": summarize(waits),
+        "stages_ms": {name: summarize(values) for name, values in sorted(stages.items())},
+        "admission": admission,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> Dict[str, Any]:
+    """Compare the headline metrics with those of a baseline report.
+
+    Returns:
+        Dict[str, Any]: The change of each metric relative to the baseline, and those worse by
+        more than the tolerance.
+    """
+    def lookup(data: Dict[str, Any], path: str) -> Optional[float]:
+        for key in path.split("."):
+            data = data.get(key, {}) if isinstance(data, dict) else {}
+        return data if isinstance(data, (int, float)) else None
+
+    changes, regressions = {}, []
+    for path, higher_is_better in COMPARED.items():
+        new, old = lookup(report, path), lookup(baseline, path)
+        if new is None or not old:
+            continue
+        change = (new - old) / old
+        changes[path] = round(change, 4)
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(path)
+    return {"changes": changes, "regressions": regressions}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replay", help="The query log to replay, the built in queries if omitted.")
+    parser.add_argument("--field", help="The field of the query in the JSON lines of the log.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=120,
+                        help="The deadline of each request in seconds.")
+    parser.add_argument("--mode", default="hybrid", help="The retriever mode.")
+    parser.add_argument("--lm", default="mock", help="The LM, mock unless comparing real models.")
+    parser.add_argument("--token-ms", type=float, default=10,
+                        help="The milliseconds the mock LM takes per token.")
+    parser.add_argument("--cache", action="store_true", help="Enable the response cache.")
+    parser.add_argument("--arxiv-cache", action="store_true", help="Enable the ArXiv response cache.")
+    parser.add_argument("--arxiv-latency-ms", type=float, default=300)
+    parser.add_argument("--arxiv-jitter-ms", type=float, default=100)
+    parser.add_argument("--arxiv-error-rate", type=float, default=0.0)
+    parser.add_argument("--fixtures", nargs="*", default=[],
+                        help="Recorded feeds served by the fake ArXiv API instead of synthesized ones.")
+    parser.add_argument("--seed-docs", type=int, default=2000,
+                        help="The number of synthetic abstracts stored before the run.")
+    parser.add_argument("--store", help="The Chroma folder to use and keep, a temporary one if omitted.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--set", action="append", default=[], metavar="SECTION.OPTION=VALUE",
+                        help="Override a configuration option, e.g. generator.batch_size=16.")
+    parser.add_argument("--output", help="Also write the report to this file.")
+    parser.add_argument("--baseline", help="A previous report to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="The relative change of a metric beyond which it is a regression.")
+    args = parser.parse_args()
+
+    from scripts.fake_arxiv import FakeArxiv
+
+    store = args.store or tempfile.mkdtemp(prefix="bench_store_")
+    fake = FakeArxiv(0, args.arxiv_latency_ms, args.arxiv_jitter_ms, args.arxiv_error_rate,
+                     fixtures=args.fixtures, seed=args.seed).start()
+    config = configure(args, store, fake.url)
+    queries = load_queries(args.replay, args.field)
+
+    server = None
+    try:
+        documents = seed_store(args.seed_docs, args.seed)
+        logger.info(f"Seeded the store at {store} with {documents} documents.")
+
+        server = ServerThread(args.port)
+        server.start(args.timeout)
+        fake.counts.update(requests=0, errors=0)
+        result = asyncio.run(drive(server.url, queries, args.concurrency, args.requests, args.timeout))
+    finally:
+        if server is not None:
+            server.close()
+        fake.close()
+        if not args.store:
+            shutil.rmtree(store, ignore_errors=True)
+
+    report = {
+        "config": {
+            "queries": len(queries),
+            "concurrency": args.concurrency,
+            "mode": args.mode,
+            "lm": args.lm,
+            "token_ms": args.token_ms,
+            "cache": args.cache,
+            "seed_docs": documents,
+            "arxiv_latency_ms": args.arxiv_latency_ms,
+            "arxiv_error_rate": args.arxiv_error_rate,
+            "overrides": args.set,
+            "batch_size": config[Constants.GENERATOR][Constants.BATCH_SIZE],
+            "max_concurrent": config[Constants.ADMISSION][Constants.MAX_CONCURRENT],
+        },
+        **result,
+        "arxiv": dict(fake.counts),
+    }
+
+    regressed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = compare(report, json.load(f), args.tolerance)
+        regressed = bool(report["comparison"]["regressions"])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
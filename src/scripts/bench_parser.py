@@ -0,0 +1,110 @@
+"""Micro-benchmark of the streaming Atom parser against the previous DOM parser, on feed fixtures
+of different sizes. Reports the total parse time, the time to the first abstract and the peak
+memory allocated while parsing.
+
+Run from the src/ directory:
+    python -m scripts.bench_parser --sizes 25 100 500
+    python -m scripts.bench_parser --record "cat:cs.LG"   # record the fixtures from ArXiv first
+"""
+import argparse
+import json
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from typing import Callable, Dict, Iterator, List
+
+from dto.response import Abstract
+from scripts.feeds import load_fixture
+from utils.atom_parser import iter_abstracts, make_id
+
+CHUNK_SIZE = 16 * 1024
+
+
+def parse_feed_dom(body: bytes) -> Iterator[Abstract]:
+    """The previous parser, decoding the full body and building the whole tree before the first
+    abstract, with namespace resolution on every lookup.
+    """
+    root = ET.fromstring(body.decode("utf-8"))
+    ns = {"atom": "http://www.w3.org/2005/Atom"}
+
+    for entry in root.findall("atom:entry", ns):
+        title_node = entry.find("atom:title", ns)
+        summary_node = entry.find("atom:summary", ns)
+        published_node = entry.find("atom:published", ns)
+        arxiv_id_node = entry.find("atom:id", ns)
+        pdf_url = ""
+        for link in entry.findall("atom:link", ns):
+            if link.attrib.get("type") == "application/pdf":
+                pdf_url = link.attrib.get("href", "")
+                break
+
+        title = (title_node.text or "").strip().replace("\n", " ")
+        yield Abstract(
+            id=make_id(title),
+            arxiv_id=(arxiv_id_node.text or "").strip().split("/")[-1],
+            title=title,
+            abstract=(summary_node.text or "").strip().replace("\n", " "),
+            authors=", ".join(
+                name.text for author in entry.findall("atom:author", ns)
+                if (name := author.find("atom:name", ns)) is not None and name.text),
+            year=(published_node.text or "")[:4],
+            categories=", ".join(
+                cat.attrib.get("term", "") for cat in entry.findall("atom:category", ns)),
+            pdf_url=pdf_url
+        )
+
+
+def parse_feed_stream(body: bytes) -> Iterator[Abstract]:
+    chunks = (body[i:i + CHUNK_SIZE] for i in range(0, len(body), CHUNK_SIZE))
+    return iter_abstracts(chunks)
+
+
+def measure(parse: Callable[[bytes], Iterator[Abstract]], body: bytes, repeat: int) -> Dict:
+    totals: List[float] = []
+    firsts: List[float] = []
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        abstracts = parse(body)
+        next(abstracts)
+        firsts.append(time.perf_counter() - start)
+        count = 1 + sum(1 for _ in abstracts)
+        totals.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    for _ in parse(body):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "entries": count,
+        "total_ms": round(min(totals) * 1000, 3),
+        "first_abstract_ms": round(min(firsts) * 1000, 3),
+        "peak_kib": round(peak / 1024, 1)
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[25, 100, 500])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--record", default="",
+                        help="Record missing fixtures from ArXiv with this query instead of synthesizing.")
+    args = parser.parse_args()
+
+    report = {}
+    for size in args.sizes:
+        body = load_fixture(size, record_query=args.record).encode("utf-8")
+        report[size] = {
+            "body_kib": round(len(body) / 1024, 1),
+            "dom": measure(parse_feed_dom, body, args.repeat),
+            "stream": measure(parse_feed_stream, body, args.repeat)
+        }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Benchmark the vector store backends on the same corpus: the recall@k of their nearest neighbours
+against an exact search, the latency per query, the build time, and the time to open the store and
+its resident memory in a fresh process, as a new uvicorn worker would.
+
+The corpus is the embeddings of the configured Chroma store with --from-store, read from a copy under
+--workdir so the store is left as is, or synthetic clustered unit vectors. It is copied into a Chroma
+and an mmap store under --workdir. The queries are perturbed documents, so they have close
+neighbours as real queries do.
+
+Run from the src/ directory:
+    python -m scripts.bench_vector_store --documents 100000 --queries 200
+    python -m scripts.bench_vector_store --from-store --probes 4 8 16
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from models.vector_stores.base import VectorStore
+from models.vector_stores.chroma import ChromaStore, open_chroma
+from models.vector_stores.mmap_store import MmapStore
+from scripts.convert_store import copy_store
+from utils.config import load_config
+from utils.constants import Constants
+
+# The most documents chromadb accepts in a single upsert.
+CHROMA_BATCH = 5000
+
+
+def synthetic_corpus(documents: int, dim: int, clusters: int, seed: int) -> Dict[str, Any]:
+    """Unit vectors drawn around random centres, with short documents and metadata.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, clusters, documents)] + \
+        0.5 * rng.standard_normal((documents, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return {
+        "ids": [f"synthetic.{i:08d}" for i in range(documents)],
+        "embeddings": vectors,
+        "documents": [f"Synthetic abstract {i}." for i in range(documents)],
+        "metadatas": [{"title": f"Synthetic {i}", "categories": f"cs.{i % clusters}"} for i in range(documents)]
+    }
+
+
+def store_corpus(workdir: str, page_size: int = 1000) -> Dict[str, Any]:
+    """The documents of the configured Chroma store, with their stored embeddings, read from a copy
+    in the working folder.
+    """
+    ret_config = load_config()[Constants.RETRIVER]
+    path = copy_store(ret_config[Constants.SAVE_FOLDER], os.path.join(workdir, "source"), ret_config[Constants.COL_DOC])
+    source = open_chroma({**ret_config, Constants.SAVE_FOLDER.value: path})
+    corpus: Dict[str, List[Any]] = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+    while True:
+        page = source.get(include=["embeddings", "documents", "metadatas"],
+                          limit=page_size, offset=len(corpus["ids"]))
+        if not page["ids"]:
+            break
+        for field in corpus:
+            corpus[field].extend(page[field])
+    return {**corpus, "embeddings": np.asarray(corpus["embeddings"], dtype=np.float32)}
+
+
+def make_queries(embeddings: np.ndarray, count: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed + 1)
+    queries = embeddings[rng.integers(0, len(embeddings), count)] + \
+        0.05 * rng.standard_normal((count, embeddings.shape[1])).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def exact_neighbours(embeddings: np.ndarray, queries: np.ndarray, k: int) -> List[set]:
+    squared = (embeddings * embeddings).sum(axis=1)
+    truth = []
+    for query in queries:
+        distances = squared - 2 * embeddings @ query
+        truth.append(set(np.argpartition(distances, k - 1)[:k].tolist()))
+    return truth
+
+
+def open_backend(backend: str, workdir: str, probes: int) -> VectorStore:
+    if backend == "mmap":
+        return MmapStore(os.path.join(workdir, "mmap"), ivf_probes=probes)
+    import chromadb
+
+    client = chromadb.PersistentClient(path=os.path.join(workdir, "chroma"))
+    return ChromaStore(client.get_or_create_collection("bench"))
+
+
+def build(backend: str, workdir: str, corpus: Dict[str, Any]) -> float:
+    """Write the corpus to a new store of the backend.
+
+    Returns:
+        float: The seconds taken, including the training of the mmap IVF index.
+    """
+    started = time.perf_counter()
+    store = open_backend(backend, workdir, 1)
+    for start in range(0, len(corpus["ids"]), CHROMA_BATCH):
+        end = start + CHROMA_BATCH
+        store.upsert(ids=corpus["ids"][start:end], embeddings=corpus["embeddings"][start:end],
+                     documents=corpus["documents"][start:end], metadatas=corpus["metadatas"][start:end])
+    if isinstance(store, MmapStore):
+        store.compact()
+    return time.perf_counter() - started
+
+
+def measure(store: VectorStore, queries: np.ndarray, truth: List[set], rows: Dict[str, int],
+            k: int) -> Dict[str, float]:
+    """The recall@k and latency of single queries to the store.
+    """
+    latencies = []
+    found = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        results = store.query(query_embeddings=[query.tolist()], n_results=k)
+        latencies.append(time.perf_counter() - start)
+        found += len({rows[id_] for id_ in results["ids"][0]} & expected)
+    latencies.sort()
+    return {
+        "recall_at_k": round(found / (k * len(queries)), 4),
+        "p50_ms": round(1000 * statistics.median(latencies), 3),
+        "p95_ms": round(1000 * latencies[int(0.95 * (len(latencies) - 1))], 3)
+    }
+
+
+def memory() -> Dict[str, int]:
+    """The resident memory of this process in KiB, private and file backed, from /proc.
+    """
+    fields = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "RssAnon", "RssFile"):
+                fields[name] = int(value.split()[0])
+    return fields
+
+
+def cold_open(backend: str, workdir: str, probes: int, query: np.ndarray) -> Dict[str, Any]:
+    """Open the store in this fresh process and run a query, reporting the time and memory taken.
+    """
+    before = memory()
+    started = time.perf_counter()
+    store = open_backend(backend, workdir, probes)
+    opened = time.perf_counter() - started
+    store.query(query_embeddings=[query.tolist()], n_results=1)
+    after = memory()
+    return {
+        "open_ms": round(1000 * opened, 2),
+        "first_query_ms": round(1000 * (time.perf_counter() - started - opened), 2),
+        "rss_kib": after.get("VmRSS", 0) - before.get("VmRSS", 0),
+        "rss_anon_kib": after.get("RssAnon", 0) - before.get("RssAnon", 0),
+        "rss_file_kib": after.get("RssFile", 0) - before.get("RssFile", 0)
+    }
+
+
+def cold_open_subprocess(backend: str, workdir: str, probes: int, query: np.ndarray) -> Dict[str, Any]:
+    np.save(os.path.join(workdir, "query.npy"), query)
+    output = subprocess.run(
+        [sys.executable, "-m", "scripts.bench_vector_store", "--child", backend,
+         "--workdir", workdir, "--probes", str(probes)],
+        check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def folder_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+def run(corpus: Dict[str, Any], queries_count: int, k: int, probes: List[int], workdir: str,
+        seed: int) -> Dict[str, Any]:
+    embeddings = corpus["embeddings"]
+    queries = make_queries(embeddings, queries_count, seed)
+    truth = exact_neighbours(embeddings, queries, k)
+    rows = {id_: i for i, id_ in enumerate(corpus["ids"])}
+    report: Dict[str, Any] = {"documents": len(embeddings), "dim": int(embeddings.shape[1]),
+                              "queries": queries_count, "k": k}
+
+    for backend in ("chroma", "mmap"):
+        seconds = build(backend, workdir, corpus)
+        entry: Dict[str, Any] = {
+            "build_seconds": round(seconds, 2),
+            "disk_mib": round(folder_size(os.path.join(workdir, backend)) / 2 ** 20, 1)
+        }
+        settings: List[Tuple[str, int]] = [(f"probes={p}", p) for p in probes] if backend == "mmap" else [("", 0)]
+        for label, probe in settings:
+            store = open_backend(backend, workdir, probe)
+            results = measure(store, queries, truth, rows, k)
+            results["cold"] = cold_open_subprocess(backend, workdir, probe, queries[0])
+            if label:
+                entry[label] = results
+            else:
+                entry.update(results)
+        report[backend] = entry
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--from-store", action="store_true",
+                        help="Use the documents of the configured Chroma store as the corpus.")
+    parser.add_argument("--documents", type=int, default=20000,
+                        help="Number of synthetic documents, without --from-store.")
+    parser.add_argument("--dim", type=int, default=384, help="Dimension of the synthetic embeddings.")
+    parser.add_argument("--clusters", type=int, default=100, help="Number of synthetic clusters.")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries measured.")
+    parser.add_argument("--k", type=int, default=5, help="Number of neighbours per query.")
+    parser.add_argument("--probes", type=int, nargs="+", default=[8],
+                        help="The IVF lists searched per query by the mmap store, measured in turn.")
+    parser.add_argument("--workdir", default=None,
+                        help="Folder of the benchmark stores, a temporary one removed after by default.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--child", choices=["chroma", "mmap"], default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        query = np.load(os.path.join(args.workdir, "query.npy"))
+        print(json.dumps(cold_open(args.child, args.workdir, args.probes[0], query)))
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_vector_store_")
+    try:
+        corpus = store_corpus(workdir) if args.from_store else \
+            synthetic_corpus(args.documents, args.dim, args.clusters, args.seed)
+        if len(corpus["ids"]) < args.k:
+            parser.error(f"The corpus holds {len(corpus['ids'])} documents, fewer than k.")
+        report = run(corpus, args.queries, args.k, args.probes, workdir, args.seed)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
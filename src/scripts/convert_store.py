@@ -0,0 +1,113 @@
+"""Copy the Chroma store of the configuration into the memory-mapped files of the mmap backend,
+under save_folder/collection_docs/, without embedding anything again.
+
+The documents are copied page by page with their stored embeddings, checkpointing the number copied
+so an interrupted run can be resumed, then the IVF index is trained on the whole store. They are read
+from a temporary copy of the Chroma store, as opening it with chromadb writes to its files, so the
+store is left as is. Switch retriever.backend to mmap once the copy is checked.
+
+Run from the src/ directory:
+    python -m scripts.convert_store
+    python -m scripts.convert_store --output /tmp/arxiv_docs
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from models.vector_stores.chroma import open_chroma
+from models.vector_stores.mmap_store import MmapStore
+from scripts.ingest import load_checkpoint, save_checkpoint
+from utils.config import load_config
+from utils.constants import Constants
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+
+def copy_store(path: str, folder: str, collection_docs: str) -> str:
+    """Copy the files of the Chroma store, leaving out the mmap store kept in the same folder.
+
+    Args:
+        path (str): The folder of the store.
+        folder (str): The folder to copy it into.
+        collection_docs (str): The name of the collection, the folder of the mmap store.
+
+    Returns:
+        str: The folder of the copy.
+    """
+    destination = os.path.join(folder, "chroma")
+    shutil.copytree(path, destination, ignore=shutil.ignore_patterns(collection_docs))
+    return destination
+
+
+def convert(path: str, output: str, page_size: int, checkpoint: str, restart: bool) -> None:
+    """Copy the documents of the Chroma store into the mmap store.
+
+    Args:
+        path (str): The folder of the store.
+        output (str): The folder of the mmap store.
+        page_size (int): The number of documents copied at a time.
+        checkpoint (str): The path of the checkpoint file.
+        restart (bool): Ignore the checkpoint and copy from the first document.
+    """
+    ret_config = load_config()[Constants.RETRIVER]
+    name = ret_config[Constants.COL_DOC]
+    target = MmapStore(output, ret_config[Constants.IVF_LISTS], ret_config[Constants.IVF_PROBES])
+
+    checkpoint_source = f"mmap:{os.path.abspath(path)}:{name}"
+    offset = 0 if restart else load_checkpoint(checkpoint, checkpoint_source)
+    if offset:
+        logger.info(f"Resuming the conversion of '{name}' after {offset} documents.")
+
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="convert_store_") as folder:
+        source = open_chroma({**ret_config, Constants.SAVE_FOLDER.value: copy_store(path, folder, name)})
+        total = source.count()
+        while offset < total:
+            page = source.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            target.upsert(ids=page["ids"], embeddings=page["embeddings"],
+                          documents=page["documents"], metadatas=page["metadatas"])
+            offset += len(page["ids"])
+            save_checkpoint(checkpoint, checkpoint_source, offset)
+            logger.info(f"Converted {offset} of {total} documents.")
+
+    target.compact()
+    report = {
+        "collection": name,
+        "documents": total,
+        "converted": target.count(),
+        "ivf_lists": len(target.current().centroids),
+        "seconds": round(time.perf_counter() - started, 2)
+    }
+    logger.info(f"Conversion report: {report}")
+    print(json.dumps(report, indent=2))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default=None,
+                        help="The folder of the store, defaults to retriever.save_folder.")
+    parser.add_argument("--output", default=None,
+                        help="The folder of the mmap store, defaults to retriever.save_folder/collection_docs.")
+    parser.add_argument("--page-size", type=int, default=1000,
+                        help="Number of documents copied at a time.")
+    parser.add_argument("--checkpoint", default="convert_checkpoint.json",
+                        help="File recording the progress, to resume an interrupted run.")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore the checkpoint and start from the first document.")
+    args = parser.parse_args()
+
+    ret_config = load_config()[Constants.RETRIVER]
+    path = args.path or ret_config[Constants.SAVE_FOLDER]
+    output = args.output or os.path.join(path, ret_config[Constants.COL_DOC])
+    convert(path, output, args.page_size, args.checkpoint, args.restart)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""A local stand-in for the ArXiv API, serving Atom feeds with a configurable latency and error
+rate, so that the service can be benchmarked without hitting the real API.
+
+Each query is answered with a recorded fixture when given, else with a feed synthesized from the
+query, so repeated queries get the same papers and different ones mostly new papers.
+
+Run from the src/ directory:
+    python -m scripts.fake_arxiv --port 8765 --latency-ms 300 --jitter-ms 100 --error-rate 0.01
+"""
+import argparse
+import random
+import threading
+import time
+import zlib
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from scripts.feeds import synthesize_feed
+
+
+class FakeArxiv:
+    """Serves the feeds from a thread of its own, counting the requests and errors served.
+    """
+
+    def __init__(self, port: int = 0, latency_ms: float = 0, jitter_ms: float = 0,
+                 error_rate: float = 0, error_status: int = 503,
+                 fixtures: Optional[List[str]] = None, seed: int = 0) -> None:
+        """
+        Args:
+            port (int): The port to listen on, 0 picks a free one.
+            latency_ms (float): The mean delay before the response starts, in milliseconds.
+            jitter_ms (float): The standard deviation of the delay, in milliseconds.
+            error_rate (float): The fraction of the requests answered with error_status.
+            error_status (int): The status of the failed requests, 503 is retried by the client.
+            fixtures (Optional[List[str]]): Recorded feeds served instead of synthesized ones, picked by the query.
+            seed (int): The seed of the latencies, errors and synthesized feeds.
+        """
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.fixtures: List[bytes] = []
+        for path in fixtures or []:
+            with open(path, "rb") as f:
+                self.fixtures.append(f.read())
+        self.counts: Dict[str, int] = {"requests": 0, "errors": 0}
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self.handler())
+        self.httpd.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/api/query"
+
+    @lru_cache(maxsize=1024)
+    def feed(self, query: str, entries: int) -> bytes:
+        if self.fixtures:
+            return self.fixtures[zlib.crc32(query.encode()) % len(self.fixtures)]
+        return synthesize_feed(entries, seed=zlib.crc32(query.encode()) ^ self.seed).encode("utf-8")
+
+    def respond(self, query: str, entries: int) -> Tuple[float, int, bytes]:
+        """Draw the delay and outcome of a request.
+
+        Returns:
+            Tuple[float, int, bytes]: The seconds to wait, the status and the body of the response.
+        """
+        with self.lock:
+            self.counts["requests"] += 1
+            delay = max(0.0, self.rng.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+            failed = self.rng.random() < self.error_rate
+            if failed:
+                self.counts["errors"] += 1
+
+        if failed:
+            return delay, self.error_status, b"Service unavailable"
+        return delay, 200, self.feed(query, entries)
+
+    def handler(self) -> type:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                params = parse_qs(urlparse(self.path).query)
+                query = params.get("search_query", [""])[0]
+                entries = int(params.get("max_results", ["25"])[0])
+                delay, status, body = fake.respond(query, entries)
+
+                time.sleep(delay)
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/atom+xml; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up, e.g. a speculative fetch discarded on a local hit.
+                    pass
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        return Handler
+
+    def start(self) -> "FakeArxiv":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fake-arxiv", daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--fixtures", nargs="*", default=[],
+                        help="Recorded feeds to serve, e.g. scripts/fixtures/feed_25.xml.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fake = FakeArxiv(args.port, args.latency_ms, args.jitter_ms, args.error_rate,
+                     args.error_status, args.fixtures, args.seed)
+    print(f"Serving a fake ArXiv API at {fake.url}, set it as arxiv.url.")
+    try:
+        fake.httpd.serve_forever()
+    except KeyboardInterrupt:
+        fake.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Helpers to build ArXiv Atom feed fixtures, either recorded from the live API or synthesized
+deterministically when the API is not reachable.
+"""
+import os
+import random
+from xml.sax.saxutils import escape
+
+import requests
+
+from utils.config import load_config
+from utils.constants import Constants
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+WORDS = (
+    "transformer attention graph reinforcement learning policy language model retrieval sparse "
+    "dense embedding diffusion generative adversarial network convolution recurrent memory "
+    "optimization gradient bayesian inference causal representation contrastive supervised "
+    "benchmark dataset robust efficient scalable distributed federated quantization pruning"
+).split()
+CATEGORIES = ["cs.CL", "cs.LG", "cs.AI", "cs.CV", "cs.IR", "stat.ML", "cs.RO", "cs.NE"]
+
+
+def synthesize_feed(entries: int, seed: int = 0) -> str:
+    """Build an Atom feed shaped like an ArXiv API response with random but deterministic content.
+
+    Args:
+        entries (int): The number of entries in the feed.
+        seed (int): The seed of the random content.
+
+    Returns:
+        str: The XML body of the feed.
+    """
+    rng = random.Random(seed)
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<feed xmlns="http://www.w3.org/2005/Atom" '
+        'xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/" '
+        'xmlns:arxiv="http://arxiv.org/schemas/atom">\n'
+        f'  <title type="html">ArXiv Query: synthetic</title>\n'
+        f'  <opensearch:totalResults>{entries}</opensearch:totalResults>\n'
+    ]
+    for i in range(entries):
+        arxiv_id = f"{rng.randint(1501, 2412)}.{rng.randint(0, 99999):05d}v{rng.randint(1, 4)}"
+        title = " ".join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(4, 10)))
+        summary = " ".join(rng.choice(WORDS) for _ in range(rng.randint(120, 250)))
+        # Wrap the summary like ArXiv does, so the newline handling is exercised.
+        summary = "\n".join(summary[j:j + 80] for j in range(0, len(summary), 80))
+        year = rng.randint(2015, 2024)
+        categories = rng.sample(CATEGORIES, rng.randint(1, 3))
+        authors = "".join(
+            f"    <author>\n      <name>Author {rng.randint(0, 10000)}</name>\n    </author>\n"
+            for _ in range(rng.randint(1, 8))
+        )
+        parts.append(
+            "  <entry>\n"
+            f"    <id>http://arxiv.org/abs/{arxiv_id}</id>\n"
+            f"    <updated>{year}-01-{i % 28 + 1:02d}T00:00:00Z</updated>\n"
+            f"    <published>{year}-01-{i % 28 + 1:02d}T00:00:00Z</published>\n"
+            f"    <title>{escape(title)}</title>\n"
+            f"    <summary>  {escape(summary)}\n</summary>\n"
+            f"{authors}"
+            f'    <link href="http://arxiv.org/abs/{arxiv_id}" rel="alternate" type="text/html"/>\n'
+            f'    <link title="pdf" href="http://arxiv.org/pdf/{arxiv_id}" rel="related" type="application/pdf"/>\n'
+            f'    <arxiv:primary_category term="{categories[0]}" scheme="http://arxiv.org/schemas/atom"/>\n'
+            + "".join(f'    <category term="{c}" scheme="http://arxiv.org/schemas/atom"/>\n' for c in categories)
+            + "  </entry>\n"
+        )
+    parts.append("</feed>\n")
+    return "".join(parts)
+
+
+def record_feed(query: str, entries: int) -> str:
+    """Record the raw response of the live ArXiv API for the query.
+
+    Args:
+        query (str): The search query.
+        entries (int): The number of results to request.
+
+    Returns:
+        str: The XML body of the response.
+    """
+    url = load_config()[Constants.ARXIV][Constants.URL]
+    response = requests.get(
+        url, params={"search_query": query, "start": 0, "max_results": entries}, timeout=60)
+    response.raise_for_status()
+    return response.text
+
+
+def load_fixture(entries: int, record_query: str = "") -> str:
+    """Load the feed fixture with the given number of entries, recording it from the API when a
+    query is given, else synthesizing it, if it does not exist yet.
+
+    Args:
+        entries (int): The number of entries in the feed.
+        record_query (str): The query to record the fixture with.
+
+    Returns:
+        str: The XML body of the feed.
+    """
+    path = os.path.join(FIXTURES_DIR, f"feed_{entries}.xml")
+    if not os.path.exists(path):
+        os.makedirs(FIXTURES_DIR, exist_ok=True)
+        text = record_feed(record_query, entries) if record_query else synthesize_feed(entries)
+        with open(path, "w") as f:
+            f.write(text)
+
+    with open(path) as f:
+        return f.read()
@@ -0,0 +1,305 @@
+"""Bulk ingest ArXiv metadata into the configured vector store, so that most queries are served
+from the local store instead of falling back to the ArXiv API.
+
+Records are read in a streaming fashion either by paging the ArXiv API for a category and date
+range, or from a local ArXiv metadata dump (the JSON lines snapshot, one paper per line). They are
+embedded in large batches by a pool of processes and upserted into `collection_docs`, or into its
+category shards when the store is sharded, batch by batch, checkpointing the number of records
+persisted so an interrupted run can be resumed.
+
+Run from the src/ directory:
+    python -m scripts.ingest dump --path arxiv-metadata-oai-snapshot.json
+    python -m scripts.ingest api --category cs.CL --from 2024-01-01 --to 2024-06-30
+"""
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from email.utils import parsedate_to_datetime
+from itertools import islice
+from typing import Deque, Iterator, List, Optional, Tuple
+
+from dto.response import Abstract
+from models.embeddings import EmbeddingModel
+from models.retrieval_systems.base import abstract_to_metadata
+from models.vector_stores.base import open_store
+from utils.api_client import stream_metadata
+from utils.atom_parser import make_id
+from utils.config import load_config
+from utils.constants import Constants
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+# The embedding model of each worker process, created once by the pool initializer.
+WORKER_EMBEDDING = None
+
+
+def init_worker() -> None:
+    global WORKER_EMBEDDING
+    WORKER_EMBEDDING = EmbeddingModel()
+
+
+def embed_documents(documents: List[str]) -> List[List[float]]:
+    """Embed a batch of documents in a worker process.
+
+    Args:
+        documents (List[str]): The documents to embed.
+
+    Returns:
+        List[List[float]]: The embeddings, in the same order as the documents.
+    """
+    return WORKER_EMBEDDING.embed_documents(documents)  # type: ignore
+
+
+def dump_record_to_abstract(record: dict) -> Optional[Abstract]:
+    """Convert a record of the ArXiv metadata dump to the same shape as the API's abstracts.
+
+    Args:
+        record (dict): The parsed JSON record.
+
+    Returns:
+        Optional[Abstract]: The abstract, None if the record misses its title or abstract.
+    """
+    title = " ".join((record.get("title") or "").split())
+    summary = " ".join((record.get("abstract") or "").split())
+    if not title or not summary:
+        return None
+
+    versions = record.get("versions") or []
+    arxiv_id = record["id"] + (versions[-1]["version"] if versions else "")
+    try:
+        year = str(parsedate_to_datetime(versions[0]["created"]).year)
+    except (IndexError, KeyError, TypeError, ValueError):
+        year = (record.get("update_date") or "")[:4]
+
+    if record.get("authors_parsed"):
+        authors = ", ".join(
+            " ".join(part for part in (name[1], name[0]) if part) for name in record["authors_parsed"])
+    else:
+        authors = " ".join((record.get("authors") or "").split())
+
+    return Abstract(
+        id=make_id(title),
+        arxiv_id=arxiv_id,
+        title=title,
+        authors=authors,
+        year=year,
+        categories=", ".join((record.get("categories") or "").split()),
+        abstract=summary,
+        pdf_url=f"https://arxiv.org/pdf/{arxiv_id}"
+    )
+
+
+def iter_dump(path: str, skip: int) -> Iterator[Tuple[int, Abstract]]:
+    """Stream the abstracts of a JSON lines metadata dump, one line at a time.
+
+    Args:
+        path (str): The path of the dump.
+        skip (int): The number of lines already ingested, to resume from.
+
+    Yields:
+        Iterator[Tuple[int, Abstract]]: The number of lines consumed so far and the abstract of the
+        last one, invalid records are skipped.
+    """
+    with open(path, "r") as f:
+        for position, line in enumerate(islice(f, skip, None), start=skip + 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                abstract = dump_record_to_abstract(json.loads(line))
+            except (json.JSONDecodeError, KeyError) as e:
+                logger.warning(f"Skipped an invalid record of the dump: {e}")
+                continue
+            if abstract is not None:
+                yield position, abstract
+
+
+def iter_api(category: str, date_from: str, date_to: str, page_size: int,
+             delay: float, skip: int) -> Iterator[Tuple[int, Abstract]]:
+    """Page through the ArXiv API for a category and submission date range, streaming each page.
+
+    Args:
+        category (str): The ArXiv category, e.g. cs.CL.
+        date_from (str): The first submission date, as YYYY-MM-DD.
+        date_to (str): The last submission date, as YYYY-MM-DD.
+        page_size (int): The number of results requested per page.
+        delay (float): The seconds to wait between pages, ArXiv asks for at least 3.
+        skip (int): The number of records already ingested, to resume from.
+
+    Yields:
+        Iterator[Tuple[int, Abstract]]: The number of results consumed so far and the last abstract,
+        in the order returned by ArXiv.
+    """
+    query = (f"cat:{category} AND submittedDate:"
+             f"[{date_from.replace('-', '')}0000 TO {date_to.replace('-', '')}2359]")
+    start = skip
+
+    while True:
+        received = 0
+        for abstract in stream_metadata(query=query, max_results=page_size, start=start):
+            received += 1
+            yield start + received, abstract
+
+        logger.info(f"Received {received} records from offset {start}.")
+        if received == 0:
+            return
+
+        start += received
+        time.sleep(delay)
+
+
+def batched(records: Iterator[Tuple[int, Abstract]], size: int) -> Iterator[Tuple[int, List[Abstract]]]:
+    """Group the records in batches, along with the source position reached by each batch.
+    """
+    while batch := list(islice(records, size)):
+        yield batch[-1][0], [abstract for _, abstract in batch]
+
+
+def load_checkpoint(path: str, source: str) -> int:
+    if not os.path.exists(path):
+        return 0
+
+    with open(path) as f:
+        checkpoint = json.load(f)
+
+    if checkpoint.get("source") != source:
+        logger.warning(
+            f"Checkpoint {path} is for '{checkpoint.get('source')}', starting '{source}' from scratch.")
+        return 0
+
+    return int(checkpoint["position"])
+
+
+def save_checkpoint(path: str, source: str, position: int) -> None:
+    # Written to a temporary file first so an interruption never leaves a partial checkpoint.
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({"source": source, "position": position}, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def upsert(collection, batch: List[Abstract], embeddings: List[List[float]]) -> int:
+    """Upsert a batch into the collection, the last occurrence of a duplicate id wins.
+
+    Returns:
+        int: The number of unique documents written.
+    """
+    unique = {abstract.arxiv_id: (abstract, embedding)
+              for abstract, embedding in zip(batch, embeddings)}
+    collection.upsert(
+        ids=list(unique.keys()),
+        embeddings=[embedding for _, embedding in unique.values()],  # type: ignore
+        documents=[abstract.abstract for abstract, _ in unique.values()],
+        metadatas=[abstract_to_metadata(abstract) for abstract, _ in unique.values()]
+    )
+    return len(unique)
+
+
+def ingest(records: Iterator[Tuple[int, Abstract]], source: str, position: int, checkpoint: str,
+           batch_size: int, workers: int) -> None:
+    """Embed the records with the process pool and upsert them batch by batch, in order, keeping
+    up to two batches per worker in flight.
+
+    Args:
+        records (Iterator[Tuple[int, Abstract]]): The source positions and abstracts to ingest.
+        source (str): The identifier of the source, stored in the checkpoint.
+        position (int): The number of records already ingested from the source.
+        checkpoint (str): The path of the checkpoint file.
+        batch_size (int): The number of documents per embedding and upsert batch.
+        workers (int): The number of embedding processes.
+    """
+    ret_config = load_config()[Constants.RETRIVER]
+    collection = open_store(ret_config)
+
+    started = time.perf_counter()
+    ingested = 0
+    pending: Deque[Tuple[int, List[Abstract], Future]] = deque()
+
+    def write_oldest() -> None:
+        nonlocal position, ingested
+        batch_position, batch, future = pending.popleft()
+        ingested += upsert(collection, batch, future.result())
+        position = batch_position
+        save_checkpoint(checkpoint, source, position)
+
+        elapsed = time.perf_counter() - started
+        logger.info(
+            f"Ingested {ingested} documents ({position} records of the source) "
+            f"at {ingested / elapsed:.1f} docs/sec.")
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+            for batch_position, batch in batched(records, batch_size):
+                pending.append((batch_position, batch, pool.submit(
+                    embed_documents, [abstract.abstract for abstract in batch])))
+                if len(pending) >= 2 * workers:
+                    write_oldest()
+
+            while pending:
+                write_oldest()
+    finally:
+        # Saves what the store keeps in memory, such as the centroids of the shards, interrupted too.
+        collection.close()
+
+    elapsed = time.perf_counter() - started
+    report = {
+        "source": source,
+        "documents": ingested,
+        "position": position,
+        "seconds": round(elapsed, 2),
+        "docs_per_sec": round(ingested / elapsed, 2) if elapsed else 0.0,
+        "collection_size": collection.count()
+    }
+    logger.info(f"Ingestion report: {report}")
+    print(json.dumps(report, indent=2))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=512,
+                        help="Number of documents per embedding and upsert batch.")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Number of embedding processes.")
+    parser.add_argument("--checkpoint", default="ingest_checkpoint.json",
+                        help="File recording the progress, to resume an interrupted run.")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore the checkpoint and start from the beginning.")
+    sources = parser.add_subparsers(dest="source", required=True)
+
+    dump = sources.add_parser("dump", help="Ingest a JSON lines ArXiv metadata dump.")
+    dump.add_argument("--path", required=True)
+
+    api = sources.add_parser("api", help="Ingest a category and date range from the ArXiv API.")
+    api.add_argument("--category", required=True)
+    api.add_argument("--from", dest="date_from", required=True, help="YYYY-MM-DD")
+    api.add_argument("--to", dest="date_to", required=True, help="YYYY-MM-DD")
+    api.add_argument("--page-size", type=int, default=500)
+    api.add_argument("--delay", type=float, default=3.0,
+                     help="Seconds between API pages.")
+
+    args = parser.parse_args()
+
+    if args.source == "dump":
+        source = f"dump:{os.path.abspath(args.path)}"
+    else:
+        source = f"api:{args.category}:{args.date_from}:{args.date_to}"
+
+    position = 0 if args.restart else load_checkpoint(args.checkpoint, source)
+    if position:
+        logger.info(f"Resuming '{source}' after {position} records.")
+
+    if args.source == "dump":
+        records = iter_dump(args.path, skip=position)
+    else:
+        records = iter_api(args.category, args.date_from, args.date_to,
+                           args.page_size, args.delay, skip=position)
+
+    ingest(records, source, position, args.checkpoint, args.batch_size, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Migrate the unsharded `collection_docs` of an existing store into a collection per primary
+category, along with the centroids the query router needs, without embedding anything again.
+
+The documents are copied page by page with their stored embeddings, checkpointing the number copied
+so an interrupted run can be resumed. The source collection is kept unless --drop is given, so the
+migration can be checked before setting retriever.sharded.
+
+Run from the src/ directory:
+    python -m scripts.shard_store
+    python -m scripts.shard_store --drop
+"""
+import argparse
+import json
+import os
+import time
+
+import chromadb
+
+from models.vector_stores.shards import ShardedCollection
+from scripts.ingest import load_checkpoint, save_checkpoint
+from utils.config import load_config
+from utils.constants import Constants
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+
+def migrate(path: str, page_size: int, checkpoint: str, restart: bool, drop: bool) -> None:
+    """Copy the documents of the collection into its shards.
+
+    Args:
+        path (str): The folder of the store.
+        page_size (int): The number of documents copied at a time.
+        checkpoint (str): The path of the checkpoint file.
+        restart (bool): Ignore the checkpoint and copy from the first document.
+        drop (bool): Delete the source collection once every document is copied.
+    """
+    ret_config = load_config()[Constants.RETRIVER]
+    name = ret_config[Constants.COL_DOC]
+    client = chromadb.PersistentClient(path=path)
+    source = client.get_collection(name)
+    sharded = ShardedCollection(client, name, path, ret_config[Constants.SHARDS_PER_QUERY])
+
+    checkpoint_source = f"shard:{os.path.abspath(path)}:{name}"
+    offset = 0 if restart else load_checkpoint(checkpoint, checkpoint_source)
+    if offset:
+        logger.info(f"Resuming the migration of '{name}' after {offset} documents.")
+
+    started = time.perf_counter()
+    total = source.count()
+    try:
+        while offset < total:
+            page = source.get(include=["embeddings", "documents", "metadatas"],  # type: ignore
+                              limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            sharded.upsert(ids=page["ids"], embeddings=page["embeddings"],
+                           documents=page["documents"], metadatas=page["metadatas"])
+            offset += len(page["ids"])
+            save_checkpoint(checkpoint, checkpoint_source, offset)
+            logger.info(f"Migrated {offset} of {total} documents.")
+    finally:
+        # The centroids are saved on close, interrupted too.
+        sharded.close()
+
+    shards = {shard.name: shard.count() for shard in sharded.shards.values()}
+    migrated = sum(shards.values())
+    if drop and migrated >= total:
+        client.delete_collection(name)
+        logger.info(f"Dropped the source collection '{name}'.")
+    elif drop:
+        logger.warning(f"Kept '{name}', only {migrated} of its {total} documents are in the shards.")
+
+    report = {
+        "collection": name,
+        "documents": total,
+        "migrated": migrated,
+        "seconds": round(time.perf_counter() - started, 2),
+        "shards": dict(sorted(shards.items(), key=lambda item: item[1], reverse=True))
+    }
+    logger.info(f"Migration report: {report}")
+    print(json.dumps(report, indent=2))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default=None,
+                        help="The folder of the store, defaults to retriever.save_folder.")
+    parser.add_argument("--page-size", type=int, default=1000,
+                        help="Number of documents copied at a time.")
+    parser.add_argument("--checkpoint", default="shard_checkpoint.json",
+                        help="File recording the progress, to resume an interrupted run.")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore the checkpoint and start from the first document.")
+    parser.add_argument("--drop", action="store_true",
+                        help="Delete the source collection once every document is migrated.")
+    args = parser.parse_args()
+
+    path = args.path or load_config()[Constants.RETRIVER][Constants.SAVE_FOLDER]
+    migrate(path, args.page_size, args.checkpoint, args.restart, args.drop)
+
+
+if __name__ == "__main__":
+    main()
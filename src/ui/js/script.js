@@ -30,13 +30,17 @@ document.addEventListener("DOMContentLoaded", () => {
 
         console.log("Loader displayed");
 
-        fetch(`/ask?limit=${limit}`, {
+        fetch(`/ask/stream?limit=${limit}`, {
             method: "POST",
             headers: { "Content-Type": "application/json" },
             body: JSON.stringify({ query })
         })
-            .then(res => res.json())
-            .then(data => processResponse(data))
+            .then(res => {
+                if (!res.ok) {
+                    throw new Error(`Request failed with status: ${res.status}`);
+                }
+                return processStream(res.body.getReader());
+            })
             .catch(err => {
                 console.error(err)
                 window.alert("Error occurred in fetching details, please try again or file an issue!");
@@ -101,6 +105,10 @@ const processResponse = (jsonData) => {
     processCitations(citationsElement, citationsData);
 
     // Once processing is done, hide the loader and show the final result.
+    showResults(midTextElement, postTextElement, summaryElement);
+}
+
+const showResults = (midTextElement, postTextElement, summaryElement) => {
     midTextElement.classList.remove("not-hidden");
     midTextElement.classList.add("hidden");
 
@@ -117,6 +125,76 @@ const processResponse = (jsonData) => {
     });
 }
 
+const processStream = async (reader) => {
+    const decoder = new TextDecoder();
+    const midTextElement = document.getElementById("mid-text");
+    const postTextElement = document.getElementById("post-text");
+    const summaryElement = document.getElementById("summary");
+    const citationsElement = document.getElementById("citations");
+
+    let buffer = "";
+    let summaryData = "";
+    let citedIds = [];
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+
+        // Server-Sent Events frames are separated by a blank line.
+        let boundary = buffer.indexOf("\n\n");
+        while (boundary !== -1) {
+            const { event, data } = parseEvent(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+            boundary = buffer.indexOf("\n\n");
+
+            if (event === "abstracts") {
+                // Sources arrive first, show them while the summary is still being generated.
+                console.log("Abstracts received:", data);
+                citedIds = data.map(citation => citation["id"]);
+                summaryElement.textContent = "";
+                processCitations(citationsElement, data);
+                showResults(midTextElement, postTextElement, summaryElement);
+            } else if (event === "token") {
+                summaryData += data;
+                summaryElement.textContent = summaryData;
+            } else if (event === "done") {
+                // Link the citations only once the full summary is available.
+                processSummary(summaryElement, summaryData, citedIds);
+            } else if (event === "error") {
+                // The server gave up mid-stream, e.g. past the deadline: keep what was generated and say so.
+                console.error("Stream failed:", data);
+                if (citedIds.length === 0) {
+                    citationsElement.innerHTML = "";
+                }
+                processSummary(summaryElement, summaryData, citedIds);
+                const errorElement = document.createElement("p");
+                errorElement.textContent = `${data}, please try again.`;
+                summaryElement.appendChild(errorElement);
+                showResults(midTextElement, postTextElement, summaryElement);
+                return;
+            }
+        }
+    }
+}
+
+const parseEvent = (frame) => {
+    let event = "message";
+    let data = "";
+
+    frame.split("\n").forEach(line => {
+        if (line.startsWith("event: ")) {
+            event = line.slice("event: ".length);
+        } else if (line.startsWith("data: ")) {
+            data += line.slice("data: ".length);
+        }
+    });
+
+    return { event, data: JSON.parse(data) };
+}
+
 const processSummary = (summaryElement, summaryData, citedIds) => {
     console.log(citedIds);
 
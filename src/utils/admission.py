@@ -0,0 +1,379 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from utils.config import load_config
+from utils.constants import Constants
+from utils.logger import setup_logger
+from utils.metrics import QUEUE_DEPTH, QUEUE_WAIT_SECONDS, REJECTED_REQUESTS
+
+logger = setup_logger()
+
+T = TypeVar("T")
+
+# The header a client sets to bound the seconds it is willing to wait for the response.
+DEADLINE_HEADER = "X-Request-Timeout"
+
+
+class Overloaded(Exception):
+    """Raised when the wait queue is full, the request is rejected without waiting.
+    """
+
+    def __init__(self, retry_after: int) -> None:
+        super().__init__(f"Server overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class QueueTimeout(Exception):
+    """Raised when the deadline of the request passes while it is still waiting for a slot.
+    """
+
+    def __init__(self, retry_after: int) -> None:
+        super().__init__(f"Deadline exceeded waiting for a slot, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class ClientDisconnected(Exception):
+    """Raised when the client left before the response was ready, its work is cancelled.
+    """
+
+
+class AdmittedStream(Generic[T]):
+    """A stream holding its admission slot until it ends or is closed. The response may never
+    iterate it, when the client disconnects before the body starts, so the AdmittedResponse
+    sending it closes it once the response is over.
+    """
+
+    def __init__(self, controller: "AdmissionController", events: AsyncIterator[T], remaining: float,
+                 disconnected: Optional[Callable[[], Awaitable[Any]]] = None) -> None:
+        """
+        Args:
+            controller (AdmissionController): The admission control the slot was acquired from.
+            events (AsyncIterator[T]): The stream to relay.
+            remaining (float): The seconds left before the deadline.
+            disconnected (Optional[Callable[[], Awaitable[Any]]]): Creates an awaitable that
+            completes when the client disconnects.
+        """
+        self.controller = controller
+        self.start = time.perf_counter()
+        self.released = False
+        self.relay = controller.relay(events, remaining, disconnected)
+
+    def __aiter__(self) -> "AdmittedStream[T]":
+        return self
+
+    async def __anext__(self) -> T:
+        try:
+            return await self.relay.__anext__()
+        except BaseException:
+            # Ended, failed or cancelled, the relay has already closed the stream.
+            self.release()
+            raise
+
+    async def aclose(self) -> None:
+        try:
+            await self.relay.aclose()  # type: ignore[attr-defined]
+        finally:
+            self.release()
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.controller.release(time.perf_counter() - self.start)
+
+
+class AdmittedResponse(StreamingResponse):
+    """The streaming response of an admitted stream, closing the stream once the response is over
+    however it ends, so its slot is released even when the client disconnected before the body
+    started, which skips the background task of the response.
+    """
+
+    def __init__(self, content: AsyncIterator[Any], stream: AdmittedStream, **kwargs: Any) -> None:
+        """
+        Args:
+            content (AsyncIterator[Any]): The encoded body of the response, read from the stream.
+            stream (AdmittedStream): The admitted stream to close after the response.
+        """
+        super().__init__(content, **kwargs)
+        self.stream = stream
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.stream.aclose()
+
+
+class AdmissionController:
+    """Limits the number of requests processed at the same time, so that a burst queues in front of
+    the engine instead of piling up behind the LM. At most max_queue requests wait for a slot, the
+    others are rejected straight away with the time to retry after, estimated from the recent
+    service times.
+
+    It runs on the event loop, so its counters need no lock.
+    """
+
+    def __init__(self) -> None:
+        adm_config = load_config()[Constants.ADMISSION]
+        self.max_concurrent = adm_config[Constants.MAX_CONCURRENT]
+        self.max_queue = adm_config[Constants.MAX_QUEUE]
+        self.default_deadline = adm_config[Constants.DEADLINE_SECONDS]
+        self.max_deadline = adm_config[Constants.MAX_DEADLINE_SECONDS]
+
+        self.slots = asyncio.Semaphore(self.max_concurrent)
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.cancelled = 0
+        # The recent wait and service times in seconds, for the stats and the Retry-After estimate.
+        self.wait_times: "deque[float]" = deque(maxlen=256)
+        self.service_times: "deque[float]" = deque(maxlen=256)
+
+        logger.info(
+            f"Admission control with {self.max_concurrent} concurrent requests "
+            f"and {self.max_queue} waiting.")
+
+    def deadline(self, header: Optional[str]) -> float:
+        """The seconds the request may take, from its header if any, capped by max_deadline.
+
+        Args:
+            header (Optional[str]): The value of the X-Request-Timeout header, in seconds.
+
+        Returns:
+            float: The deadline of the request in seconds.
+        """
+        try:
+            seconds = float(header) if header else self.default_deadline
+        except ValueError:
+            seconds = self.default_deadline
+        if not math.isfinite(seconds) or seconds <= 0:
+            seconds = self.default_deadline
+        return min(seconds, self.max_deadline)
+
+    def retry_after(self) -> int:
+        """Estimate the seconds until a slot frees up for a new request, behind the ones waiting.
+
+        Returns:
+            int: The seconds to retry after, at least 1.
+        """
+        if not self.service_times:
+            return 1
+        service = sum(self.service_times) / len(self.service_times)
+        return max(1, math.ceil(service * (self.waiting + 1) / self.max_concurrent))
+
+    async def acquire(self, timeout: float) -> float:
+        """Wait for a slot, at most timeout seconds, rejecting outright when the queue is full.
+
+        Args:
+            timeout (float): The maximum seconds to wait for a slot.
+
+        Raises:
+            Overloaded: The wait queue is full.
+            QueueTimeout: No slot freed up within the timeout.
+
+        Returns:
+            float: The seconds waited for the slot.
+        """
+        # Counted on the requests not yet holding their slot, as acquiring it happens later on the loop.
+        if self.active + self.waiting >= self.max_concurrent + self.max_queue:
+            self.rejected += 1
+            REJECTED_REQUESTS.inc(reason="overloaded")
+            logger.warning(
+                f"Rejected request, {self.active} in flight and {self.waiting} waiting.")
+            raise Overloaded(self.retry_after())
+
+        start = time.perf_counter()
+        self.waiting += 1
+        QUEUE_DEPTH.inc(state="waiting")
+        try:
+            await asyncio.wait_for(self.slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            REJECTED_REQUESTS.inc(reason="queue_timeout")
+            logger.warning(f"Request timed out after waiting {timeout:.1f}s for a slot.")
+            raise QueueTimeout(self.retry_after())
+        finally:
+            self.waiting -= 1
+            QUEUE_DEPTH.dec(state="waiting")
+
+        waited = time.perf_counter() - start
+        self.wait_times.append(waited)
+        QUEUE_WAIT_SECONDS.observe(waited)
+        self.active += 1
+        QUEUE_DEPTH.inc(state="active")
+        self.admitted += 1
+        return waited
+
+    def release(self, service_seconds: float) -> None:
+        self.active -= 1
+        QUEUE_DEPTH.dec(state="active")
+        self.service_times.append(service_seconds)
+        self.slots.release()
+
+    @asynccontextmanager
+    async def admit(self, timeout: float) -> AsyncIterator[float]:
+        """Hold a slot over the block.
+
+        Args:
+            timeout (float): The maximum seconds to wait for a slot.
+
+        Yields:
+            AsyncIterator[float]: The seconds waited for the slot.
+        """
+        waited = await self.acquire(timeout)
+        start = time.perf_counter()
+        try:
+            yield waited
+        finally:
+            self.release(time.perf_counter() - start)
+
+    async def run(self, work: Callable[[], Awaitable[T]], deadline: float,
+                  disconnected: Optional[Callable[[], Awaitable[Any]]] = None) -> Tuple[T, float]:
+        """Run the work in a slot within the deadline, cancelling it if the deadline passes or
+        the client disconnects first. The deadline covers the wait for the slot too.
+
+        Args:
+            work (Callable[[], Awaitable[T]]): Creates the awaitable to run once admitted.
+            deadline (float): The seconds the request may take in total.
+            disconnected (Optional[Callable[[], Awaitable[Any]]]): Creates an awaitable that
+            completes when the client disconnects.
+
+        Raises:
+            Overloaded: The wait queue is full.
+            QueueTimeout: The deadline passed while waiting for a slot.
+            asyncio.TimeoutError: The deadline passed while processing.
+            ClientDisconnected: The client left before the work completed.
+
+        Returns:
+            Tuple[T, float]: The result of the work, and the seconds waited for the slot.
+        """
+        async with self.admit(deadline) as waited:
+            task = asyncio.ensure_future(asyncio.wait_for(work(), deadline - waited))
+            if disconnected is None:
+                return await task, waited
+
+            watcher = asyncio.ensure_future(disconnected())
+            try:
+                await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                # Also reached when the handler itself is cancelled.
+                for pending in (task, watcher):
+                    if not pending.done():
+                        pending.cancel()
+
+            if not task.done() or task.cancelled():
+                self.cancelled += 1
+                REJECTED_REQUESTS.inc(reason="disconnected")
+                logger.info("Client disconnected, cancelled its request.")
+                raise ClientDisconnected()
+            return task.result(), waited
+
+    async def run_stream(self, events: Callable[[], AsyncIterator[T]], deadline: float,
+                         disconnected: Optional[Callable[[], Awaitable[Any]]] = None
+                         ) -> Tuple[AdmittedStream[T], float]:
+        """Wait for a slot for the stream, so that a rejection is raised before the response starts.
+        The slot is held until the stream ends or is closed, the stream is cancelled if the deadline
+        passes or the client disconnects first.
+
+        Args:
+            events (Callable[[], AsyncIterator[T]]): Creates the stream to run once admitted.
+            deadline (float): The seconds the request may take in total.
+            disconnected (Optional[Callable[[], Awaitable[Any]]]): Creates an awaitable that
+            completes when the client disconnects.
+
+        Raises:
+            Overloaded: The wait queue is full.
+            QueueTimeout: The deadline passed while waiting for a slot.
+
+        Returns:
+            Tuple[AdmittedStream[T], float]: The admitted stream, raising asyncio.TimeoutError when
+            the deadline passes and ClientDisconnected when the client leaves, and the seconds
+            waited for the slot.
+        """
+        waited = await self.acquire(deadline)
+        return AdmittedStream(self, events(), deadline - waited, disconnected), waited
+
+    async def relay(self, events: AsyncIterator[T], remaining: float,
+                    disconnected: Optional[Callable[[], Awaitable[Any]]] = None) -> AsyncIterator[T]:
+        """Relay the stream within the remaining deadline, until the client disconnects.
+
+        The stream is drained by a single task of its own rather than a task per item, so that the
+        context it sets, such as its current span, carries over from one item to the next.
+        """
+        start = time.perf_counter()
+        end = object()
+        items: "asyncio.Queue[Tuple[Any, Optional[BaseException]]]" = asyncio.Queue(maxsize=1)
+
+        async def drain() -> None:
+            try:
+                async for item in events:
+                    await items.put((item, None))
+                await items.put((end, None))
+            except Exception as e:
+                await items.put((end, e))
+            finally:
+                await events.aclose()  # type: ignore[attr-defined]
+
+        drainer = asyncio.ensure_future(drain())
+        watcher = asyncio.ensure_future(disconnected()) if disconnected is not None else None
+        tasks: List["asyncio.Future[Any]"] = [drainer] + ([watcher] if watcher is not None else [])
+        try:
+            while True:
+                left = max(remaining - (time.perf_counter() - start), 0)
+                get = asyncio.ensure_future(items.get())
+                tasks.append(get)
+                done, _ = await asyncio.wait(
+                    [get] + ([watcher] if watcher is not None else []),
+                    timeout=left, return_when=asyncio.FIRST_COMPLETED)
+                tasks.remove(get)
+                if get not in done:
+                    get.cancel()
+                    if watcher in done:
+                        self.cancelled += 1
+                        REJECTED_REQUESTS.inc(reason="disconnected")
+                        logger.info("Client disconnected, cancelled its stream.")
+                        raise ClientDisconnected()
+                    raise asyncio.TimeoutError()
+
+                item, error = get.result()
+                if error is not None:
+                    raise error
+                if item is end:
+                    return
+                yield item
+        finally:
+            # Runs when the response cancels or closes the stream too, cancelling its work.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """The current load and the recent wait and service times.
+
+        Returns:
+            Dict[str, Any]: The limits, the requests in flight and waiting, the counts of admitted,
+            rejected, timed out and cancelled requests, and the average and max wait in ms.
+        """
+        waits = list(self.wait_times)
+        services = list(self.service_times)
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "cancelled": self.cancelled,
+            "avg_wait_ms": round(sum(waits) / len(waits) * 1000, 2) if waits else 0.0,
+            "max_wait_ms": round(max(waits) * 1000, 2) if waits else 0.0,
+            "avg_service_ms": round(sum(services) / len(services) * 1000, 2) if services else 0.0,
+        }
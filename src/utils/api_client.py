@@ -1,13 +1,18 @@
+import asyncio
 import xml.etree.ElementTree as ET
-from typing import List, cast
+from typing import AsyncIterator, Iterator, List, Optional
 
+import httpx
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
 from dto.response import Abstract
+from utils.arxiv_cache import get_arxiv_cache
+from utils.atom_parser import aiter_abstracts, iter_abstracts
 from utils.config import load_config
 from utils.constants import Constants
+from utils.executors import get_retrieval_executor, run_in_executor
 from utils.logger import setup_logger
 from utils.timer import timeit
 
@@ -16,117 +21,185 @@ config = load_config()
 
 # Unpack the constants needed for this module.
 ARXIV_API_URL = config[Constants.ARXIV][Constants.URL]
-MAX_ARXIV_RESULTS = config[Constants.ARXIV][Constants.URL]
+MAX_ARXIV_RESULTS = config[Constants.ARXIV][Constants.MAX_RESULTS]
+POOL_SIZE = config[Constants.ARXIV][Constants.POOL_SIZE]
+RETRY_STATUSES = [502, 503, 504]
+CHUNK_SIZE = 16 * 1024
 
+# Pooled clients shared across requests, so that connections are kept alive between calls.
+SESSION: Optional[requests.Session] = None
+ASYNC_CLIENT: Optional[httpx.AsyncClient] = None
 
-@timeit
-def fetch_metadata(query: str, max_results: int = MAX_ARXIV_RESULTS) -> List[Abstract]:
-    """Query the arXiv API with `query` and return a list of metadata dicts.
-    Each dict contains: id, title, abstract, authors, published, categories.
+
+def get_session() -> requests.Session:
+    """Returns the shared session, with a keep-alive connection pool and retries for both
+    http and https.
+
+    Returns:
+        requests.Session: The pooled session.
+    """
+    global SESSION
+    if SESSION is None:
+        retries = Retry(total=3, backoff_factor=1,
+                        status_forcelist=RETRY_STATUSES)
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE,
+                              pool_maxsize=POOL_SIZE, max_retries=retries)
+        SESSION = requests.Session()
+        SESSION.mount("http://", adapter)
+        SESSION.mount("https://", adapter)
+
+    return SESSION
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Returns the shared async client, with a keep-alive connection pool of the same size.
+
+    Returns:
+        httpx.AsyncClient: The pooled async client.
+    """
+    global ASYNC_CLIENT
+    if ASYNC_CLIENT is None:
+        limits = httpx.Limits(max_connections=POOL_SIZE,
+                              max_keepalive_connections=POOL_SIZE)
+        # Connection errors are retried by the transport, server errors by the caller.
+        transport = httpx.AsyncHTTPTransport(retries=3, limits=limits)
+        ASYNC_CLIENT = httpx.AsyncClient(transport=transport, timeout=20)
+
+    return ASYNC_CLIENT
+
+
+async def close_clients() -> None:
+    """Close the pooled clients and their connections.
+    """
+    global SESSION, ASYNC_CLIENT
+    if SESSION is not None:
+        SESSION.close()
+    if ASYNC_CLIENT is not None:
+        await ASYNC_CLIENT.aclose()
+
+    SESSION, ASYNC_CLIENT = None, None
+
+
+def stream_metadata(query: str, max_results: int = MAX_ARXIV_RESULTS, start: int = 0) -> Iterator[Abstract]:
+    """Query the arXiv API and yield each paper's metadata as soon as its entry has been received
+    and parsed, without holding the whole response body in memory.
 
     Args:
         query (str): The query to fetch the results for.
         max_results (int, optional): The maximum number of results needed for the query. Defaults to MAX_ARXIV_RESULTS.
+        start (int, optional): The offset of the first result, for paging. Defaults to 0.
 
-    Returns:
-        List[Abstract]: The list of relevant papers' metadata returned by ArXiv
+    Yields:
+        Iterator[Abstract]: The relevant papers' metadata, in the order returned by ArXiv.
     """
-    # Build the request URL and parameters
     params = {
         "search_query": query,
-        "start": 0,
+        "start": start,
         "max_results": max_results
     }
 
-    try:
-        session = requests.Session()
-        retries = Retry(total=3, backoff_factor=1,
-                        status_forcelist=[502, 503, 504])
-        session.mount("http://", HTTPAdapter(max_retries=retries))
-
-        response = session.get(ARXIV_API_URL, params=params, timeout=20)
+    with get_session().get(ARXIV_API_URL, params=params, timeout=20, stream=True) as response:
         response.raise_for_status()
+        yield from iter_abstracts(response.iter_content(chunk_size=CHUNK_SIZE))
+
+
+async def stream_metadata_async(query: str, max_results: int = MAX_ARXIV_RESULTS,
+                                start: int = 0) -> AsyncIterator[Abstract]:
+    """Async counterpart of stream_metadata.
+
+    Args:
+        query (str): The query to fetch the results for.
+        max_results (int, optional): The maximum number of results needed for the query. Defaults to MAX_ARXIV_RESULTS.
+        start (int, optional): The offset of the first result, for paging. Defaults to 0.
+
+    Yields:
+        AsyncIterator[Abstract]: The relevant papers' metadata, in the order returned by ArXiv.
+    """
+    params = {
+        "search_query": query,
+        "start": start,
+        "max_results": max_results
+    }
 
-        logger.info(f"Response body size: {len(response.text)}")
+    client = get_async_client()
+    for attempt in range(4):
+        async with client.stream("GET", ARXIV_API_URL, params=params) as response:
+            if response.status_code not in RETRY_STATUSES or attempt == 3:
+                response.raise_for_status()
+                async for abstract in aiter_abstracts(response.aiter_bytes(CHUNK_SIZE)):
+                    yield abstract
+                return
+
+        await asyncio.sleep(2 ** attempt)
+
+
+@timeit
+def fetch_metadata(query: str, max_results: int = MAX_ARXIV_RESULTS, start: int = 0) -> List[Abstract]:
+    """Query the arXiv API with `query` and return a list of metadata dicts.
+    Each dict contains: id, title, abstract, authors, published, categories.
+
+    Args:
+        query (str): The query to fetch the results for.
+        max_results (int, optional): The maximum number of results needed for the query. Defaults to MAX_ARXIV_RESULTS.
+        start (int, optional): The offset of the first result, for paging. Defaults to 0.
+
+    Returns:
+        List[Abstract]: The list of relevant papers' metadata returned by ArXiv
+    """
+    cache = get_arxiv_cache()
+    if cache is not None and (papers := cache.get(query, start, max_results)) is not None:
+        logger.info(f"Fetched {len(papers)} cached papers for query='{query}'.")
+        return papers
+
+    try:
+        papers = list(stream_metadata(
+            query=query, max_results=max_results, start=start))
+    except ET.ParseError as e:
+        logger.error(f"Failed to parse arXiv XML: {e}")
+        return []
     except Exception as e:
         logger.error(f"Error fetching arXiv data for query='{query}': {e}")
         return []
 
-    # Parse the XML response
+    if cache is not None and papers:
+        cache.put(query, start, max_results, papers)
+
+    logger.info(
+        f"Fetched {len(papers)} papers for query='{query}'.")
+    return papers
+
+
+@timeit
+async def fetch_metadata_async(query: str, max_results: int = MAX_ARXIV_RESULTS, start: int = 0) -> List[Abstract]:
+    """Async counterpart of fetch_metadata, awaits the ArXiv API without holding a thread.
+
+    Args:
+        query (str): The query to fetch the results for.
+        max_results (int, optional): The maximum number of results needed for the query. Defaults to MAX_ARXIV_RESULTS.
+        start (int, optional): The offset of the first result, for paging. Defaults to 0.
+
+    Returns:
+        List[Abstract]: The list of relevant papers' metadata returned by ArXiv
+    """
+    # The cache is a sqlite file, read and written off the event loop.
+    cache = get_arxiv_cache()
+    if cache is not None and (papers := await run_in_executor(
+            get_retrieval_executor(), cache.get, query, start, max_results)) is not None:
+        logger.info(f"Fetched {len(papers)} cached papers for query='{query}'.")
+        return papers
+
     try:
-        root = ET.fromstring(response.text)
+        papers = [abstract async for abstract in stream_metadata_async(
+            query=query, max_results=max_results, start=start)]
     except ET.ParseError as e:
         logger.error(f"Failed to parse arXiv XML: {e}")
         return []
+    except Exception as e:
+        logger.error(f"Error fetching arXiv data for query='{query}': {e}")
+        return []
 
-    ns = {"atom": "http://www.w3.org/2005/Atom"}
-
-    papers = []
-    for entry in root.findall("atom:entry", ns):
-        try:
-            arxiv_id_node = entry.find("atom:id", ns)
-            title_node = entry.find("atom:title", ns)
-            summary_node = entry.find("atom:summary", ns)
-            published_node = entry.find("atom:published", ns)
-            pdf_url = None
-
-            for link in entry.findall("atom:link", ns):
-                if link.attrib.get("type") == "application/pdf":
-                    pdf_url = link.attrib.get("href")
-                    break
-
-            if title_node is not None and summary_node is not None and published_node is not None:
-                # Parse the title node
-                title = cast(str, title_node.text).strip().replace("\n", " ")
-
-                # Parse a better ID than the one returned by ArXiv
-                words = title.split()
-                upper_words = [
-                    word for word in words if word and word[0].isupper()]
-                my_id = ''.join(word[0] for word in upper_words[:2]) if len(
-                        upper_words) >= 2 else title[:2].upper()
-
-                # Get the abstract and other data
-                abstract = cast(
-                    str, summary_node.text).strip().replace("\n", " ")
-                published = cast(str, published_node.text)
-
-                arxiv_id = cast(str, arxiv_id_node.text).strip(
-                ) if arxiv_id_node is not None else ""
-                arxiv_id = arxiv_id.split("/")[-1]
-
-                # Authors
-                authors = [
-                    name_tag.text
-                    for author in entry.findall("atom:author", ns)
-                    if (name_tag := author.find("atom:name", ns)) is not None and name_tag.text
-                ]
-
-                # Categories
-                categories = [
-                    cat.attrib.get("term", "")
-                    for cat in entry.findall("atom:category", ns)
-                ]
-
-                papers.append(Abstract(
-                    id=my_id,
-                    arxiv_id=arxiv_id,
-                    title=title,
-                    abstract=abstract,
-                    authors=", ".join(authors),
-                    year=published[:4],
-                    categories=", ".join(categories),
-                    pdf_url=pdf_url or ""
-                ))
-            else:
-                logger.warning(
-                    "Error in parsing, some of the nodes are empty!")
-                logger.warning(
-                    f"{title_node} : {summary_node} : {published_node}")
-        except Exception as parse_err:
-            logger.warning(
-                f"Skipped an entry due to parsing error: {parse_err}")
-            continue
+    if cache is not None and papers:
+        await run_in_executor(get_retrieval_executor(), cache.put, query, start, max_results, papers)
 
     logger.info(
         f"Fetched {len(papers)} papers for query='{query}'.")
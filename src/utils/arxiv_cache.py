@@ -0,0 +1,102 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from dto.response import Abstract
+from utils.config import load_config
+from utils.constants import Constants
+from utils.logger import setup_logger
+
+logger = setup_logger()
+config = load_config()
+
+ARXIV_CACHE = None
+
+
+class ArxivCache:
+    """On-disk cache of the parsed ArXiv API responses, keyed by the parameters of the request,
+    so that repeated remote lookups neither wait on nor count against the ArXiv API.
+    """
+
+    def __init__(self, path: str, ttl: float) -> None:
+        """The constructor to open (or create) the cache database.
+
+        Args:
+            path (str): The path of the sqlite database file.
+            ttl (float): The number of seconds an entry is considered fresh.
+        """
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS arxiv_cache ("
+            "search_query TEXT NOT NULL, start INTEGER NOT NULL, max_results INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, payload TEXT NOT NULL, "
+            "PRIMARY KEY (search_query, start, max_results))"
+        )
+        self.connection.commit()
+
+    def get(self, search_query: str, start: int, max_results: int) -> Optional[List[Abstract]]:
+        """Look up a fresh entry for the request.
+
+        Args:
+            search_query (str): The search_query parameter of the request.
+            start (int): The start parameter of the request.
+            max_results (int): The max_results parameter of the request.
+
+        Returns:
+            Optional[List[Abstract]]: The cached abstracts, None on a miss or an expired entry.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT created_at, payload FROM arxiv_cache "
+                "WHERE search_query = ? AND start = ? AND max_results = ?",
+                (search_query, start, max_results)
+            ).fetchone()
+
+        if row is None or time.time() - row[0] > self.ttl:
+            return None
+
+        return [Abstract(**item) for item in json.loads(row[1])]
+
+    def put(self, search_query: str, start: int, max_results: int, abstracts: List[Abstract]) -> None:
+        """Store the parsed abstracts of a request, replacing any previous entry.
+
+        Args:
+            search_query (str): The search_query parameter of the request.
+            start (int): The start parameter of the request.
+            max_results (int): The max_results parameter of the request.
+            abstracts (List[Abstract]): The abstracts parsed from the response.
+        """
+        payload = json.dumps([abstract.model_dump() for abstract in abstracts])
+
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO arxiv_cache VALUES (?, ?, ?, ?, ?)",
+                (search_query, start, max_results, time.time(), payload)
+            )
+            # Expired entries are purged on write, to keep the file bounded.
+            self.connection.execute(
+                "DELETE FROM arxiv_cache WHERE created_at < ?", (time.time() - self.ttl,))
+            self.connection.commit()
+
+
+def get_arxiv_cache() -> Optional[ArxivCache]:
+    """Returns the shared ArXiv response cache.
+
+    Returns:
+        Optional[ArxivCache]: The cache, None if it is disabled in the configuration.
+    """
+    global ARXIV_CACHE
+    arxiv_config = config[Constants.ARXIV]
+    if ARXIV_CACHE is None and arxiv_config[Constants.CACHE]:
+        ARXIV_CACHE = ArxivCache(
+            path=arxiv_config[Constants.CACHE_PATH],
+            ttl=arxiv_config[Constants.CACHE_TTL]
+        )
+        logger.info(
+            f"Opened ArXiv response cache at {arxiv_config[Constants.CACHE_PATH]}.")
+
+    return ARXIV_CACHE
@@ -0,0 +1,210 @@
+import time
+import xml.etree.ElementTree as ET
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, List, Optional
+
+from dto.response import Abstract
+from utils.logger import setup_logger
+from utils.tracing import span
+
+logger = setup_logger()
+
+# Fully qualified tags, compared directly instead of resolving a namespace map per lookup.
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+ENTRY = f"{ATOM_NS}entry"
+ID = f"{ATOM_NS}id"
+TITLE = f"{ATOM_NS}title"
+SUMMARY = f"{ATOM_NS}summary"
+PUBLISHED = f"{ATOM_NS}published"
+LINK = f"{ATOM_NS}link"
+AUTHOR = f"{ATOM_NS}author"
+NAME = f"{ATOM_NS}name"
+CATEGORY = f"{ATOM_NS}category"
+
+
+def make_id(title: str) -> str:
+    """Build a short citation id from the title, better suited to the summary than the ArXiv id.
+
+    Args:
+        title (str): The title of the paper.
+
+    Returns:
+        str: The initials of the first two capitalised words, or the first two letters of the title.
+    """
+    upper_words = [word for word in title.split() if word and word[0].isupper()]
+    return ''.join(word[0] for word in upper_words[:2]) if len(
+        upper_words) >= 2 else title[:2].upper()
+
+
+def parse_entry(entry: ET.Element) -> Optional[Abstract]:
+    """Parse a single Atom entry in one pass over its children.
+
+    Args:
+        entry (ET.Element): The completed entry element.
+
+    Returns:
+        Optional[Abstract]: The paper's metadata, None if the required nodes are missing.
+    """
+    arxiv_id, title, summary, published, pdf_url = "", None, None, None, ""
+    authors, categories = [], []
+
+    for child in entry:
+        tag = child.tag
+        if tag == ID:
+            arxiv_id = (child.text or "").strip().split("/")[-1]
+        elif tag == TITLE:
+            title = child.text
+        elif tag == SUMMARY:
+            summary = child.text
+        elif tag == PUBLISHED:
+            published = child.text
+        elif tag == LINK:
+            if not pdf_url and child.get("type") == "application/pdf":
+                pdf_url = child.get("href", "")
+        elif tag == AUTHOR:
+            name = child.find(NAME)
+            if name is not None and name.text:
+                authors.append(name.text)
+        elif tag == CATEGORY:
+            categories.append(child.get("term", ""))
+
+    if title is None or summary is None or published is None:
+        logger.warning("Error in parsing, some of the nodes are empty!")
+        logger.warning(f"{title} : {summary} : {published}")
+        return None
+
+    title = title.strip().replace("\n", " ")
+
+    return Abstract(
+        id=make_id(title),
+        arxiv_id=arxiv_id,
+        title=title,
+        abstract=summary.strip().replace("\n", " "),
+        authors=", ".join(authors),
+        year=published[:4],
+        categories=", ".join(categories),
+        pdf_url=pdf_url
+    )
+
+
+class AtomStreamParser:
+    """Incremental parser of the ArXiv Atom feed, fed with the response body as it arrives and
+    yielding each abstract as soon as its entry is complete. Completed entries are dropped from
+    the tree so the memory held does not grow with the size of the feed.
+    """
+
+    def __init__(self) -> None:
+        self.parser = ET.XMLPullParser(events=("start", "end"))
+        self.root: Optional[ET.Element] = None
+        # The time spent parsing, excluding the waits for the body between the chunks.
+        self.parse_seconds = 0.0
+        self.entries = 0
+
+    def feed(self, chunk: bytes) -> Iterator[Abstract]:
+        """Feed the next chunk of the response body.
+
+        Args:
+            chunk (bytes): The next chunk of the body.
+
+        Yields:
+            Iterator[Abstract]: The abstracts of the entries completed by this chunk.
+        """
+        start = time.perf_counter()
+        self.parser.feed(chunk)
+        self.parse_seconds += time.perf_counter() - start
+        yield from self.read_entries()
+
+    def close(self) -> Iterator[Abstract]:
+        """Signal the end of the body, raises ET.ParseError if the feed is incomplete.
+
+        Yields:
+            Iterator[Abstract]: The abstracts of the entries completed by the remaining data.
+        """
+        start = time.perf_counter()
+        self.parser.close()
+        self.parse_seconds += time.perf_counter() - start
+        yield from self.read_entries()
+
+    def read_entries(self) -> Iterator[Abstract]:
+        start = time.perf_counter()
+        for event, elem in self.parser.read_events():
+            if event == "start":
+                if self.root is None:
+                    self.root = elem
+                continue
+
+            if elem.tag != ENTRY:
+                continue
+
+            try:
+                abstract = parse_entry(elem)
+            except Exception as parse_err:
+                logger.warning(
+                    f"Skipped an entry due to parsing error: {parse_err}")
+                abstract = None
+
+            if self.root is not None:
+                self.root.remove(elem)
+
+            if abstract is not None:
+                self.entries += 1
+                self.parse_seconds += time.perf_counter() - start
+                yield abstract
+                start = time.perf_counter()
+
+        self.parse_seconds += time.perf_counter() - start
+
+
+def iter_abstracts(chunks: Iterable[bytes]) -> Iterator[Abstract]:
+    """Parse the feed from an iterable of body chunks, yielding the abstracts as entries complete.
+
+    Args:
+        chunks (Iterable[bytes]): The chunks of the response body.
+
+    Yields:
+        Iterator[Abstract]: The parsed abstracts, in feed order.
+    """
+    parser = AtomStreamParser()
+    with span("arxiv.parse") as parse_span:
+        for chunk in chunks:
+            yield from parser.feed(chunk)
+        yield from parser.close()
+        if parse_span is not None:
+            parse_span.set_attribute("entries", parser.entries)
+            parse_span.set_attribute("parse_seconds", round(parser.parse_seconds, 6))
+
+
+async def aiter_abstracts(chunks: AsyncIterable[bytes]) -> AsyncIterator[Abstract]:
+    """Async counterpart of iter_abstracts.
+
+    Args:
+        chunks (AsyncIterable[bytes]): The chunks of the response body.
+
+    Yields:
+        AsyncIterator[Abstract]: The parsed abstracts, in feed order.
+    """
+    parser = AtomStreamParser()
+    with span("arxiv.parse") as parse_span:
+        async for chunk in chunks:
+            for abstract in parser.feed(chunk):
+                yield abstract
+        for abstract in parser.close():
+            yield abstract
+        if parse_span is not None:
+            parse_span.set_attribute("entries", parser.entries)
+            parse_span.set_attribute("parse_seconds", round(parser.parse_seconds, 6))
+
+
+def parse_feed(text: str) -> List[Abstract]:
+    """Parse a complete Atom feed into the list of abstracts.
+
+    Args:
+        text (str): The XML body of the ArXiv API response.
+
+    Returns:
+        List[Abstract]: The papers' metadata parsed from the entries of the feed.
+    """
+    try:
+        return list(iter_abstracts([text.encode("utf-8")]))
+    except ET.ParseError as e:
+        logger.error(f"Failed to parse arXiv XML: {e}")
+        return []
@@ -16,3 +16,66 @@ class Constants(str, Enum):
     COL_DOC = "collection_docs"
     HF_KEY = "hf-key"
     THRESHOLD = "threshold"
+    WORKERS = "workers"
+    BATCH_SIZE = "batch_size"
+    BATCH_WAIT_MS = "batch_wait_ms"
+    CACHE = "cache"
+    ENABLED = "enabled"
+    MAX_ENTRIES = "max_entries"
+    TTL_SECONDS = "ttl_seconds"
+    SEMANTIC = "semantic"
+    SEMANTIC_DISTANCE = "semantic_distance"
+    POOL_SIZE = "pool_size"
+    CACHE_PATH = "cache_path"
+    CACHE_TTL = "cache_ttl"
+    SAVE_QUEUE = "save_queue"
+    SAVE_BATCH = "save_batch"
+    SAVE_POLICY = "save_policy"
+    LEXICAL = "lexical"
+    RRF_K = "rrf_k"
+    LEXICAL_MIN_MATCH = "lexical_min_match"
+    SPECULATIVE = "speculative"
+    SHARDED = "sharded"
+    SHARDS_PER_QUERY = "shards_per_query"
+    SHARD_WORKERS = "shard_workers"
+    IVF_LISTS = "ivf_lists"
+    IVF_PROBES = "ivf_probes"
+    PROMPT_BUDGET = "prompt_budget"
+    MIN_SOURCE_TOKENS = "min_source_tokens"
+    PREFIX_CACHE = "prefix_cache"
+    DTYPE = "dtype"
+    QUANTIZE = "quantize"
+    COMPILE = "compile"
+    INFERENCE = "inference"
+    REPLICAS = "replicas"
+    HEALTH_INTERVAL = "health_interval"
+    HEALTH_TIMEOUT = "health_timeout"
+    GENERATION_TIMEOUT = "generation_timeout"
+    SERVER_URL = "server_url"
+    SERVER_WAIT = "server_wait"
+    WARMUP_TOKENS = "warmup_tokens"
+    MOCK_TOKEN_MS = "mock_token_ms"
+    DRAFT = "draft"
+    DRAFT_TOKENS = "draft_tokens"
+    OUTPUT_TOKENS_BASE = "output_tokens_base"
+    OUTPUT_TOKENS_PER_SOURCE = "output_tokens_per_source"
+    MAX_TEMPERATURE = "max_temperature"
+    MAX_STOP_SEQUENCES = "max_stop_sequences"
+    EMBEDDINGS = "embeddings"
+    BACKEND = "backend"
+    MODEL = "model"
+    RUNTIME = "runtime"
+    ONNX_FILE = "onnx_file"
+    DEVICE = "device"
+    THREADS = "threads"
+    CACHE_SIZE = "cache_size"
+    ADMISSION = "admission"
+    MAX_CONCURRENT = "max_concurrent"
+    MAX_QUEUE = "max_queue"
+    DEADLINE_SECONDS = "deadline_seconds"
+    MAX_DEADLINE_SECONDS = "max_deadline_seconds"
+    MAX_BATCH_QUERIES = "max_batch_queries"
+    TRACING = "tracing"
+    PATH = "path"
+    COLLECTOR_URL = "collector_url"
+    SERVER_TIMING = "server_timing"
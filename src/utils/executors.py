@@ -0,0 +1,114 @@
+import asyncio
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional, TypeVar
+
+from utils.config import load_config
+from utils.constants import Constants
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+T = TypeVar("T")
+
+RETRIEVAL_EXECUTOR: Optional[ThreadPoolExecutor] = None
+INFERENCE_EXECUTOR: Optional[ThreadPoolExecutor] = None
+SHARD_EXECUTOR: Optional[ThreadPoolExecutor] = None
+
+
+def get_retrieval_executor() -> ThreadPoolExecutor:
+    """Bounded executor for the blocking vector store calls, so that they do not compete with
+    the request handling threadpool.
+
+    Returns:
+        ThreadPoolExecutor: The shared retrieval executor.
+    """
+    global RETRIEVAL_EXECUTOR
+    if RETRIEVAL_EXECUTOR is None:
+        workers = load_config()[Constants.RETRIVER][Constants.WORKERS]
+        RETRIEVAL_EXECUTOR = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="retrieval")
+        logger.info(f"Created retrieval executor with {workers} workers.")
+
+    return RETRIEVAL_EXECUTOR
+
+
+def get_shard_executor() -> ThreadPoolExecutor:
+    """Executor fanning a query out to the shards of the vector store, separate from the retrieval
+    executor whose threads wait on it.
+
+    Returns:
+        ThreadPoolExecutor: The shared shard executor.
+    """
+    global SHARD_EXECUTOR
+    if SHARD_EXECUTOR is None:
+        workers = load_config()[Constants.RETRIVER][Constants.SHARD_WORKERS]
+        SHARD_EXECUTOR = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="shard")
+        logger.info(f"Created shard executor with {workers} workers.")
+
+    return SHARD_EXECUTOR
+
+
+def get_inference_executor() -> ThreadPoolExecutor:
+    """Dedicated executor for the LM generation, sized independently as generation is memory
+    and compute bound.
+
+    Returns:
+        ThreadPoolExecutor: The shared inference executor.
+    """
+    global INFERENCE_EXECUTOR
+    if INFERENCE_EXECUTOR is None:
+        gen_config = load_config()[Constants.GENERATOR]
+        workers = gen_config[Constants.WORKERS]
+        if gen_config[Constants.INFERENCE] != "local":
+            # The threads only wait on the worker processes, one per batch in flight.
+            workers = max(workers, gen_config[Constants.REPLICAS])
+        INFERENCE_EXECUTOR = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="inference")
+        logger.info(f"Created inference executor with {workers} workers.")
+
+    return INFERENCE_EXECUTOR
+
+
+async def run_in_executor(executor: ThreadPoolExecutor, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking function on the given executor without blocking the event loop. The
+    current context is copied, so the request id is kept in the logs of the worker thread.
+
+    Args:
+        executor (ThreadPoolExecutor): The executor to run the function on.
+        func (Callable[..., T]): The blocking function to run.
+
+    Returns:
+        T: The value returned by the function.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(executor, partial(ctx.run, func, *args, **kwargs))
+
+
+def submit_in_context(executor: ThreadPoolExecutor, func: Callable[..., T], *args: Any, **kwargs: Any) -> "Future[T]":
+    """Submit a blocking function to the executor from a thread, with a copy of the current
+    context as run_in_executor does, so the request id and current span follow it.
+
+    Args:
+        executor (ThreadPoolExecutor): The executor to run the function on.
+        func (Callable[..., T]): The blocking function to run.
+
+    Returns:
+        Future[T]: The future of the value returned by the function.
+    """
+    ctx = contextvars.copy_context()
+    return executor.submit(ctx.run, func, *args, **kwargs)
+
+
+def shutdown_executors() -> None:
+    """Shutdown the shared executors, waiting for the running tasks to complete.
+    """
+    global RETRIEVAL_EXECUTOR, INFERENCE_EXECUTOR, SHARD_EXECUTOR
+    for executor in (RETRIEVAL_EXECUTOR, INFERENCE_EXECUTOR, SHARD_EXECUTOR):
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    RETRIEVAL_EXECUTOR, INFERENCE_EXECUTOR, SHARD_EXECUTOR = None, None, None
@@ -0,0 +1,224 @@
+"""Process wide metrics, rendered in the Prometheus text exposition format by the /metrics endpoint.
+Every sample is labeled with the configured retriever mode and lm key.
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from utils.config import load_config
+from utils.constants import Constants
+
+PREFIX = "simplicity_"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                   30.0, 60.0, 120.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+RATIO_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """A named family of samples, one per combination of its label values.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, Sequence[str], LabelValues, float]]:
+        """The samples to render, as suffixed name, label names, label values and value.
+        """
+        raise NotImplementedError
+
+    def render(self, const_names: Sequence[str], const_values: Sequence[str]) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labelnames, labelvalues, value in self.samples():
+            labels = format_labels(tuple(const_names) + tuple(labelnames),
+                                   tuple(const_values) + tuple(labelvalues))
+            lines.append(f"{name}{labels} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[Tuple[str, Sequence[str], LabelValues, float]]:
+        with self.lock:
+            return [(self.name + "_total", self.labelnames, key, value)
+                    for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels: str) -> None:
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Compute the value of the unlabeled gauge when scraped, rather than on every change.
+
+        Args:
+            function (Callable[[], float]): Returns the current value.
+        """
+        self.function = function
+
+    def samples(self) -> List[Tuple[str, Sequence[str], LabelValues, float]]:
+        if self.function is not None:
+            try:
+                return [(self.name, (), (), float(self.function()))]
+            except Exception:
+                return []
+        with self.lock:
+            return [(self.name, self.labelnames, key, value) for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # The per bucket counts, the sum and the count of each label values.
+        self.values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, totals = self.values.setdefault(
+                key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            totals[0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the duration of the block, in seconds.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[Tuple[str, Sequence[str], LabelValues, float]]:
+        samples = []
+        with self.lock:
+            for key, (counts, totals) in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += count
+                    samples.append((self.name + "_bucket", self.labelnames + ("le",),
+                                    key + (format_value(bound),), cumulative))
+                samples.append((self.name + "_sum", self.labelnames, key, totals[0]))
+                samples.append((self.name + "_count", self.labelnames, key, cumulative))
+        return samples
+
+
+REGISTRY: List[Metric] = []
+
+FUNCTION_SECONDS = Histogram(
+    "function_seconds", "Duration of the functions decorated with timeit.", ["function"])
+RETRIEVAL_SECONDS = Histogram(
+    "retrieval_seconds", "Duration of the retrieval stages, the remote one counting only the wait "
+    "after the local stage.", ["source"])
+RETRIEVED_ABSTRACTS = Counter(
+    "retrieved_abstracts", "Abstracts retrieved, from the local store or the ArXiv API.", ["source"])
+RETRIEVALS = Counter(
+    "retrievals", "Retrievals, by whether the local store satisfied them or they fell back to "
+    "the ArXiv API.", ["outcome"])
+COLLECTION_DOCUMENTS = Gauge(
+    "collection_documents", "Documents in the vector store.")
+SHARD_QUERIES = Counter(
+    "shard_queries", "Queries routed to each shard of the vector store, when sharded.", ["shard"])
+EMBEDDING_SECONDS = Histogram(
+    "embedding_seconds", "Duration of embedding a batch of texts.")
+PROMPT_BUILD_SECONDS = Histogram(
+    "prompt_build_seconds", "Duration of packing the sources and filling the prompt template.")
+PREFILL_SECONDS = Histogram(
+    "lm_prefill_seconds", "Duration of the prefill of a batch, up to its first generated token.")
+DECODE_SECONDS = Histogram(
+    "lm_decode_seconds", "Duration of the decoding of a batch, after its first generated token.")
+TOKENS_PER_SECOND = Histogram(
+    "lm_tokens_per_second", "Tokens decoded per second across a batch.", buckets=RATE_BUCKETS)
+DRAFT_ACCEPTANCE = Histogram(
+    "lm_draft_acceptance_rate", "Fraction of the draft tokens accepted by the main model in an "
+    "assisted generation.", buckets=RATIO_BUCKETS)
+QUEUE_WAIT_SECONDS = Histogram(
+    "queue_wait_seconds", "Time requests waited for an admission slot.")
+QUEUE_DEPTH = Gauge(
+    "queue_depth", "Requests in flight and waiting for an admission slot.", ["state"])
+REJECTED_REQUESTS = Counter(
+    "rejected_requests", "Requests rejected or cancelled by the admission control.", ["reason"])
+CACHE_LOOKUPS = Counter(
+    "cache_lookups", "Lookups of the response cache, by tier and result.", ["tier", "result"])
+CACHE_HIT_RATE = Gauge(
+    "cache_hit_rate", "Fraction of the requests served from the response cache since the start.")
+
+
+def render() -> str:
+    """Render every metric in the Prometheus text exposition format.
+
+    Returns:
+        str: The exposition of the metrics.
+    """
+    config = load_config()
+    const_names = ("mode", "lm")
+    const_values = (config[Constants.RETRIVER][Constants.MODE], config[Constants.GENERATOR][Constants.LM])
+
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(const_names, const_values))
+    return "\n".join(lines) + "\n"
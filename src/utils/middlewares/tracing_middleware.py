@@ -0,0 +1,47 @@
+import re
+import uuid
+from typing import Optional, Tuple
+
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+
+from utils.logger import request_id_var
+from utils.tracing import KIND_SERVER, get_tracer, server_timing
+
+# The W3C trace context header of a caller already tracing the request.
+TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str]]:
+    match = TRACEPARENT.match(header.strip().lower()) if header else None
+    return (match.group(1), match.group(2)) if match else None
+
+
+class TracingMiddleware(BaseHTTPMiddleware):
+    """Runs every request in the root span of its trace, whose id is the X-Request-ID without its
+    dashes unless the caller sent a traceparent to continue its own trace. The stage timings are
+    reported in the Server-Timing header when enabled.
+    """
+
+    async def dispatch(self, request: Request, call_next):
+        tracer = get_tracer()
+        request_id = request_id_var.get()
+        parent = parse_traceparent(request.headers.get("traceparent"))
+        if parent is not None:
+            trace_id, parent_id = parent
+        else:
+            trace_id = uuid.UUID(request_id).hex if request_id != "-" else uuid.uuid4().hex
+            parent_id = None
+
+        with tracer.span(f"{request.method} {request.url.path}", kind=KIND_SERVER,
+                         trace_id=trace_id, parent_id=parent_id, request_id=request_id) as root:
+            response = await call_next(request)
+            if root is not None:
+                root.set_attribute("http.status_code", response.status_code)
+                if tracer.server_timing:
+                    # The stages finished by the time the response starts, and the root span so far.
+                    timings = server_timing(root.trace)
+                    response.headers["Server-Timing"] = (
+                        f"{timings}, total" if timings else "total") + f";dur={root.duration * 1000:.1f}"
+
+        return response
@@ -0,0 +1,107 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+# Taken when the server first imports this module, the startup report measures from here.
+PROCESS_START = time.perf_counter()
+
+# The components loaded in the background.
+EMBEDDING_MODEL = "embedding_model"
+CHROMA = "chroma"
+TOKENIZER = "tokenizer"
+LM = "lm"
+WARMUP = "warmup"
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+READINESS = None
+
+
+class Readiness:
+    """The loading state of the components loaded in the background at startup, reported by the
+    /ready endpoint and logged as a startup time report once every component is done.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.components: Dict[str, Dict[str, Any]] = {}
+        self.reported = False
+
+    def register(self, *names: str) -> None:
+        """Declare the components expected to load, so they are reported as pending until then.
+
+        Args:
+            names (str): The names of the components.
+        """
+        with self.lock:
+            for name in names:
+                self.components.setdefault(name, {"state": PENDING})
+
+    @contextmanager
+    def loading(self, name: str) -> Iterator[None]:
+        """Track the loading of a component over the block.
+
+        Args:
+            name (str): The name of the component.
+        """
+        start = time.perf_counter()
+        with self.lock:
+            self.components[name] = {"state": LOADING}
+
+        try:
+            yield
+        except BaseException as e:
+            self.finish(name, {"state": FAILED, "error": str(e),
+                               "seconds": round(time.perf_counter() - start, 3)})
+            raise
+
+        self.finish(name, {"state": READY, "seconds": round(time.perf_counter() - start, 3),
+                           "since_start": round(time.perf_counter() - PROCESS_START, 3)})
+
+    def finish(self, name: str, status: Dict[str, Any]) -> None:
+        with self.lock:
+            self.components[name] = status
+            done = all(c["state"] in (READY, FAILED) for c in self.components.values())
+            report = done and not self.reported
+            self.reported = self.reported or done
+
+        logger.info(f"Component '{name}' {status['state']} in {status['seconds']}s.")
+        if report:
+            logger.info(f"Startup report: {self.report()}")
+
+    def is_ready(self, names: List[str]) -> bool:
+        with self.lock:
+            return all(self.components.get(name, {}).get("state") == READY for name in names)
+
+    def report(self) -> Dict[str, Any]:
+        """The state of every component and the time since the start of the process.
+
+        Returns:
+            Dict[str, Any]: The components by name and the startup time so far.
+        """
+        with self.lock:
+            return {
+                "components": {name: dict(status) for name, status in self.components.items()},
+                "uptime_seconds": round(time.perf_counter() - PROCESS_START, 3)
+            }
+
+
+def get_readiness() -> Readiness:
+    """Returns the shared readiness tracker.
+
+    Returns:
+        Readiness: The readiness of the components of the server.
+    """
+    global READINESS
+    if READINESS is None:
+        READINESS = Readiness()
+
+    return READINESS
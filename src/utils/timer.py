@@ -1,18 +1,37 @@
-import logging
+import inspect
 import time
 from functools import wraps
 
 from utils.logger import setup_logger
+from utils.metrics import FUNCTION_SECONDS
 
 logger = setup_logger()
 
 
 def timeit(func):
+    """Log the duration of every call of the function and observe it in the function_seconds
+    histogram, measured with the monotonic perf_counter. Coroutine functions are timed until
+    they complete, including when they raise.
+    """
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                FUNCTION_SECONDS.observe(elapsed, function=func.__name__)
+                logger.info(f"{func.__name__} executed in {elapsed:.4f}s")
+        return async_wrapper
+
     @wraps(func)
     def wrapper(*args, **kwargs):
-        start = time.time()
-        result = func(*args, **kwargs)
-        end = time.time()
-        logger.info(f"{func.__name__} executed in {end - start:.4f}s")
-        return result
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            FUNCTION_SECONDS.observe(elapsed, function=func.__name__)
+            logger.info(f"{func.__name__} executed in {elapsed:.4f}s")
     return wrapper
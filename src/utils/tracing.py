@@ -0,0 +1,332 @@
+"""Lightweight span tracing of the stages of a request. Spans follow the OpenTelemetry data model,
+and are exported as OTLP/JSON: appended to a local file, one export request per line, and sent to
+an OTLP/HTTP collector when configured.
+
+The current span is kept in a contextvar, so spans started in the executors, whose tasks copy the
+context, are children of the span that submitted them. Work handed over to the long lived threads
+(the batch scheduler and the persistence writer) carries its parent span along explicitly.
+"""
+import contextvars
+import functools
+import inspect
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import httpx
+
+from utils.config import load_config
+from utils.constants import Constants
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+SERVICE_NAME = "simplicity"
+
+# The OTLP span kinds used.
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+
+STATUS_ERROR = 2
+
+TRACER = None
+
+
+class Trace:
+    """The state shared by the spans of a trace: its id and the durations of its finished spans,
+    for the Server-Timing header of the request.
+    """
+
+    def __init__(self, trace_id: str) -> None:
+        self.trace_id = trace_id
+        self.timings: List[Tuple[str, float]] = []
+
+
+class Span:
+    """A timed operation of a trace, with its attributes and the spans of other traces it is linked to.
+    """
+
+    def __init__(self, name: str, trace: Trace, parent_id: Optional[str] = None,
+                 kind: int = KIND_INTERNAL, attributes: Optional[Dict[str, Any]] = None,
+                 links: Sequence["Span"] = ()) -> None:
+        self.name = name
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.links = [(link.trace.trace_id, link.span_id) for link in links]
+        self.error: Optional[str] = None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+
+    @property
+    def duration(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """The span in the OTLP/JSON encoding.
+
+        Returns:
+            Dict[str, Any]: The encoded span.
+        """
+        span: Dict[str, Any] = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [encode_attribute(key, value) for key, value in self.attributes.items()],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.links:
+            span["links"] = [{"traceId": trace_id, "spanId": span_id}
+                             for trace_id, span_id in self.links]
+        if self.error is not None:
+            span["status"] = {"code": STATUS_ERROR, "message": self.error}
+        return span
+
+
+def encode_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        encoded = {"boolValue": value}
+    elif isinstance(value, int):
+        encoded = {"intValue": str(value)}
+    elif isinstance(value, float):
+        encoded = {"doubleValue": value}
+    else:
+        encoded = {"stringValue": str(value)}
+    return {"key": key, "value": encoded}
+
+
+current_span_var: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar(
+    "current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return current_span_var.get()
+
+
+class Tracer:
+    """Starts the spans and exports the finished ones from a background thread, off the request path.
+    """
+
+    def __init__(self) -> None:
+        trace_config = load_config()[Constants.TRACING]
+        self.enabled = trace_config[Constants.ENABLED]
+        self.path = trace_config[Constants.PATH]
+        self.collector_url = trace_config[Constants.COLLECTOR_URL]
+        self.server_timing = trace_config[Constants.SERVER_TIMING]
+
+        self.finished: "queue.Queue[Optional[Span]]" = queue.Queue(maxsize=10000)
+        self.dropped = 0
+        self.thread: Optional[threading.Thread] = None
+        if self.enabled:
+            if self.path:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.thread = threading.Thread(target=self.export, name="trace-exporter", daemon=True)
+            self.thread.start()
+            logger.info(
+                f"Tracing to {self.path or 'no file'}"
+                f"{f' and {self.collector_url}' if self.collector_url else ''}.")
+
+    @contextmanager
+    def span(self, name: str, kind: int = KIND_INTERNAL, trace_id: Optional[str] = None,
+             parent: Optional[Span] = None, parent_id: Optional[str] = None,
+             links: Sequence[Optional[Span]] = (), **attributes: Any) -> Iterator[Optional[Span]]:
+        """Time the block as a span, the current span for the code it runs.
+
+        Args:
+            name (str): The name of the operation.
+            kind (int): The OTLP span kind.
+            trace_id (Optional[str]): Starts a new trace with this id, for the root spans.
+            parent (Optional[Span]): The parent span, defaults to the current span.
+            parent_id (Optional[str]): The id of a remote parent span of the new trace.
+            links (Sequence[Optional[Span]]): The spans of other traces the operation also serves.
+            attributes (Any): The attributes of the span.
+
+        Yields:
+            Iterator[Optional[Span]]: The span, None if tracing is disabled or there is no trace.
+        """
+        parent = parent or current_span()
+        if not self.enabled or (parent is None and trace_id is None):
+            yield None
+            return
+
+        if trace_id is not None:
+            span = Span(name, Trace(trace_id), parent_id, kind, attributes)
+        else:
+            assert parent is not None
+            span = Span(name, parent.trace, parent.span_id, kind, attributes,
+                        [link for link in links if link is not None])
+
+        token = current_span_var.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            try:
+                current_span_var.reset(token)
+            except ValueError:
+                # Closed from another context, such as an async generator finalized late.
+                current_span_var.set(parent)
+            self.end(span)
+
+    def record(self, name: str, start: float, end: float, **attributes: Any) -> None:
+        """Record an already finished operation as a child of the current span.
+
+        Args:
+            name (str): The name of the operation.
+            start (float): When it started, from time.perf_counter.
+            end (float): When it ended, from time.perf_counter.
+            attributes (Any): The attributes of the span.
+        """
+        parent = current_span()
+        if not self.enabled or parent is None:
+            return
+
+        span = Span(name, parent.trace, parent.span_id, attributes=attributes)
+        # Convert from the monotonic clock to the wall clock of the span.
+        now_ns, now = time.time_ns(), time.perf_counter()
+        span.start_ns = now_ns - int((now - start) * 1e9)
+        span.end_ns = now_ns - int((now - end) * 1e9)
+        self.publish(span)
+
+    def end(self, span: Span) -> None:
+        span.end_ns = time.time_ns()
+        self.publish(span)
+
+    def publish(self, span: Span) -> None:
+        span.trace.timings.append((span.name, span.duration))
+        try:
+            self.finished.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def export(self) -> None:
+        """Write the finished spans in batches until the tracer is closed.
+        """
+        client = httpx.Client(timeout=5) if self.collector_url else None
+        closed = False
+        while not closed:
+            first = self.finished.get()
+            spans = [] if first is None else [first]
+            closed = first is None
+            while len(spans) < 512 and not closed:
+                try:
+                    span = self.finished.get_nowait()
+                except queue.Empty:
+                    break
+                if span is None:
+                    closed = True
+                else:
+                    spans.append(span)
+            if not spans:
+                continue
+
+            payload = {"resourceSpans": [{
+                "resource": {"attributes": [encode_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": SERVICE_NAME},
+                                "spans": [span.to_otlp() for span in spans]}]
+            }]}
+            try:
+                if self.path:
+                    with open(self.path, "a") as f:
+                        f.write(json.dumps(payload) + "\n")
+                if client is not None:
+                    client.post(self.collector_url, json=payload).raise_for_status()
+            except Exception as e:
+                logger.warning(f"Failed to export {len(spans)} spans: {e}")
+
+        if client is not None:
+            client.close()
+
+    def close(self) -> None:
+        """Export the spans finished so far and stop the exporter.
+        """
+        if self.thread is not None:
+            self.finished.put(None)
+            self.thread.join()
+            self.thread = None
+
+
+def get_tracer() -> Tracer:
+    """Returns the shared tracer.
+
+    Returns:
+        Tracer: The tracer configured under tracing.
+    """
+    global TRACER
+    if TRACER is None:
+        TRACER = Tracer()
+
+    return TRACER
+
+
+def span(name: str, **attributes: Any):
+    """Shorthand for a span of the shared tracer, a child of the current span.
+    """
+    return get_tracer().span(name, **attributes)
+
+
+def traced(name: str):
+    """Decorate a function, or a coroutine function, to run in a span of its own.
+
+    Args:
+        name (str): The name of the span.
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def continue_trace(parent: Optional[Span]) -> Iterator[None]:
+    """Make the span the current one over the block, for work handed over to another thread.
+
+    Args:
+        parent (Optional[Span]): The span the work was submitted from.
+    """
+    token = current_span_var.set(parent)
+    try:
+        yield
+    finally:
+        current_span_var.reset(token)
+
+
+def server_timing(trace: Trace) -> str:
+    """The Server-Timing header of the spans of the trace finished so far, summed by name.
+
+    Args:
+        trace (Trace): The trace of the request.
+
+    Returns:
+        str: The value of the header.
+    """
+    totals: Dict[str, float] = {}
+    for name, duration in list(trace.timings):
+        totals[name] = totals.get(name, 0.0) + duration
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())